@@ -1,13 +1,21 @@
 # backend/app/llm_orchestrator.py
 import logging
-from typing import Dict, Optional, Type, List, Any # Type, List, Any 是必要的
+from typing import Dict, Optional, Type, List, Any, AsyncIterator # Type, List, Any 是必要的
 
 from . import config_service, schemas # 从同级或上级导入配置服务和Pydantic schemas
 from .llm_providers import PROVIDER_CLASSES  # 动态导入所有已注册的提供商类
 from .llm_providers.base_llm_provider import BaseLLMProvider, LLMResponse, ContentSafetyException # 导入基础提供商和响应模型
+from .llm_providers.response_cache import LazyEmbeddingClient, SemanticResponseCache
 
 logger = logging.getLogger(__name__)
 
+
+def _load_semantic_cache_embeddings() -> Any:
+    """语义缓存复用向量库服务的本地嵌入模型；延迟导入，未启用语义缓存时不加载 langchain 与模型。"""
+    from .services.vector_store_service import get_embedding_model_faiss
+    return get_embedding_model_faiss()
+
+
 class LLMOrchestrator:
     """
     LLM 提供商编排器。
@@ -44,6 +52,10 @@ class LLMOrchestrator:
         # 键是用户定义的模型ID (user_given_id, 例如 "my-gpt-4o", "local-llama3")
         # 值是对应的 BaseLLMProvider 实例
         self._provider_instances: Dict[str, BaseLLMProvider] = {} #
+        # 语义缓存按提供商标签创建，在该提供商的所有模型实例间共享（条目按模型等参数隔离）；
+        # 嵌入模型由所有语义缓存共用，首次查找时才加载
+        self._semantic_caches: Dict[str, Optional[SemanticResponseCache]] = {}
+        self._semantic_embedding_client = LazyEmbeddingClient(_load_semantic_cache_embeddings)
         
         self._initialized = True
         logger.info("LLMOrchestrator 初始化完成。") #
@@ -57,6 +69,14 @@ class LLMOrchestrator:
         logger.warning(f"在配置中未找到模型ID为 '{model_id}' 的用户定义LLM配置。") #
         return None
 
+    def _get_semantic_cache(self, provider_tag: str, provider_global_config: schemas.LLMProviderConfigSchema) -> Optional[SemanticResponseCache]:
+        """返回该提供商共享的语义缓存；未启用 enable_semantic_cache 时为 None。"""
+        if provider_tag not in self._semantic_caches:
+            self._semantic_caches[provider_tag] = SemanticResponseCache.from_provider_config(provider_global_config, self._semantic_embedding_client)
+            if self._semantic_caches[provider_tag] is not None:
+                logger.info(f"已为提供商 '{provider_tag}' 启用语义响应缓存 (相似度阈值: {provider_global_config.semantic_cache_threshold})。")
+        return self._semantic_caches[provider_tag]
+
     def _create_provider_instance(self, model_config: schemas.UserDefinedLLMConfigSchema) -> Optional[BaseLLMProvider]: #
         """
         根据给定的模型配置，创建并返回一个 LLM 提供商的实例。
@@ -78,10 +98,14 @@ class LLMOrchestrator:
         try:
             logger.info(f"正在为模型 '{model_config.user_given_name}' (ID: {model_config.user_given_id}) 创建提供商 '{ProviderClass.__name__}' 的实例...") #
             
-            # 实例化提供商，传入其需要的特定模型配置和全局提供商配置
+            # 实例化提供商，传入其需要的特定模型配置和全局提供商配置；支持语义缓存的提供商同时注入按配置创建的语义缓存
+            provider_kwargs: Dict[str, Any] = {}
+            if ProviderClass.SUPPORTS_SEMANTIC_CACHE:
+                provider_kwargs["semantic_cache"] = self._get_semantic_cache(provider_tag, provider_global_config)
             provider_instance = ProviderClass( #
                 model_config=model_config, #
-                provider_config=provider_global_config #
+                provider_config=provider_global_config, #
+                **provider_kwargs
             )
             
             # 将新创建的实例存入缓存
@@ -254,6 +278,54 @@ class LLMOrchestrator:
                 error=str(e_generate_general_err) #
             )
 
+    async def generate_stream(
+        self,
+        model_id: Optional[str], # 目标模型的 user_given_id
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式生成：对提供商 `generate_stream` 的封装，边生成边产出。
+        每段增量文本产出 {"text_delta": ...}；结束时产出一个 {"is_final_usage_info": True, ...} 携带 token 用量与完成原因。
+        无法获取提供商时产出 {"error": ...}；生成过程中的异常 (包括内容安全异常) 直接抛给调用方。
+        """
+        kwargs.pop("stream", None) # 流式由本方法本身决定，不再传给提供商
+        requested_model_id_for_log = model_id or self.config.llm_settings.default_model_id or "未指定"
+        try:
+            provider_instance = self.get_llm_provider(model_id)
+        except ValueError as e_get_provider_val_err:
+            error_msg_provider_unavailable = f"无法获取任何可用的LLM提供商 (请求模型ID: {requested_model_id_for_log}): {e_get_provider_val_err}"
+            logger.error(error_msg_provider_unavailable)
+            yield {"error": error_msg_provider_unavailable}
+            return
+
+        async for response_chunk in provider_instance.generate_stream(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            is_json_output=is_json_output,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            llm_override_parameters=llm_override_parameters,
+            **kwargs
+        ):
+            if response_chunk.text:
+                yield {"text_delta": response_chunk.text}
+            # 增量块的 finish_reason 为空；携带完成原因的块 (包括 JSON 模式下一次性返回的完整结果) 同时给出用量
+            if not response_chunk.text or response_chunk.finish_reason is not None:
+                yield {
+                    "is_final_usage_info": True,
+                    "model_id_used": response_chunk.model_id_used,
+                    "prompt_tokens": response_chunk.prompt_tokens,
+                    "completion_tokens": response_chunk.completion_tokens,
+                    "total_tokens": response_chunk.total_tokens,
+                    "finish_reason": response_chunk.finish_reason,
+                }
+
     def get_all_available_model_ids(self) -> List[str]: #
         """
         返回配置中所有已启用且其提供商也已启用的模型ID列表。
@@ -64,6 +64,17 @@ def _discover_providers():
                     exc_info=True
                 )
 
+async def close_shared_provider_clients() -> None:
+    """
+    关闭所有已注册提供商持有的进程级共享客户端（连接池等）。
+    应在应用关闭 (shutdown) 时调用。
+    """
+    for provider_tag, provider_class in PROVIDER_CLASSES.items():
+        try:
+            await provider_class.aclose_shared_clients()
+        except Exception as e:
+            logger.warning(f"关闭提供商 '{provider_tag}' 的共享客户端时出错: {e}")
+
 # 在模块首次被导入时执行发现过程
 _discover_providers()
 
@@ -1,11 +1,18 @@
 # backend/app/llm_providers/base_llm_provider.py
+import asyncio
+import logging
 from abc import ABC, abstractmethod
-from typing import NamedTuple, Optional, Dict, Any, Tuple # Added Tuple for test_connection
+from typing import NamedTuple, Optional, Dict, Any, Tuple, List, AsyncIterator # Added Tuple for test_connection
 
 # 导入 schemas 以便在类型提示中使用
 # 在实际项目中，请确保 app 目录在PYTHONPATH中，或者使用相对导入
 # from .. import schemas # 如果 base_llm_provider.py 在 app/llm_providers/ 目录下
 from app import schemas # 假设 app 是顶级可导入包
+from .provider_utils import AsyncTokenBucket
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GENERATE_MANY_CONCURRENCY = 16 # generate_many 默认同时进行中的 generate() 调用数
 
 
 class LLMResponse(NamedTuple):
@@ -27,6 +34,7 @@ class BaseLLMProvider(ABC):
     它定义了所有提供商必须实现的通用接口。
     """
     PROVIDER_TAG: str = "" # 每个子类都必须定义这个标签
+    SUPPORTS_SEMANTIC_CACHE: bool = False # 构造函数是否接受 semantic_cache 参数（由编排器按配置注入）
 
     def __init__(
         self,
@@ -62,6 +70,99 @@ class BaseLLMProvider(ABC):
         """
         pass
 
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[LLMResponse]:
+        """
+        流式生成。每段增量文本产出一个 LLMResponse（text 为本段增量，token 数为0）；
+        最后产出一个 text 为空的 LLMResponse，携带 finish_reason 与整次调用的 token 用量。
+        默认实现调用 generate() 并把完整结果作为单个增量产出；支持原生流式的子类应重写此方法。
+        """
+        full_response = await self.generate(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters, **kwargs)
+        if full_response.text:
+            yield full_response._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0, finish_reason=None)
+        yield full_response._replace(text="")
+
+    async def _generate_buffered_from_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        llm_override_parameters: Optional[Dict[str, Any]],
+        **kwargs: Any
+    ) -> LLMResponse:
+        """
+        消费 generate_stream 并把增量文本拼接为一个完整的 LLMResponse。
+        供原生流式的子类在调用方通过覆盖参数要求 stream 时使用，generate 的返回类型保持不变。
+        """
+        text_parts: List[str] = []
+        final_chunk: Optional[LLMResponse] = None
+        async for response_chunk in self.generate_stream(prompt, system_prompt, False, temperature, max_tokens, llm_override_parameters, **kwargs):
+            if response_chunk.text:
+                text_parts.append(response_chunk.text)
+            else:
+                final_chunk = response_chunk
+        return LLMResponse(
+            text="".join(text_parts),
+            model_id_used=final_chunk.model_id_used if final_chunk else self.get_user_defined_model_id(),
+            prompt_tokens=final_chunk.prompt_tokens if final_chunk else 0,
+            completion_tokens=final_chunk.completion_tokens if final_chunk else 0,
+            total_tokens=final_chunk.total_tokens if final_chunk else 0,
+            finish_reason=final_chunk.finish_reason if final_chunk else None,
+            error=None
+        )
+
+    async def generate_many(
+        self,
+        prompts: List[str],
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        *,
+        max_concurrency: int = DEFAULT_GENERATE_MANY_CONCURRENCY,
+        rate_limit_per_min: Optional[float] = None
+    ) -> List[LLMResponse]:
+        """
+        为大量相互独立的提示并发调用 generate()，返回顺序与 prompts 一致。
+        同时进行中的调用数不超过 max_concurrency；设置 rate_limit_per_min 时再按令牌桶限制每分钟发起的调用数。
+        单个提示失败不会中断其他提示，失败项以 text 为空、error 为错误信息的 LLMResponse 返回。
+        """
+        concurrency_semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        rate_limiter = AsyncTokenBucket(rate_limit_per_min) if rate_limit_per_min else None
+
+        async def generate_one(prompt: str) -> LLMResponse:
+            async with concurrency_semaphore:
+                if rate_limiter is not None:
+                    await rate_limiter.acquire()
+                return await self.generate(
+                    prompt, system_prompt=system_prompt, is_json_output=is_json_output, temperature=temperature,
+                    max_tokens=max_tokens, llm_override_parameters=llm_override_parameters
+                )
+
+        raw_results = await asyncio.gather(*[generate_one(prompt) for prompt in prompts], return_exceptions=True)
+        results: List[LLMResponse] = []
+        for raw_result in raw_results:
+            if isinstance(raw_result, BaseException):
+                if not isinstance(raw_result, Exception):
+                    raise raw_result # 不吞掉 CancelledError / KeyboardInterrupt 等
+                logger.warning(f"{self.__class__.__name__} (模型: {self.get_user_defined_model_id()}) generate_many 中单个提示失败: {raw_result}")
+                raw_result = LLMResponse(
+                    text="", model_id_used=self.get_user_defined_model_id(), prompt_tokens=0, completion_tokens=0,
+                    total_tokens=0, finish_reason="error", error=str(raw_result)
+                )
+            results.append(raw_result)
+        return results
+
     def get_model_identifier_for_api(self) -> str:
         """
         返回此提供商实例配置的、用于API调用的实际模型标识符。
@@ -81,6 +182,14 @@ class BaseLLMProvider(ABC):
         """
         return self.client is not None
 
+    @classmethod
+    async def aclose_shared_clients(cls) -> None:
+        """
+        关闭此提供商类在进程级共享的客户端资源（例如连接池）。
+        默认无操作；持有共享客户端的子类应重写此方法。应用关闭时统一调用。
+        """
+        return None
+
     @abstractmethod
     async def test_connection(
         self,
@@ -1,8 +1,12 @@
 # backend/app/llm_providers/deepseek_provider.py
+import asyncio
+import hashlib
 import logging
 import os
+import re
+import sys
 import time
-from typing import Dict, Any, Optional, Tuple, List, Union
+from typing import Dict, Any, Optional, Tuple, List, Union, AsyncIterator
 
 # DeepSeek API 通常与 OpenAI API 兼容，因此也使用 openai SDK
 try:
@@ -19,10 +23,35 @@ except ImportError:
     OPENAI_SDK_FOR_DEEPSEEK_AVAILABLE = False
     logging.warning("OpenAI SDK (用于DeepSeekProvider) 未安装。DeepSeekProvider 将不可用。请运行 'pip install openai'")
 
+# httpx 是 openai SDK 的底层传输库；HTTP/2 支持需要额外安装 h2 (pip install 'httpx[http2]')
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    httpx = None # type: ignore
+    HTTPX_AVAILABLE = False
+
+try:
+    import h2 # noqa: F401
+    HTTP2_AVAILABLE = HTTPX_AVAILABLE
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Prometheus 指标为可选依赖；未安装时请求耗时只在 DEBUG 日志中输出
+try:
+    from prometheus_client import Histogram
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    Histogram = None # type: ignore
+    PROMETHEUS_AVAILABLE = False
+
 # 导入新的基类和响应模型
-from .base_llm_provider import BaseLLMProvider, LLMResponse
+from .base_llm_provider import DEFAULT_GENERATE_MANY_CONCURRENCY, BaseLLMProvider, LLMResponse
+from .response_cache import ResponseCache, SemanticResponseCache, build_response_cache_key
+from .provider_utils import AsyncTokenBucket, DynamicBatcher, OrjsonAsyncHTTPClient, compute_backoff_delay, estimate_message_tokens, get_account_rate_limiters, get_retry_after_seconds, json_dumps_bytes, json_loads, settle_token_usage
 # 导入类型化的配置模型和全局配置服务
 from app import schemas, config_service
+from app.services import tokenizer_service
 
 # 从 app.exceptions 导入统一的异常类
 from app.exceptions import (
@@ -38,6 +67,88 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1" # DeepSeek 官方 API 地址
 
+# HTTP/1.1 模式下共享连接池的上限与空闲连接保活时间
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY_SECONDS = 30.0
+# HTTP/2 模式下的连接池上限：每条连接可多路复用上百个并发流，少量连接即可承载大量并发请求
+HTTP2_MAX_CONNECTIONS = 10
+HTTP2_MAX_KEEPALIVE_CONNECTIONS = 10
+
+DEFAULT_MAX_RETRIES = 2 # provider_config.max_retries 未设置时的重试次数
+
+# 进程级共享的 AsyncOpenAI 客户端池，键为 (base_url, api_key 的哈希, 超时, 是否启用HTTP/2)，见 _client_pool_key。
+# 多个指向 DeepSeek 的用户模型配置复用同一个客户端（及其连接池），避免重复的 TLS 握手和文件描述符占用。
+# 客户端统一通过 _get_or_create_pooled_client 获取或创建（检查与插入之间没有 await，不会发生并发插入）；
+# 在协程中创建及关闭时还由 _CLIENT_POOL_LOCK 保护，避免与 aclose_shared_clients 交错。
+_CLIENT_POOL: Dict[Tuple[str, str, Optional[float], bool], "AsyncOpenAI"] = {}
+_CLIENT_POOL_LOCK = asyncio.Lock()
+
+# 主客户端不可用时列出模型所用的持久 httpx 客户端（懒创建，随 aclose_shared_clients 关闭）。
+# 模型列表请求频率很低，只保留少量空闲连接，但避免每次轮询都重新进行 TLS 握手。
+_LISTING_HTTP_CLIENT: Optional["httpx.AsyncClient"] = None
+LISTING_MAX_KEEPALIVE_CONNECTIONS = 2
+LISTING_KEEPALIVE_EXPIRY_SECONDS = 60.0
+
+# 按 (model, status) 统计的请求耗时直方图，p95/p99 可用于调整并发上限与批处理参数
+DEEPSEEK_REQUEST_DURATION_SECONDS = Histogram(
+    "deepseek_request_duration_seconds",
+    "DeepSeek API 请求耗时（秒）",
+    ["model", "status"]
+) if PROMETHEUS_AVAILABLE and Histogram is not None else None
+
+# 模型不支持独立系统提示时，系统提示与用户提示之间的分隔符。
+# 合并后的前缀必须逐字节稳定，DeepSeek 服务端的前缀缓存 (prompt cache) 才能命中。
+MERGED_SYSTEM_PROMPT_SEPARATOR = "\n\n---\n\n用户请求：\n"
+MAX_MERGED_PREFIX_CACHE_ENTRIES = 256
+DEEPSEEK_MAX_OUTPUT_TOKENS = 8192 # DeepSeek chat 接口单次请求允许的最大输出 token 数，限制合并请求可容纳的提示数
+
+# Batch API 相关常量
+BATCH_API_ENDPOINT = "/v1/chat/completions"
+BATCH_API_COMPLETION_WINDOW = "24h"
+BATCH_API_MAX_POLL_INTERVAL_SECONDS = 60.0
+BATCH_API_TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+
+# 表示内容安全拦截的错误码与错误信息关键字
+CONTENT_SAFETY_ERROR_CODES = frozenset({"content_filter", "prompt_blocked"})
+CONTENT_SAFETY_ERROR_KEYWORDS = ("safety policy violation", "content blocked", "unsafe content")
+# 关键字合并为一个预编译的忽略大小写正则，一次扫描即可完成匹配
+CONTENT_SAFETY_ERROR_PATTERN = re.compile("|".join(re.escape(keyword) for keyword in CONTENT_SAFETY_ERROR_KEYWORDS), re.IGNORECASE)
+
+_TOKEN_ENCODER_UNSET = object()
+
+# OpenAI SDK 异常 -> (统一异常类, 错误描述, 日志级别)。按异常类的 MRO 查找，子类 (如 APITimeoutError) 优先于父类匹配。
+# OpenAIBadRequestError 及其余 APIError 需要解析内容安全信息，不在此表中。
+_SDK_ERROR_MAP: Dict[type, Tuple[type, str, int]] = {
+    OpenAIAuthenticationError: (LLMAuthenticationError, "认证失败", logging.ERROR),
+    RateLimitError: (LLMRateLimitError, "速率限制错误", logging.WARNING),
+    APIConnectionError: (LLMConnectionError, "连接错误", logging.WARNING),
+    APITimeoutError: (LLMConnectionError, "超时错误", logging.WARNING),
+} if OPENAI_SDK_FOR_DEEPSEEK_AVAILABLE else {}
+
+# test_connection 使用的 OpenAI SDK 异常 -> (日志描述, 日志级别, 返回的摘要信息, 建议)
+_TEST_CONNECTION_ERROR_MAP: Dict[type, Tuple[str, int, str, str]] = {
+    OpenAIAuthenticationError: ("认证失败", logging.ERROR, "DeepSeek API认证失败。", "请检查您的API密钥是否正确并具有访问模型 {model_id} 的权限。"),
+    RateLimitError: ("遭遇速率限制", logging.WARNING, "DeepSeek API速率限制。", "请稍后再试或检查您的API使用限制。"),
+    APIConnectionError: ("连接或超时错误", logging.ERROR, "无法连接到DeepSeek API或请求超时。", "请检查您的网络连接和DeepSeek服务状态。"),
+} if OPENAI_SDK_FOR_DEEPSEEK_AVAILABLE else {}
+
+
+def _lookup_sdk_error(e: Exception, error_map: Dict[type, Any]) -> Optional[Any]:
+    """沿异常类的 MRO 在映射表中查找第一个匹配项。"""
+    for exception_class in type(e).__mro__:
+        mapped_entry = error_map.get(exception_class)
+        if mapped_entry is not None:
+            return mapped_entry
+    return None
+
+# generate_batch 合并请求时附加在系统提示后的说明，要求模型按编号返回 JSON
+BATCH_MERGE_INSTRUCTION = (
+    "下面给出了 {count} 个相互独立的请求，请分别完成每一个请求，彼此之间不要相互影响。\n"
+    "只输出一个 JSON 对象，格式为：{{\"responses\": [{{\"index\": 1, \"response\": \"对请求1的完整回答\"}}, ...]}}，"
+    "index 与请求编号一一对应，且必须覆盖全部 {count} 个请求。"
+)
+
 # 移除本地定义的 ContentSafetyException
 # class ContentSafetyException(RuntimeError):
 # ... (本地定义已移除)
@@ -49,17 +160,67 @@ class DeepSeekProvider(BaseLLMProvider):
     使用 openai Python 库与 DeepSeek 的 OpenAI 兼容 API 进行交互。
     """
     PROVIDER_TAG = "deepseek"
+    SUPPORTS_SEMANTIC_CACHE = True
+
+    # /models 列表缓存，键为 base_url，值为 (获取时间 monotonic, 模型列表)；DeepSeek 的模型列表很少变化
+    _MODELS_CACHE: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
+    # llm_override_parameters 中允许透传给 DeepSeek API 的参数
+    _VALID_OVERRIDE_KEYS = frozenset({"top_p", "frequency_penalty", "presence_penalty", "stop", "stream", "seed", "logprobs", "top_logprobs"})
 
     def __init__(
         self,
         model_config: schemas.UserDefinedLLMConfigSchema,
-        provider_config: schemas.LLMProviderConfigSchema
+        provider_config: schemas.LLMProviderConfigSchema,
+        semantic_cache: Optional[SemanticResponseCache] = None
     ):
         """
         初始化 DeepSeek API 的客户端。
+        semantic_cache: 可选的语义响应缓存（编排器在 enable_semantic_cache 启用时注入），在精确匹配缓存未命中后使用。
         """
         super().__init__(model_config, provider_config)
 
+        # 确定性调用 (temperature=0) 的精确匹配响应缓存；cache_ttl_seconds 为空或模型配置关闭 enable_response_cache 时禁用
+        self._response_cache: Optional[ResponseCache] = (
+            ResponseCache.from_provider_config(self.provider_config) if self.model_config.enable_response_cache else None
+        )
+        self._semantic_cache: Optional[SemanticResponseCache] = semantic_cache
+
+        # 每次请求都相同的参数与模型信息预先计算好（见 _init_static_request_fields）；全局 llm_settings 按配置版本号缓存
+        self._init_static_request_fields()
+        self._cached_llm_settings: Optional[schemas.LLMSettingsConfigSchema] = None
+        # 从 llm_settings 派生的 (默认温度, 默认最大生成token数)，与 _cached_llm_settings 一同失效
+        self._cached_llm_defaults: Optional[Tuple[float, int]] = None
+        # 配置重载时由 config_service 回调失效缓存，热路径上无需再查询配置版本号
+        config_service.add_config_reload_listener(self._on_config_reload)
+        # system_prompt -> 合并到用户提示前的固定前缀（仅 supports_system_prompt 为 False 时使用）
+        self._merged_prefix_cache: Dict[str, str] = {}
+
+        # 进行中的确定性请求：缓存键 -> 结果 Future，相同请求并发到达时共享同一次 API 调用
+        self._inflight_requests: Dict[str, "asyncio.Future[LLMResponse]"] = {}
+        # 本地 tiktoken 编码器，首次估算 token 时获取（None 表示不可用，回退到字符数估算）
+        self._token_encoder: Any = _TOKEN_ENCODER_UNSET
+
+        # 客户端侧的并发上限，避免大量并发任务同时打满连接池
+        self._request_semaphore = asyncio.Semaphore(self.provider_config.max_concurrent_requests or 32)
+        # RPM/TPM 主动限流器在确定 API 密钥后按账号获取，见 provider_utils.get_account_rate_limiters
+        self._rate_limiter: Optional[AsyncTokenBucket] = None
+        self._token_rate_limiter: Optional[AsyncTokenBucket] = None
+
+        # generate_batch 使用的动态批处理器：窗口内的确定性请求合并为一次 API 调用
+        self._batcher = DynamicBatcher(
+            self._flush_merged_batch,
+            max_batch_size=self.provider_config.max_batch_size,
+            batch_window_ms=self.provider_config.batch_window_ms
+        )
+
+        self._init_client()
+        if not self.is_client_ready():
+            # 客户端不可用时将 generate 替换为直接失败的实现；就绪时 generate 无需在每次调用时检查就绪状态
+            self.generate = self._generate_unready # type: ignore[method-assign]
+
+    def _init_client(self) -> None:
+        """确定 API 密钥与 Base URL，并从共享池获取或创建 AsyncOpenAI 客户端。"""
         if not OPENAI_SDK_FOR_DEEPSEEK_AVAILABLE or AsyncOpenAI is None:
             logger.error("DeepSeekProvider 初始化失败：OpenAI SDK (用于DeepSeek) 不可用。")
             self.client = None
@@ -85,65 +246,179 @@ class DeepSeekProvider(BaseLLMProvider):
 
         base_url_to_use = self.model_config.base_url if self.model_config.base_url is not None else DEFAULT_DEEPSEEK_BASE_URL
 
-        try:
-            client_params: Dict[str, Any] = {
-                "api_key": api_key_to_use,
-                "base_url": base_url_to_use,
-            }
-            if self.provider_config.api_timeout_seconds is not None:
-                client_params["timeout"] = self.provider_config.api_timeout_seconds
-            if self.provider_config.max_retries is not None:
-                client_params["max_retries"] = self.provider_config.max_retries
-            else:
-                client_params["max_retries"] = 1
-
-            self.client: Optional[AsyncOpenAI] = AsyncOpenAI(**client_params)
+        self._rate_limiter, self._token_rate_limiter = get_account_rate_limiters(
+            self.PROVIDER_TAG, base_url_to_use, api_key_to_use, self.provider_config.rate_limit_rpm, self.provider_config.rate_limit_tpm
+        )
 
-            logger.info(f"DeepSeekProvider 客户端 (模型: {self.model_config.user_given_name}) 已成功初始化。Base URL: {base_url_to_use}")
+        try:
+            self.client, reused_pooled_client = self._get_or_create_pooled_client(api_key_to_use, base_url_to_use)
         except Exception as e:
             logger.error(f"DeepSeekProvider 初始化客户端 (模型: {self.model_config.user_given_name}) 失败: {e}", exc_info=True)
             self.client = None
             self._sdk_ready = False
+            return
+        if reused_pooled_client:
+            logger.info(f"DeepSeekProvider 客户端 (模型: {self.model_config.user_given_name}) 复用了共享客户端。Base URL: {base_url_to_use}")
+        else:
+            logger.info(f"DeepSeekProvider 客户端 (模型: {self.model_config.user_given_name}) 已成功初始化。Base URL: {base_url_to_use}")
+
+    def _get_or_create_pooled_client(self, api_key: str, base_url: str) -> Tuple["AsyncOpenAI", bool]:
+        """
+        返回共享池中对应 (base_url, api_key) 的客户端，不存在时创建并放入池中；第二项表示是否复用了已有客户端。
+        检查与插入之间没有 await，不会覆盖（并泄漏）其他协程同时为同一账号创建的客户端。
+        """
+        pool_key = self._client_pool_key(base_url, api_key)
+        pooled_client = _CLIENT_POOL.get(pool_key)
+        if pooled_client is not None:
+            return pooled_client, True
+        pooled_client = self._create_client(api_key, base_url)
+        _CLIENT_POOL[pool_key] = pooled_client
+        return pooled_client, False
+
+    def _client_pool_key(self, base_url: str, api_key: str) -> Tuple[str, str, Optional[float], bool]:
+        """共享客户端池的键：客户端构造参数相同的配置才共享。密钥以哈希形式参与，不直接作为字典键保存。"""
+        api_key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        return (base_url, api_key_hash, self.provider_config.api_timeout_seconds, self._use_http2())
+
+    def _use_http2(self) -> bool:
+        """enable_http2 未显式关闭且已安装 h2 时使用 HTTP/2。"""
+        return self.provider_config.enable_http2 is not False and HTTP2_AVAILABLE
+
+    def _estimate_prompt_tokens(self, api_params: Dict[str, Any]) -> int:
+        """
+        估算请求消息的提示 token 数（见 provider_utils.estimate_message_tokens）。
+        编码器在首次使用时获取（tiktoken 首次加载编码可能需要下载词表），之后复用。
+        """
+        if self._token_encoder is _TOKEN_ENCODER_UNSET:
+            self._token_encoder = tokenizer_service.get_tiktoken_encoding_for_model(self._model_api_id)
+        return estimate_message_tokens(self._token_encoder, api_params.get("messages", ()), self._log_prefix)
+
+    def _with_estimated_prompt_tokens(self, translated_error: Exception, api_params: Dict[str, Any]) -> Exception:
+        """请求未返回 usage 时，在内容安全异常的 details 中附上本地估算的提示 token 数。"""
+        if isinstance(translated_error, GlobalContentSafetyException) and not translated_error.prompt_tokens:
+            if isinstance(translated_error.safety_details, dict):
+                translated_error.safety_details.setdefault("estimated_prompt_tokens", self._estimate_prompt_tokens(api_params))
+        return translated_error
+
+    def _create_client(self, api_key: str, base_url: str) -> "AsyncOpenAI":
+        """根据提供商配置构造一个新的 AsyncOpenAI 客户端。"""
+        client_params: Dict[str, Any] = {
+            "api_key": api_key,
+            "base_url": base_url,
+        }
+        if self.provider_config.api_timeout_seconds is not None:
+            client_params["timeout"] = self.provider_config.api_timeout_seconds
+        # 重试由 _create_chat_completion 统一负责（带抖动并遵守 Retry-After），关闭 SDK 内置的重试以免叠加
+        client_params["max_retries"] = 0
+
+        if self._use_http2():
+            # 并发的 generate() 请求通过同一条 TCP+TLS 连接多路复用，避免每个请求占用独立连接
+            client_params["http_client"] = OrjsonAsyncHTTPClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=HTTP2_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP2_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+                ),
+                timeout=self.provider_config.api_timeout_seconds
+            )
+        else:
+            if self.provider_config.enable_http2 is True:
+                logger.warning(f"DeepSeekProvider (模型: {self.model_config.user_given_name}): 配置启用了 HTTP/2，但未安装 h2。将回退到 HTTP/1.1。请运行 'pip install \"httpx[http2]\"'")
+            if HTTPX_AVAILABLE and httpx is not None:
+                # 显式设置共享连接池的上限，而不是依赖 SDK 默认值
+                client_params["http_client"] = OrjsonAsyncHTTPClient(
+                    limits=httpx.Limits(
+                        max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+                    ),
+                    timeout=self.provider_config.api_timeout_seconds
+                )
+
+        return AsyncOpenAI(**client_params)
 
     def is_client_ready(self) -> bool:
         return bool(self._sdk_ready and self.client is not None)
 
-    async def generate(
-        self,
-        prompt: str,
-        system_prompt: Optional[str] = None,
-        is_json_output: bool = False,
-        temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None,
-        llm_override_parameters: Optional[Dict[str, Any]] = None,
-        **kwargs: Any
-    ) -> LLMResponse:
-        if not self.is_client_ready() or self.client is None:
-            logger.error(f"DeepSeekProvider (模型: {self.model_config.user_given_name}) 错误：客户端未初始化。")
-            raise LLMConnectionError("DeepSeek客户端未初始化或未就绪", provider=self.PROVIDER_TAG)
+    def _on_config_reload(self) -> None:
+        self._cached_llm_settings = None
+        self._cached_llm_defaults = None
 
-        final_system_prompt = system_prompt
-        
-        messages: List[Dict[str, str]] = []
-        user_prompt_content = prompt
+    def _get_llm_settings(self) -> schemas.LLMSettingsConfigSchema:
+        """返回全局 llm_settings；缓存由配置重载回调 _on_config_reload 清除后才重新读取。"""
+        if self._cached_llm_settings is None:
+            self._cached_llm_settings = config_service.get_config().llm_settings
+        return self._cached_llm_settings
+
+    def _get_llm_defaults(self) -> Tuple[float, int]:
+        """返回 (default_temperature, default_max_completion_tokens)，热路径上无需再访问配置对象。"""
+        if self._cached_llm_defaults is None:
+            global_llm_settings = self._get_llm_settings()
+            self._cached_llm_defaults = (
+                global_llm_settings.default_temperature,
+                global_llm_settings.default_max_completion_tokens or 4096 # DeepSeek-chat default context is 16k, completion can be less
+            )
+        return self._cached_llm_defaults
+
+    @classmethod
+    async def aclose_shared_clients(cls) -> None:
+        """关闭进程级共享池中的所有 DeepSeek 客户端及模型列表客户端（在应用关闭时调用）。"""
+        global _LISTING_HTTP_CLIENT
+        async with _CLIENT_POOL_LOCK:
+            pooled_clients = list(_CLIENT_POOL.values())
+            _CLIENT_POOL.clear()
+            for pooled_client in pooled_clients:
+                try:
+                    await pooled_client.close()
+                except Exception as e_close:
+                    logger.warning(f"关闭共享 DeepSeek 客户端时出错: {e_close}")
+            listing_client, _LISTING_HTTP_CLIENT = _LISTING_HTTP_CLIENT, None
+            if listing_client is not None:
+                try:
+                    await listing_client.aclose()
+                except Exception as e_close:
+                    logger.warning(f"关闭 DeepSeek 模型列表客户端时出错: {e_close}")
 
-        if final_system_prompt and self.model_config.supports_system_prompt:
-            messages.append({"role": "system", "content": final_system_prompt})
-        elif final_system_prompt:
+    def _get_merged_prefix(self, system_prompt: str) -> str:
+        """返回系统提示合并到用户提示时使用的前缀；同一系统提示总是得到同一个（驻留的）字符串。"""
+        merged_prefix = self._merged_prefix_cache.get(system_prompt)
+        if merged_prefix is None:
             logger.warning(
                 f"模型 '{self.model_config.user_given_name}' 配置为不支持独立系统提示，"
                 f"但调用时提供了系统提示。将尝试将其合并到用户提示中。"
             )
-            user_prompt_content = final_system_prompt + "\n\n---\n\n用户请求：\n" + prompt
-        
-        messages.append({"role": "user", "content": user_prompt_content})
+            merged_prefix = sys.intern(system_prompt.rstrip() + MERGED_SYSTEM_PROMPT_SEPARATOR)
+            if len(self._merged_prefix_cache) < MAX_MERGED_PREFIX_CACHE_ENTRIES:
+                self._merged_prefix_cache[system_prompt] = merged_prefix
+        return merged_prefix
 
-        global_llm_settings = config_service.get_config().llm_settings
+    def _build_api_params(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        is_json_output: bool,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        llm_override_parameters: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """构造 chat.completions.create 的请求参数（generate 与 generate_stream 共用）。"""
+        messages: List[Dict[str, str]]
+        if not system_prompt:
+            messages = [{"role": "user", "content": prompt}]
+        elif self._supports_system:
+            messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}]
+        else:
+            # 不变的系统提示放在最前，随调用变化的用户提示放在最后，以便命中服务端前缀缓存；
+            # 前缀已缓存，只需一次拼接即可得到最终字符串
+            messages = [{"role": "user", "content": self._get_merged_prefix(system_prompt) + prompt}]
+
+        default_temperature, default_max_completion_tokens = self._get_llm_defaults()
         
         api_params: Dict[str, Any] = {
-            "model": self.get_model_identifier_for_api(),
+            **self._base_api_params,
             "messages": messages,
-            "temperature": temperature if temperature is not None else global_llm_settings.default_temperature,
+            "temperature": temperature if temperature is not None else default_temperature,
         }
 
         effective_max_tokens = max_tokens
@@ -153,92 +428,45 @@ class DeepSeekProvider(BaseLLMProvider):
             effective_max_tokens = llm_override_parameters.get("max_output_tokens")
         
         if not effective_max_tokens :
-            effective_max_tokens = global_llm_settings.default_max_completion_tokens or 4096 # DeepSeek-chat default context is 16k, completion can be less
+            effective_max_tokens = default_max_completion_tokens
         
         api_params["max_tokens"] = int(effective_max_tokens)
 
         if is_json_output:
             # DeepSeek API (OpenAI compatible) supports response_format for JSON mode
             api_params["response_format"] = {"type": "json_object"}
-            logger.debug(f"为DeepSeek模型 '{self.get_model_identifier_for_api()}' 启用了JSON输出模式。")
+            logger.debug("为DeepSeek模型 '%s' 启用了JSON输出模式。", self._model_api_id)
 
 
         if llm_override_parameters:
-            valid_deepseek_params = ["top_p", "frequency_penalty", "presence_penalty", "stop", "stream", "seed", "logprobs", "top_logprobs"]
-            filtered_llm_params = {k: v for k, v in llm_override_parameters.items() if k in valid_deepseek_params and v is not None}
-            api_params.update(filtered_llm_params)
-        
-        log_prefix = f"[DeepSeekProvider(Model:'{self.get_user_defined_model_id()}')]"
-        logger.debug(f"{log_prefix} 请求参数 (部分): messages_count={len(messages)}, other_params_keys={list(set(api_params.keys()) - {'model', 'messages'})}")
-
-        prompt_tokens_for_safety_exc = 0
-        completion_tokens_for_safety_exc = 0
-
-        try:
-            start_time_ns = time.perf_counter_ns()
-            response = await self.client.chat.completions.create(**api_params) # type: ignore[arg-type]
-            duration_ms = (time.perf_counter_ns() - start_time_ns) / 1_000_000
-            logger.debug(f"{log_prefix} API 调用耗时: {duration_ms:.2f}ms")
-
-            if not response.choices or not response.choices[0].message or response.choices[0].message.content is None:
-                logger.warning(f"{log_prefix} DeepSeek API 响应中 choices[0].message.content 为空或不存在。响应: {response.model_dump_json(indent=2)}")
-                # 检查是否为内容安全过滤
-                if response.choices and response.choices[0].finish_reason == "content_filter":
-                    logger.error(f"{log_prefix} DeepSeek 内容过滤器触发。")
-                    raise GlobalContentSafetyException(
-                        message="DeepSeek API 因内容过滤阻止了响应 (finish_reason: content_filter)。",
-                        provider=self.PROVIDER_TAG, model_id=self.get_user_defined_model_id(),
-                        details={"finish_reason": response.choices[0].finish_reason, "response_dump": response.model_dump(exclude_none=True)},
-                        prompt_tokens=response.usage.prompt_tokens if response.usage else 0,
-                        completion_tokens=response.usage.completion_tokens if response.usage else 0,
-                        total_tokens=response.usage.total_tokens if response.usage else 0,
-                        finish_reason=response.choices[0].finish_reason
-                    )
-                raise LLMAPIError("DeepSeek API 响应内容为空。", provider=self.PROVIDER_TAG)
-
-
-            generated_text = response.choices[0].message.content
-            
-            token_usage_info = response.usage
-            if token_usage_info:
-                prompt_tokens_for_safety_exc = token_usage_info.prompt_tokens
-                completion_tokens_for_safety_exc = token_usage_info.completion_tokens
-            
-            return LLMResponse(
-                text=generated_text,
-                model_id_used=self.get_user_defined_model_id(), 
-                prompt_tokens=token_usage_info.prompt_tokens if token_usage_info else 0,
-                completion_tokens=token_usage_info.completion_tokens if token_usage_info else 0,
-                total_tokens=token_usage_info.total_tokens if token_usage_info else 0,
-                finish_reason=response.choices[0].finish_reason,
-                error=None
+            api_params.update(
+                (k, llm_override_parameters[k])
+                for k in self._VALID_OVERRIDE_KEYS & llm_override_parameters.keys()
+                if llm_override_parameters[k] is not None
             )
-        # Map OpenAI SDK exceptions to custom LLM exceptions
-        except OpenAIAuthenticationError as e:
-            error_message = f"DeepSeek API 认证失败: {e.message if hasattr(e, 'message') else str(e)}"
-            logger.error(f"{log_prefix} {error_message}", exc_info=False)
-            raise LLMAuthenticationError(error_message, provider=self.PROVIDER_TAG) from e
-        except RateLimitError as e:
-            error_message = f"DeepSeek API 速率限制错误: {e.message if hasattr(e, 'message') else str(e)}"
-            logger.warning(f"{log_prefix} {error_message}")
-            raise LLMRateLimitError(error_message, provider=self.PROVIDER_TAG) from e
-        except APIConnectionError as e:
-            error_message = f"DeepSeek API 连接错误: {e.message if hasattr(e, 'message') else str(e)}"
-            logger.warning(f"{log_prefix} {error_message}")
-            raise LLMConnectionError(error_message, provider=self.PROVIDER_TAG) from e
-        except APITimeoutError as e:
-            error_message = f"DeepSeek API 超时错误: {e.message if hasattr(e, 'message') else str(e)}"
-            logger.warning(f"{log_prefix} {error_message}")
-            raise LLMConnectionError(error_message, provider=self.PROVIDER_TAG) from e
-        except OpenAIBadRequestError as e: # Catches 400 errors from OpenAI SDK
+        return api_params
+
+    def _translate_api_error(
+        self,
+        e: Exception,
+        log_prefix: str,
+        prompt_tokens_for_safety_exc: int = 0,
+        completion_tokens_for_safety_exc: int = 0
+    ) -> Exception:
+        """将 OpenAI SDK 抛出的异常映射为统一的 LLM 异常；已是统一异常的直接返回。"""
+        if isinstance(e, LLMAPIError):
+            return e
+        mapped_error = _lookup_sdk_error(e, _SDK_ERROR_MAP)
+        if mapped_error is not None:
+            mapped_exception_class, error_label, log_level = mapped_error
+            error_message = f"DeepSeek API {error_label}: {e.message if hasattr(e, 'message') else str(e)}"
+            logger.log(log_level, f"{log_prefix} {error_message}")
+            return mapped_exception_class(error_message, provider=self.PROVIDER_TAG)
+        if isinstance(e, OpenAIBadRequestError): # Catches 400 errors from OpenAI SDK
             error_text = e.message if hasattr(e, 'message') and e.message else str(e)
             error_code_val = getattr(e, 'code', None)
             # DeepSeek might use 'content_filter' or similar codes if it's OpenAI-compatible
-            is_safety_error = False
-            if error_code_val == 'content_filter':
-                is_safety_error = True
-            elif any(keyword in error_text.lower() for keyword in ["safety policy violation", "content blocked", "unsafe content"]):
-                is_safety_error = True
+            is_safety_error = error_code_val in CONTENT_SAFETY_ERROR_CODES or CONTENT_SAFETY_ERROR_PATTERN.search(error_text) is not None
             
             if is_safety_error:
                 logger.error(f"{log_prefix} DeepSeek API 错误指示内容安全问题 (Code: {error_code_val})。")
@@ -252,30 +480,558 @@ class DeepSeekProvider(BaseLLMProvider):
                 # and depends on the exact error structure DeepSeek returns.
                 # This is a placeholder for potential future implementation if DeepSeek provides such details in errors.
 
-                raise GlobalContentSafetyException(
+                return GlobalContentSafetyException(
                     message=error_text,
-                    provider=self.PROVIDER_TAG, model_id=self.get_user_defined_model_id(),
+                    provider=self.PROVIDER_TAG, model_id=self._user_model_id,
                     details={"http_status": e.status_code, "code": error_code_val, "body": getattr(e, 'body', None)},
                     prompt_tokens=prompt_tokens_for_safety_exc, # Use tokens accumulated before error
                     completion_tokens=completion_tokens_for_safety_exc,
                     total_tokens=prompt_tokens_for_safety_exc + completion_tokens_for_safety_exc,
                     finish_reason=finish_reason_from_err
-                ) from e
+                )
             else: # Other 400 Bad Request errors
                 error_message_full = f"DeepSeek API 请求无效 (HTTP Status: {e.status_code}, Code: {error_code_val}): {error_text}"
                 logger.error(f"{log_prefix} {error_message_full}", exc_info=False)
-                raise LLMAPIError(error_message_full, provider=self.PROVIDER_TAG) from e
-        except OpenAIAPIError as e: # Catch other OpenAI SDK API errors
+                return LLMAPIError(error_message_full, provider=self.PROVIDER_TAG)
+        if isinstance(e, OpenAIAPIError): # Catch other OpenAI SDK API errors
             error_text = e.message if hasattr(e, 'message') and e.message else str(e)
             error_code_val = getattr(e, 'code', None)
+            if error_code_val in CONTENT_SAFETY_ERROR_CODES:
+                # 非 400 状态码返回的安全拦截同样转换为 ContentSafetyException，以便调用方不再重试
+                logger.error(f"{log_prefix} DeepSeek API 错误指示内容安全问题 (HTTP Status: {getattr(e, 'status_code', None)}, Code: {error_code_val})。")
+                return GlobalContentSafetyException(
+                    message=error_text,
+                    provider=self.PROVIDER_TAG, model_id=self._user_model_id,
+                    details={"http_status": getattr(e, 'status_code', None), "code": error_code_val, "body": getattr(e, 'body', None)},
+                    prompt_tokens=prompt_tokens_for_safety_exc,
+                    completion_tokens=completion_tokens_for_safety_exc,
+                    total_tokens=prompt_tokens_for_safety_exc + completion_tokens_for_safety_exc,
+                    finish_reason="content_filter"
+                )
             error_message_full = f"DeepSeek API 通用错误 (HTTP Status: {e.status_code}, Code: {error_code_val}): {error_text}"
             logger.error(f"{log_prefix} {error_message_full}", exc_info=False)
-            raise LLMAPIError(error_message_full, provider=self.PROVIDER_TAG) from e
-        except Exception as e_generate_unknown:
-            logger.error(f"{log_prefix} 调用 DeepSeek API generate 时发生未知错误: {e_generate_unknown}", exc_info=True)
-            raise LLMAPIError(f"调用 DeepSeek 模型时发生未知错误: {str(e_generate_unknown)}", provider=self.PROVIDER_TAG) from e_generate_unknown
+            return LLMAPIError(error_message_full, provider=self.PROVIDER_TAG)
+        logger.error(f"{log_prefix} 调用 DeepSeek API 时发生未知错误: {e}", exc_info=True)
+        return LLMAPIError(f"调用 DeepSeek 模型时发生未知错误: {str(e)}", provider=self.PROVIDER_TAG)
 
-    def get_model_capabilities(self) -> Dict[str, Any]:
+    def _start_request_timer(self) -> Optional[float]:
+        """仅在需要记录耗时（已配置 Prometheus 或开启 DEBUG 日志）时返回起始时间。"""
+        if DEEPSEEK_REQUEST_DURATION_SECONDS is not None or logger.isEnabledFor(logging.DEBUG):
+            return time.monotonic()
+        return None
+
+    def _observe_request_duration(self, start_time: Optional[float], status: str, log_prefix: str) -> None:
+        if start_time is None:
+            return
+        elapsed_seconds = time.monotonic() - start_time
+        if DEEPSEEK_REQUEST_DURATION_SECONDS is not None:
+            DEEPSEEK_REQUEST_DURATION_SECONDS.labels(model=self._model_api_id, status=status).observe(elapsed_seconds)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s API 调用耗时: %.2fms (状态: %s)", log_prefix, elapsed_seconds * 1000, status)
+
+    @staticmethod
+    def _is_retryable_error(e: Exception) -> bool:
+        """429、连接/超时错误以及 5xx 服务端错误可以重试；内容安全等 4xx 错误重试无意义。"""
+        if isinstance(e, (RateLimitError, APIConnectionError)): # APITimeoutError 是 APIConnectionError 的子类
+            return True
+        status_code = getattr(e, "status_code", None)
+        return isinstance(e, OpenAIAPIError) and isinstance(status_code, int) and status_code >= 500
+
+    async def _create_chat_completion(self, api_params: Dict[str, Any], log_prefix: str, reserved_tokens: Optional[int] = None) -> Any:
+        """
+        在并发信号量和限流器的保护下调用 chat.completions.create。
+        发送前按 RPM/TPM 令牌桶主动等待，尽量不触发服务端 429 而浪费一次往返。
+        TPM 令牌桶发送前只预留提示 token（reserved_tokens，为空时本地估算），非流式响应返回后按 usage 结算实际用量；
+        流式调用由调用方在读到最后的 usage 后调用 settle_token_usage 结算。
+        请求失败时退还本次预留的 TPM 令牌（否则每次重试都重复预留，错误风暴会耗尽整个账号共享的额度）；
+        429 时再清空 RPM/TPM 令牌桶，使后续请求按补充速率等待，与服务端额度保持同步。
+        对可重试的错误按带抖动的指数退避重试（429 时至少等待 Retry-After），最多 provider_config.max_retries 次；
+        等待期间不占用并发名额。
+        """
+        max_request_retries = self.provider_config.max_retries if self.provider_config.max_retries is not None else DEFAULT_MAX_RETRIES
+        if reserved_tokens is None:
+            reserved_tokens = self._estimate_prompt_tokens(api_params) if self._token_rate_limiter is not None else 0
+        attempt = 0
+        while True:
+            tokens_reserved = False
+            try:
+                async with self._request_semaphore:
+                    if self._rate_limiter is not None:
+                        await self._rate_limiter.acquire()
+                    if self._token_rate_limiter is not None:
+                        await self._token_rate_limiter.acquire(reserved_tokens)
+                        tokens_reserved = True
+                    response = await self.client.chat.completions.create(**api_params) # type: ignore[union-attr]
+                if not api_params.get("stream"):
+                    response_usage = getattr(response, "usage", None)
+                    settle_token_usage(self._token_rate_limiter, reserved_tokens, response_usage.total_tokens if response_usage else 0)
+                return response
+            except Exception as e_request:
+                if tokens_reserved:
+                    self._token_rate_limiter.charge(-reserved_tokens) # type: ignore[union-attr]
+                if RateLimitError is not None and isinstance(e_request, RateLimitError):
+                    for rate_limiter in (self._rate_limiter, self._token_rate_limiter):
+                        if rate_limiter is not None:
+                            rate_limiter.drain()
+                if attempt >= max_request_retries or not self._is_retryable_error(e_request):
+                    raise
+                retry_delay = compute_backoff_delay(attempt, retry_after=get_retry_after_seconds(e_request))
+                attempt += 1
+                logger.warning(f"{log_prefix} 请求失败 ({type(e_request).__name__})，{retry_delay:.2f}秒后进行第 {attempt}/{max_request_retries} 次重试。")
+                await asyncio.sleep(retry_delay)
+
+    async def generate(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> LLMResponse:
+        # 客户端就绪检查在初始化时完成：未就绪的实例上 generate 已被替换为 _generate_unready
+        api_params = self._build_api_params(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters)
+        if api_params.pop("stream", False) and not is_json_output:
+            # 调用方通过覆盖参数要求流式：在内部消费流并组装为完整的 LLMResponse，返回类型保持不变
+            return await self._generate_buffered_from_stream(prompt, system_prompt, temperature, max_tokens, llm_override_parameters, **kwargs)
+        
+        log_prefix = self._log_prefix
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s 请求参数 (部分): messages_count=%d, other_params_keys=%s", log_prefix, len(api_params["messages"]), api_params.keys() - {"model", "messages"})
+
+        # 仅缓存确定性的非流式调用：相同的 (model, messages, temperature, max_tokens, response_format) 必然得到可复用的结果
+        is_deterministic_call = api_params["temperature"] == 0 and "stream" not in api_params
+        cache_key: Optional[str] = None
+        if self._response_cache is not None and is_deterministic_call:
+            cache_key = build_response_cache_key(api_params)
+            cached_response = await self._response_cache.get(cache_key)
+            if cached_response is not None:
+                logger.debug("%s 命中响应缓存。缓存统计: %s", log_prefix, self._response_cache.stats)
+                # 缓存命中没有产生新的 token 消耗
+                return cached_response._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+        # 精确匹配未命中时，再在同一 (模型, 系统提示, 生成参数) 范围内按用户提示的语义相似度查找（JSON 输出对措辞敏感，不参与语义缓存）
+        semantic_scope: Optional[str] = None
+        semantic_vector: Optional[Any] = None
+        if self._semantic_cache is not None and is_deterministic_call and not is_json_output:
+            semantic_hit, semantic_scope, semantic_vector = await self._semantic_cache.lookup_prompt(api_params, system_prompt, prompt, self.provider_config.semantic_cache_threshold)
+            if semantic_hit is not None:
+                logger.debug("%s 命中语义缓存。缓存统计: %s", log_prefix, self._semantic_cache.stats)
+                return semantic_hit._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+        if not is_deterministic_call:
+            return await self._request_completion(api_params, log_prefix, cache_key, semantic_scope, semantic_vector)
+
+        # 单飞合并：相同的确定性请求正在进行时，等待其结果而不是再发起一次 API 调用
+        inflight_key = cache_key or build_response_cache_key(api_params)
+        inflight_future = self._inflight_requests.get(inflight_key)
+        if inflight_future is not None:
+            try:
+                shared_response = await asyncio.shield(inflight_future)
+            except asyncio.CancelledError:
+                if not inflight_future.cancelled():
+                    raise
+                # 发起请求的调用方被取消，由当前调用方自行请求
+            else:
+                logger.debug("%s 合并到进行中的相同请求。", log_prefix)
+                return shared_response._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+        inflight_future = asyncio.get_running_loop().create_future()
+        # 没有等待者时也标记异常已被读取，避免 "Future exception was never retrieved" 警告
+        inflight_future.add_done_callback(lambda done_future: done_future.cancelled() or done_future.exception())
+        self._inflight_requests[inflight_key] = inflight_future
+        try:
+            llm_response = await self._request_completion(api_params, log_prefix, cache_key, semantic_scope, semantic_vector)
+        except Exception as e_inflight:
+            inflight_future.set_exception(e_inflight)
+            raise
+        except BaseException:
+            inflight_future.cancel()
+            raise
+        else:
+            inflight_future.set_result(llm_response)
+            return llm_response
+        finally:
+            if self._inflight_requests.get(inflight_key) is inflight_future:
+                del self._inflight_requests[inflight_key]
+
+    async def _generate_unready(self, *args: Any, **kwargs: Any) -> LLMResponse:
+        logger.error(f"DeepSeekProvider (模型: {self.model_config.user_given_name}) 错误：客户端未初始化。")
+        raise LLMConnectionError("DeepSeek客户端未初始化或未就绪", provider=self.PROVIDER_TAG)
+
+    async def _request_completion(
+        self,
+        api_params: Dict[str, Any],
+        log_prefix: str,
+        cache_key: Optional[str],
+        semantic_scope: Optional[str],
+        semantic_vector: Optional[Any]
+    ) -> LLMResponse:
+        """发起一次 chat.completions 请求，转换为 LLMResponse 并写入已启用的缓存。"""
+        prompt_tokens_for_safety_exc = 0
+        completion_tokens_for_safety_exc = 0
+
+        try:
+            request_start_time = self._start_request_timer()
+            try:
+                response = await self._create_chat_completion(api_params, log_prefix)
+            except Exception as e_request:
+                self._observe_request_duration(request_start_time, type(e_request).__name__, log_prefix)
+                raise
+            self._observe_request_duration(request_start_time, "success", log_prefix)
+
+            first_choice = response.choices[0] if response.choices else None
+            token_usage_info = response.usage
+
+            # 内容过滤无论是否已生成部分内容都直接抛出 ContentSafetyException，部分输出放在 details 中供调用方取用，
+            # 编排器据此跳过重试，避免对同一提示重复计费
+            if first_choice is not None and first_choice.finish_reason == "content_filter":
+                partial_text = first_choice.message.content if first_choice.message else None
+                logger.error(f"{log_prefix} DeepSeek 内容过滤器触发 (部分输出长度: {len(partial_text or '')})。")
+                # 完整响应的序列化开销较大且与 partial_text 重复，仅在 DEBUG 级别输出；details 中只保留响应ID
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("%s 内容过滤响应详情: %s", log_prefix, response.model_dump_json(exclude_none=True))
+                raise GlobalContentSafetyException(
+                    message="DeepSeek API 因内容过滤阻止了响应 (finish_reason: content_filter)。",
+                    provider=self.PROVIDER_TAG, model_id=self._user_model_id,
+                    details={"finish_reason": first_choice.finish_reason, "partial_text": partial_text, "response_id": response.id},
+                    prompt_tokens=token_usage_info.prompt_tokens if token_usage_info else 0,
+                    completion_tokens=token_usage_info.completion_tokens if token_usage_info else 0,
+                    total_tokens=token_usage_info.total_tokens if token_usage_info else 0,
+                    finish_reason=first_choice.finish_reason
+                )
+
+            if first_choice is None or not first_choice.message or first_choice.message.content is None:
+                # 只记录响应ID和choices数量；完整响应的序列化开销较大，仅在 DEBUG 级别输出
+                logger.warning(f"{log_prefix} DeepSeek API 响应中 choices[0].message.content 为空或不存在。响应ID: {response.id}, choices数量: {len(response.choices or [])}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("%s 空内容响应详情: %s", log_prefix, response.model_dump_json())
+                raise LLMAPIError("DeepSeek API 响应内容为空。", provider=self.PROVIDER_TAG)
+
+
+            if token_usage_info:
+                prompt_tokens_for_safety_exc = token_usage_info.prompt_tokens
+                completion_tokens_for_safety_exc = token_usage_info.completion_tokens
+                # DeepSeek 在 usage 中返回服务端前缀缓存的命中情况
+                prompt_cache_hit_tokens = getattr(token_usage_info, "prompt_cache_hit_tokens", None)
+                if prompt_cache_hit_tokens is not None:
+                    logger.debug("%s 前缀缓存命中 %s/%s 个提示 token。", log_prefix, prompt_cache_hit_tokens, token_usage_info.prompt_tokens)
+            
+            llm_response = LLMResponse(
+                text=first_choice.message.content,
+                model_id_used=self._user_model_id,
+                prompt_tokens=token_usage_info.prompt_tokens if token_usage_info else 0,
+                completion_tokens=token_usage_info.completion_tokens if token_usage_info else 0,
+                total_tokens=token_usage_info.total_tokens if token_usage_info else 0,
+                finish_reason=first_choice.finish_reason,
+                error=None
+            )
+            if cache_key is not None and self._response_cache is not None:
+                await self._response_cache.set(cache_key, llm_response)
+            if semantic_vector is not None and semantic_scope is not None and self._semantic_cache is not None:
+                self._semantic_cache.store(semantic_scope, semantic_vector, llm_response)
+            return llm_response
+        except Exception as e:
+            raise self._with_estimated_prompt_tokens(
+                self._translate_api_error(e, log_prefix, prompt_tokens_for_safety_exc, completion_tokens_for_safety_exc), api_params
+            ) from e
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[LLMResponse]:
+        """
+        流式生成。每收到一段增量文本即产出一个 LLMResponse（text 为本段增量）；
+        最后产出一个 text 为空的 LLMResponse，携带 finish_reason 与整次调用的 token 用量。
+        JSON 输出模式需要完整响应才能解析，此时退化为一次 generate() 调用并产出其完整结果。
+        """
+        if is_json_output:
+            yield await self.generate(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters, **kwargs)
+            return
+
+        if not self.is_client_ready() or self.client is None:
+            logger.error(f"DeepSeekProvider (模型: {self.model_config.user_given_name}) 错误：客户端未初始化。")
+            raise LLMConnectionError("DeepSeek客户端未初始化或未就绪", provider=self.PROVIDER_TAG)
+
+        api_params = self._build_api_params(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters)
+        api_params["stream"] = True
+        api_params["stream_options"] = {"include_usage": True} # 最后一个数据块携带 usage
+
+        log_prefix = self._stream_log_prefix
+        model_id_used = self._user_model_id
+        prompt_tokens = 0
+        completion_tokens = 0
+        total_tokens = 0
+        finish_reason: Optional[str] = None
+
+        try:
+            request_start_time = self._start_request_timer()
+            first_chunk_logged = request_start_time is None or not logger.isEnabledFor(logging.DEBUG)
+            reserved_tokens = self._estimate_prompt_tokens(api_params) if self._token_rate_limiter is not None else 0
+            stream = await self._create_chat_completion(api_params, log_prefix, reserved_tokens)
+            async for chunk in stream:
+                if chunk.usage:
+                    prompt_tokens = chunk.usage.prompt_tokens
+                    completion_tokens = chunk.usage.completion_tokens
+                    total_tokens = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                if finish_reason == "content_filter":
+                    logger.error(f"{log_prefix} DeepSeek 内容过滤器在流式输出过程中触发，终止读取。")
+                    raise GlobalContentSafetyException(
+                        message="DeepSeek API 因内容过滤中止了流式响应 (finish_reason: content_filter)。",
+                        provider=self.PROVIDER_TAG, model_id=model_id_used,
+                        details={"finish_reason": finish_reason},
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        total_tokens=total_tokens,
+                        finish_reason=finish_reason
+                    )
+                delta_text = choice.delta.content if choice.delta else None
+                if delta_text:
+                    if not first_chunk_logged:
+                        first_chunk_logged = True
+                        logger.debug("%s 首个 token 耗时: %.2fms", log_prefix, (time.monotonic() - request_start_time) * 1000) # type: ignore[operator]
+                    yield LLMResponse(
+                        text=delta_text,
+                        model_id_used=model_id_used,
+                        prompt_tokens=0,
+                        completion_tokens=0,
+                        total_tokens=0,
+                        finish_reason=None,
+                        error=None
+                    )
+            settle_token_usage(self._token_rate_limiter, reserved_tokens, total_tokens)
+            self._observe_request_duration(request_start_time, "success", log_prefix)
+        except Exception as e:
+            self._observe_request_duration(request_start_time, type(e).__name__, log_prefix)
+            raise self._with_estimated_prompt_tokens(self._translate_api_error(e, log_prefix, prompt_tokens, completion_tokens), api_params) from e
+
+        yield LLMResponse(
+            text="",
+            model_id_used=model_id_used,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=total_tokens,
+            finish_reason=finish_reason,
+            error=None
+        )
+
+    async def generate_batch(
+        self,
+        prompts: List[str],
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None
+    ) -> List[LLMResponse]:
+        """
+        为多个相互独立的提示生成结果，返回顺序与 prompts 一致。
+        确定性调用 (temperature=0 且非流式) 会经动态批处理器合并：同一窗口内（包括来自其他并发调用方的）
+        提示被编号后以一次 JSON 输出请求发送，以减少受 RPM 限制时的请求次数。
+        采样调用 (temperature>0) 中重复出现的相同提示以一次 n>1 的请求获取多个独立采样；其余提示逐个并发调用 generate()。
+        """
+        effective_temperature = temperature if temperature is not None else self._get_llm_defaults()[0]
+        is_streaming = bool(llm_override_parameters and llm_override_parameters.get("stream"))
+        if is_streaming or len(prompts) <= 1:
+            return list(await asyncio.gather(*[
+                self.generate(prompt, system_prompt=system_prompt, temperature=temperature, max_tokens=max_tokens, llm_override_parameters=llm_override_parameters)
+                for prompt in prompts
+            ]))
+        if effective_temperature != 0:
+            positions_by_prompt: Dict[str, List[int]] = {}
+            for position, prompt in enumerate(prompts):
+                positions_by_prompt.setdefault(prompt, []).append(position)
+            sampled_results: List[Optional[LLMResponse]] = [None] * len(prompts)
+
+            async def _run_prompt_group(prompt: str, positions: List[int]) -> None:
+                if len(positions) == 1:
+                    group_responses = [await self.generate(prompt, system_prompt=system_prompt, temperature=temperature, max_tokens=max_tokens, llm_override_parameters=llm_override_parameters)]
+                else:
+                    group_responses = await self._generate_samples(prompt, system_prompt, temperature, max_tokens, llm_override_parameters, len(positions))
+                for position, group_response in zip(positions, group_responses):
+                    sampled_results[position] = group_response
+
+            await asyncio.gather(*[_run_prompt_group(prompt, positions) for prompt, positions in positions_by_prompt.items()])
+            return sampled_results # type: ignore[return-value]
+
+        override_items = tuple(sorted((llm_override_parameters or {}).items(), key=lambda item: item[0]))
+        batch_group_key = (system_prompt, max_tokens, repr(override_items))
+        return list(await asyncio.gather(*[
+            self._batcher.submit((batch_group_key, prompt, system_prompt, max_tokens, llm_override_parameters))
+            for prompt in prompts
+        ]))
+
+    async def _generate_samples(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        llm_override_parameters: Optional[Dict[str, Any]],
+        sample_count: int
+    ) -> List[LLMResponse]:
+        """
+        以一次 n=sample_count 的请求获取同一提示的多个采样，提示 token 只计费一次、只占用一次 RPM。
+        服务端忽略 n、返回的可用 choice 不足或被内容过滤时，缺少的采样逐个调用 generate() 补齐。
+        """
+        api_params = self._build_api_params(prompt, system_prompt, False, temperature, max_tokens, llm_override_parameters)
+        api_params.pop("stream", None)
+        api_params["n"] = sample_count
+        log_prefix = self._log_prefix
+        try:
+            request_start_time = self._start_request_timer()
+            try:
+                response = await self._create_chat_completion(api_params, log_prefix)
+            except Exception as e_request:
+                self._observe_request_duration(request_start_time, type(e_request).__name__, log_prefix)
+                raise
+            self._observe_request_duration(request_start_time, "success", log_prefix)
+        except Exception as e:
+            raise self._with_estimated_prompt_tokens(self._translate_api_error(e, log_prefix), api_params) from e
+
+        usable_choices = [
+            choice for choice in (response.choices or [])[:sample_count]
+            if choice.finish_reason != "content_filter" and choice.message and choice.message.content is not None
+        ]
+        # 一次请求的 token 用量平均分摊到各条采样上
+        share_count = max(1, len(usable_choices))
+        prompt_share = response.usage.prompt_tokens // share_count if response.usage else 0
+        completion_share = response.usage.completion_tokens // share_count if response.usage else 0
+        sample_responses = [
+            LLMResponse(
+                text=choice.message.content,
+                model_id_used=self._user_model_id,
+                prompt_tokens=prompt_share,
+                completion_tokens=completion_share,
+                total_tokens=prompt_share + completion_share,
+                finish_reason=choice.finish_reason,
+                error=None
+            )
+            for choice in usable_choices
+        ]
+        missing_count = sample_count - len(sample_responses)
+        if missing_count > 0:
+            logger.debug("%s n=%d 的请求只返回了 %d 个可用采样，将单独请求其余采样。", log_prefix, sample_count, len(sample_responses))
+            sample_responses.extend(await asyncio.gather(*[
+                self.generate(prompt, system_prompt=system_prompt, temperature=temperature, max_tokens=max_tokens, llm_override_parameters=llm_override_parameters)
+                for _ in range(missing_count)
+            ]))
+        return sample_responses
+
+    async def _flush_merged_batch(self, batch_items: List[Tuple[Any, str, Optional[str], Optional[int], Optional[Dict[str, Any]]]]) -> List[LLMResponse]:
+        """DynamicBatcher 的刷新回调：按 (系统提示, max_tokens, 覆盖参数) 分组，每组合并为一次请求。"""
+        results: List[Optional[LLMResponse]] = [None] * len(batch_items)
+        groups: Dict[Any, List[int]] = {}
+        for position, batch_item in enumerate(batch_items):
+            groups.setdefault(batch_item[0], []).append(position)
+
+        async def _run_group(positions: List[int]) -> None:
+            _, _, group_system_prompt, group_max_tokens, group_overrides = batch_items[positions[0]]
+            group_prompts = [batch_items[position][1] for position in positions]
+            group_responses = await self._generate_merged(group_prompts, group_system_prompt, group_max_tokens, group_overrides)
+            for position, group_response in zip(positions, group_responses):
+                results[position] = group_response
+
+        await asyncio.gather(*[_run_group(positions) for positions in groups.values()])
+        return results # type: ignore[return-value]
+
+    async def _generate_merged(
+        self,
+        prompts: List[str],
+        system_prompt: Optional[str],
+        max_tokens: Optional[int],
+        llm_override_parameters: Optional[Dict[str, Any]]
+    ) -> List[LLMResponse]:
+        """
+        把多个提示编号合并为一次 JSON 输出请求；解析失败或缺失的条目单独重新请求。
+        合并请求的输出预算为每条提示的预算（max_tokens 或全局默认值）乘以提示数，
+        超过 DEEPSEEK_MAX_OUTPUT_TOKENS 时拆分为多个合并请求；单条预算已容不下两条提示时不合并。
+        """
+        if len(prompts) == 1:
+            return [await self.generate(prompts[0], system_prompt=system_prompt, temperature=0, max_tokens=max_tokens, llm_override_parameters=llm_override_parameters)]
+
+        log_prefix = self._batch_log_prefix
+        per_prompt_max_tokens = max_tokens or self._get_llm_defaults()[1]
+        prompts_per_request = DEEPSEEK_MAX_OUTPUT_TOKENS // per_prompt_max_tokens
+        if prompts_per_request < 2:
+            logger.debug("%s 每条提示的输出预算 (%d) 过大，无法合并，逐个请求 %d 条提示。", log_prefix, per_prompt_max_tokens, len(prompts))
+            return list(await asyncio.gather(*[
+                self.generate(prompt, system_prompt=system_prompt, temperature=0, max_tokens=max_tokens, llm_override_parameters=llm_override_parameters)
+                for prompt in prompts
+            ]))
+        if len(prompts) > prompts_per_request:
+            chunk_results = await asyncio.gather(*[
+                self._generate_merged(prompts[chunk_start:chunk_start + prompts_per_request], system_prompt, max_tokens, llm_override_parameters)
+                for chunk_start in range(0, len(prompts), prompts_per_request)
+            ])
+            return [chunk_response for chunk_responses in chunk_results for chunk_response in chunk_responses]
+
+        merge_instruction = BATCH_MERGE_INSTRUCTION.format(count=len(prompts))
+        merged_system_prompt = f"{system_prompt.rstrip()}\n\n{merge_instruction}" if system_prompt else merge_instruction
+        merged_prompt = "\n\n".join(f"### 请求 {index}\n{prompt}" for index, prompt in enumerate(prompts, start=1))
+
+        merged_response = await self.generate(
+            merged_prompt,
+            system_prompt=merged_system_prompt,
+            is_json_output=True,
+            temperature=0,
+            max_tokens=per_prompt_max_tokens * len(prompts),
+            llm_override_parameters=llm_override_parameters
+        )
+
+        texts_by_index: Dict[int, str] = {}
+        try:
+            parsed_payload = json_loads(merged_response.text)
+            for response_entry in parsed_payload.get("responses", []):
+                if isinstance(response_entry, dict) and isinstance(response_entry.get("response"), str):
+                    texts_by_index[int(response_entry["index"])] = response_entry["response"]
+        except (ValueError, TypeError, AttributeError, KeyError) as e_parse:
+            logger.warning(f"{log_prefix} 无法解析合并请求的 JSON 响应，将逐个重新请求: {e_parse}")
+
+        # 合并请求的 token 用量平均分摊到各条结果上
+        prompt_share = merged_response.prompt_tokens // len(prompts)
+        completion_share = merged_response.completion_tokens // len(prompts)
+        results: List[LLMResponse] = []
+        missing_positions: List[int] = []
+        for position in range(len(prompts)):
+            response_text = texts_by_index.get(position + 1)
+            if response_text is None:
+                missing_positions.append(position)
+                results.append(merged_response) # 占位，下面会替换
+                continue
+            results.append(LLMResponse(
+                text=response_text,
+                model_id_used=merged_response.model_id_used,
+                prompt_tokens=prompt_share,
+                completion_tokens=completion_share,
+                total_tokens=prompt_share + completion_share,
+                finish_reason=merged_response.finish_reason,
+                error=None
+            ))
+
+        if missing_positions:
+            logger.warning(f"{log_prefix} 合并响应缺少 {len(missing_positions)}/{len(prompts)} 条结果，将单独请求这些提示。")
+            fallback_responses = await asyncio.gather(*[
+                self.generate(prompts[position], system_prompt=system_prompt, temperature=0, max_tokens=max_tokens, llm_override_parameters=llm_override_parameters)
+                for position in missing_positions
+            ])
+            for position, fallback_response in zip(missing_positions, fallback_responses):
+                results[position] = fallback_response
+        return results
+
+    def _compute_capabilities(self) -> Dict[str, Any]:
+        """根据模型配置推断能力信息（仅在初始化和 refresh_capabilities 时调用）。"""
         base_capabilities = {
             "max_context_tokens": self.model_config.max_context_tokens,
             "supports_system_prompt": self.model_config.supports_system_prompt,
@@ -290,51 +1046,208 @@ class DeepSeekProvider(BaseLLMProvider):
                 inferred_max_tokens = 130000 #
             
             base_capabilities["max_context_tokens"] = inferred_max_tokens
-            logger.debug(f"DeepSeekProvider for '{self.get_user_defined_model_id()}': 根据API模型ID '{model_api_id_lower}' 推断 max_context_tokens 为 {inferred_max_tokens} (因用户未配置)。")
+            logger.debug("DeepSeekProvider for '%s': 根据API模型ID '%s' 推断 max_context_tokens 为 %s (因用户未配置)。", self._user_model_id, model_api_id_lower, inferred_max_tokens)
         
         if base_capabilities["supports_system_prompt"] is None: # DeepSeek models generally support system prompts
              base_capabilities["supports_system_prompt"] = True
 
         return base_capabilities
 
+    def _init_static_request_fields(self) -> None:
+        """根据 model_config 预先计算每次请求都不变的字段：模型ID、请求参数模板、能力信息和日志前缀。"""
+        self._model_api_id = self.get_model_identifier_for_api()
+        self._user_model_id = self.get_user_defined_model_id()
+        self._supports_system = bool(self.model_config.supports_system_prompt)
+        self._base_api_params: Dict[str, Any] = {"model": self._model_api_id}
+        self._capabilities: Dict[str, Any] = self._compute_capabilities()
+        self._log_prefix = f"[DeepSeekProvider(Model:'{self._user_model_id}')]"
+        self._stream_log_prefix = f"[DeepSeekProvider(Model:'{self._user_model_id}', Stream)]"
+        self._batch_log_prefix = f"[DeepSeekProvider(Model:'{self._user_model_id}', Batch)]"
+
+    def refresh_capabilities(self) -> Dict[str, Any]:
+        """model_config 被修改后调用，重新计算缓存的能力信息及请求模板。"""
+        self._init_static_request_fields()
+        return self._capabilities
+
+    async def generate_many(
+        self,
+        prompts: List[str],
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        *,
+        max_concurrency: int = DEFAULT_GENERATE_MANY_CONCURRENCY,
+        rate_limit_per_min: Optional[float] = None
+    ) -> List[LLMResponse]:
+        """
+        为大量相互独立的提示生成结果，返回顺序与 prompts 一致。
+        provider_config.use_batch_api 开启且提示数不少于 batch_api_min_prompts 时，通过 Batch API 异步提交
+        （单价更低，但完成时间可能长达数小时）；否则由基类按 max_concurrency / rate_limit_per_min 并发调用 generate()。
+        """
+        if not self.provider_config.use_batch_api or len(prompts) < self.provider_config.batch_api_min_prompts:
+            return await super().generate_many(
+                prompts, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters,
+                max_concurrency=max_concurrency, rate_limit_per_min=rate_limit_per_min
+            )
+
+        if not self.is_client_ready() or self.client is None:
+            logger.error(f"DeepSeekProvider (模型: {self.model_config.user_given_name}) 错误：客户端未初始化。")
+            raise LLMConnectionError("DeepSeek客户端未初始化或未就绪", provider=self.PROVIDER_TAG)
+
+        log_prefix = f"[DeepSeekProvider(Model:'{self.get_user_defined_model_id()}', BatchAPI)]"
+        request_bodies = [
+            self._build_api_params(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters)
+            for prompt in prompts
+        ]
+        for request_body in request_bodies:
+            request_body.pop("stream", None) # Batch API 不支持流式
+        try:
+            batch_output_lines = await self._run_batch_job(request_bodies, log_prefix)
+        except Exception as e:
+            raise self._translate_api_error(e, log_prefix) from e
+
+        results: List[Optional[LLMResponse]] = [None] * len(prompts)
+        for output_line in batch_output_lines:
+            position = self._parse_batch_custom_id(output_line.get("custom_id"))
+            if position is None or position >= len(prompts):
+                continue
+            results[position] = self._batch_output_to_llm_response(output_line)
+
+        missing_positions = [position for position, result in enumerate(results) if result is None]
+        if missing_positions:
+            logger.warning(f"{log_prefix} Batch 结果缺少或失败 {len(missing_positions)}/{len(prompts)} 条，将单独请求这些提示。")
+            fallback_responses = await super().generate_many(
+                [prompts[position] for position in missing_positions], system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters,
+                max_concurrency=max_concurrency, rate_limit_per_min=rate_limit_per_min
+            )
+            for position, fallback_response in zip(missing_positions, fallback_responses):
+                results[position] = fallback_response
+        return results # type: ignore[return-value]
+
+    async def _run_batch_job(self, request_bodies: List[Dict[str, Any]], log_prefix: str) -> List[Dict[str, Any]]:
+        """上传 JSONL 输入文件、创建 Batch 任务、按指数退避轮询直至结束，返回输出文件中的各行。"""
+        batch_input_bytes = b"\n".join(
+            json_dumps_bytes({"custom_id": f"request-{position}", "method": "POST", "url": BATCH_API_ENDPOINT, "body": request_body})
+            for position, request_body in enumerate(request_bodies)
+        )
+        input_file = await self.client.files.create(file=("batch_input.jsonl", batch_input_bytes), purpose="batch") # type: ignore[union-attr]
+        batch_job = await self.client.batches.create( # type: ignore[union-attr]
+            input_file_id=input_file.id,
+            endpoint=BATCH_API_ENDPOINT,
+            completion_window=BATCH_API_COMPLETION_WINDOW
+        )
+        logger.info(f"{log_prefix} 已提交 Batch 任务 {batch_job.id}，共 {len(request_bodies)} 个请求。")
+
+        poll_interval = self.provider_config.batch_api_poll_interval_seconds
+        while batch_job.status not in BATCH_API_TERMINAL_STATUSES:
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(BATCH_API_MAX_POLL_INTERVAL_SECONDS, poll_interval * 2)
+            batch_job = await self.client.batches.retrieve(batch_job.id) # type: ignore[union-attr]
+            logger.debug("%s Batch 任务 %s 状态: %s", log_prefix, batch_job.id, batch_job.status)
+
+        if batch_job.status != "completed" or not batch_job.output_file_id:
+            raise LLMAPIError(f"DeepSeek Batch 任务 {batch_job.id} 未成功完成 (状态: {batch_job.status})。", provider=self.PROVIDER_TAG)
+
+        output_content = await self.client.files.content(batch_job.output_file_id) # type: ignore[union-attr]
+        return [json_loads(output_line) for output_line in output_content.content.splitlines() if output_line.strip()]
+
+    @staticmethod
+    def _parse_batch_custom_id(custom_id: Optional[str]) -> Optional[int]:
+        if not custom_id or not custom_id.startswith("request-"):
+            return None
+        try:
+            return int(custom_id[len("request-"):])
+        except ValueError:
+            return None
+
+    def _batch_output_to_llm_response(self, output_line: Dict[str, Any]) -> Optional[LLMResponse]:
+        """把 Batch 输出中的一行转换为 LLMResponse；失败的条目返回 None，由调用方单独重试。"""
+        response_entry = output_line.get("response") or {}
+        response_body = response_entry.get("body") or {}
+        if output_line.get("error") or response_entry.get("status_code") != 200 or not response_body.get("choices"):
+            return None
+        first_choice = response_body["choices"][0]
+        usage = response_body.get("usage") or {}
+        finish_reason = first_choice.get("finish_reason")
+        generated_text = (first_choice.get("message") or {}).get("content")
+        if finish_reason == "content_filter":
+            # 单条被内容过滤不应让整批失败，以带 error 的 LLMResponse 返回
+            return LLMResponse(
+                text="",
+                model_id_used=self.get_user_defined_model_id(),
+                prompt_tokens=usage.get("prompt_tokens", 0),
+                completion_tokens=usage.get("completion_tokens", 0),
+                total_tokens=usage.get("total_tokens", 0),
+                finish_reason=finish_reason,
+                error="DeepSeek API 因内容过滤阻止了响应 (finish_reason: content_filter)。"
+            )
+        if generated_text is None:
+            return None
+        return LLMResponse(
+            text=generated_text,
+            model_id_used=self.get_user_defined_model_id(),
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            total_tokens=usage.get("total_tokens", 0),
+            finish_reason=finish_reason,
+            error=None
+        )
+
+    def get_model_capabilities(self) -> Dict[str, Any]:
+        return self._capabilities
+
     async def get_available_models_from_api(self) -> List[Dict[str, Any]]:
         log_prefix_list = f"[DeepSeekProvider(ListModels)]"
-        
+
+        models_cache_key = self.model_config.base_url or DEFAULT_DEEPSEEK_BASE_URL
+        cached_models_entry = self._MODELS_CACHE.get(models_cache_key)
+        if cached_models_entry is not None and time.monotonic() - cached_models_entry[0] < self.provider_config.models_list_ttl_seconds:
+            logger.debug("%s 使用缓存的模型列表 (Base URL: %s)。", log_prefix_list, models_cache_key)
+            return [dict(model_info) for model_info in cached_models_entry[1]]
+
         client_instance_to_use: Optional[AsyncOpenAI] = self.client
-        temp_client_created_for_listing = False
 
         if not self.is_client_ready() or client_instance_to_use is None:
-            logger.warning(f"{log_prefix_list} 主客户端未就绪。尝试使用模型配置中的凭证创建临时客户端以列出模型。")
             temp_api_key_from_cfg = self.model_config.api_key or os.getenv("DEEPSEEK_API_KEY")
             temp_base_url_from_cfg = self.model_config.base_url or DEFAULT_DEEPSEEK_BASE_URL
             
             if not temp_api_key_from_cfg:
                 logger.error(f"{log_prefix_list} 无法列出模型：未提供API密钥。")
                 return []
+            client_instance_to_use = _CLIENT_POOL.get(self._client_pool_key(temp_base_url_from_cfg, temp_api_key_from_cfg))
+        
+        if client_instance_to_use is None and HTTPX_AVAILABLE and httpx is not None:
+            # 没有可复用的客户端时直接发一次 GET /models，无需为单个请求构造带完整连接池的 SDK 客户端
+            direct_models_list = await self._list_models_via_http(temp_base_url_from_cfg, temp_api_key_from_cfg, log_prefix_list)
+            if direct_models_list is not None:
+                if direct_models_list:
+                    self._MODELS_CACHE[models_cache_key] = (time.monotonic(), [dict(model_info) for model_info in direct_models_list])
+                return direct_models_list
+
+        if client_instance_to_use is None:
+            if not OPENAI_SDK_FOR_DEEPSEEK_AVAILABLE or AsyncOpenAI is None:
+                logger.error(f"{log_prefix_list} 无法列出模型：OpenAI SDK 不可用。")
+                return []
+            logger.warning(f"{log_prefix_list} 主客户端未就绪且无可复用的共享客户端。将使用模型配置中的凭证创建共享客户端以列出模型。")
             try:
-                client_instance_to_use = AsyncOpenAI(api_key=temp_api_key_from_cfg, base_url=temp_base_url_from_cfg)
-                temp_client_created_for_listing = True
+                # 放入共享池而不是用完即关，后续列表请求和同账号的实例都可复用其连接。
+                # 上面的直连请求期间其他协程可能已为同一账号创建了客户端，因此在锁内重新检查共享池后再创建
+                async with _CLIENT_POOL_LOCK:
+                    client_instance_to_use, _ = self._get_or_create_pooled_client(temp_api_key_from_cfg, temp_base_url_from_cfg)
             except Exception as e_temp_client_create:
-                logger.error(f"{log_prefix_list} 创建临时DeepSeek客户端列出模型失败: {e_temp_client_create}")
+                logger.error(f"{log_prefix_list} 创建DeepSeek客户端列出模型失败: {e_temp_client_create}")
                 return []
-        
-        if client_instance_to_use is None:
-            logger.error(f"{log_prefix_list} 无法确定用于列出模型的DeepSeek客户端实例。")
-            return []
 
         try:
             models_response_obj = await client_instance_to_use.models.list()
             available_models_list: List[Dict[str, Any]] = []
             if models_response_obj and models_response_obj.data:
                 for model_api_obj in models_response_obj.data:
-                    model_info = {
-                        "id": model_api_obj.id,
-                        "name": model_api_obj.id, 
-                        "provider_tag": self.PROVIDER_TAG,
-                        "notes": f"由DeepSeek API发现。Owner: {getattr(model_api_obj, 'owned_by', 'DeepSeek')}",
-                    }
-                    available_models_list.append(model_info)
+                    available_models_list.append(self._build_model_info(model_api_obj.id, getattr(model_api_obj, 'owned_by', None)))
                 logger.info(f"{log_prefix_list} 从 DeepSeek API 成功获取 {len(available_models_list)} 个可用模型信息。")
+                self._MODELS_CACHE[models_cache_key] = (time.monotonic(), [dict(model_info) for model_info in available_models_list])
                 return available_models_list
             else:
                 logger.warning(f"{log_prefix_list} DeepSeek API models.list() 返回了空响应或无数据。")
@@ -345,11 +1258,55 @@ class DeepSeekProvider(BaseLLMProvider):
         except Exception as e_generic:
             logger.error(f"{log_prefix_list} 获取 DeepSeek 可用模型列表时发生未知错误: {e_generic}", exc_info=True)
             return []
-        finally:
-            if temp_client_created_for_listing and client_instance_to_use and hasattr(client_instance_to_use, 'aclose'):
-                try:
-                    await client_instance_to_use.aclose()
-                except Exception: pass
+
+    def _build_model_info(self, model_id: str, owned_by: Optional[str]) -> Dict[str, Any]:
+        return {
+            "id": model_id,
+            "name": model_id,
+            "provider_tag": self.PROVIDER_TAG,
+            "notes": f"由DeepSeek API发现。Owner: {owned_by or 'DeepSeek'}",
+        }
+
+    async def _list_models_via_http(self, base_url: str, api_key: str, log_prefix_list: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        直接通过持久的 httpx 客户端请求 {base_url}/models。
+        返回模型列表；请求失败时返回空列表；响应不是 OpenAI 兼容格式时返回 None，由调用方回退到 SDK。
+        """
+        global _LISTING_HTTP_CLIENT
+        if _LISTING_HTTP_CLIENT is None or _LISTING_HTTP_CLIENT.is_closed:
+            _LISTING_HTTP_CLIENT = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_keepalive_connections=LISTING_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LISTING_KEEPALIVE_EXPIRY_SECONDS
+                )
+            )
+        try:
+            http_response = await _LISTING_HTTP_CLIENT.get(
+                f"{base_url.rstrip('/')}/models",
+                headers={"Authorization": f"Bearer {api_key}"},
+                timeout=self.provider_config.api_timeout_seconds
+            )
+        except Exception as e_http:
+            logger.error(f"{log_prefix_list} 请求 DeepSeek /models 失败: {e_http}")
+            return []
+        if http_response.status_code != 200:
+            logger.error(f"{log_prefix_list} 从 DeepSeek API 获取可用模型列表失败 (HTTP Status: {http_response.status_code}): {http_response.text[:200]}")
+            return []
+        try:
+            models_payload = json_loads(http_response.content)
+            model_entries = models_payload["data"]
+            available_models_list = [
+                self._build_model_info(model_entry["id"], model_entry.get("owned_by"))
+                for model_entry in model_entries
+            ]
+        except (ValueError, TypeError, KeyError, AttributeError) as e_parse:
+            logger.warning(f"{log_prefix_list} /models 响应不是预期的 OpenAI 兼容格式，将回退到 SDK 获取: {e_parse}")
+            return None
+        if available_models_list:
+            logger.info(f"{log_prefix_list} 从 DeepSeek API 成功获取 {len(available_models_list)} 个可用模型信息。")
+        else:
+            logger.warning(f"{log_prefix_list} DeepSeek API /models 返回了空列表。")
+        return available_models_list
 
     async def test_connection(
         self,
@@ -379,15 +1336,10 @@ class DeepSeekProvider(BaseLLMProvider):
                 logger.warning(f"[DeepSeek-TestConnection] 连接测试：模型 {test_model_id} 返回了空内容。")
                 return False, f"连接到DeepSeek模型 {test_model_id} 成功，但模型返回了空响应。", [f"原始响应对象: {str(response)[:200]}..."]
 
-        except OpenAIAuthenticationError as e_auth:
-            logger.error(f"[DeepSeek-TestConnection] 认证失败 (模型: {test_model_id}): {e_auth}", exc_info=False)
-            return False, "DeepSeek API认证失败。", [f"请检查您的API密钥是否正确并具有访问模型 {test_model_id} 的权限。", f"错误详情: {str(e_auth)[:200]}"]
-        except RateLimitError as e_rate:
-            logger.warning(f"[DeepSeek-TestConnection] 遭遇速率限制 (模型: {test_model_id}): {e_rate}")
-            return False, "DeepSeek API速率限制。", [f"请稍后再试或检查您的API使用限制。", f"错误详情: {str(e_rate)[:200]}"]
-        except (APIConnectionError, APITimeoutError) as e_conn:
-            logger.error(f"[DeepSeek-TestConnection] 连接或超时错误 (模型: {test_model_id}): {e_conn}", exc_info=False)
-            return False, "无法连接到DeepSeek API或请求超时。", [f"请检查您的网络连接和DeepSeek服务状态。", f"错误详情: {str(e_conn)[:200]}"]
+        except (OpenAIAuthenticationError, RateLimitError, APIConnectionError) as e_mapped:
+            log_label, log_level, summary_message, suggestion = _lookup_sdk_error(e_mapped, _TEST_CONNECTION_ERROR_MAP)
+            logger.log(log_level, f"[DeepSeek-TestConnection] {log_label} (模型: {test_model_id}): {e_mapped}")
+            return False, summary_message, [suggestion.format(model_id=test_model_id), f"错误详情: {str(e_mapped)[:200]}"]
         except OpenAIAPIError as e_api: # Catch other OpenAI SDK errors
             status_code = getattr(e_api, 'status_code', 'N/A')
             error_code = getattr(e_api, 'code', 'N/A')
@@ -2,33 +2,44 @@
 import logging
 import os
 import asyncio # 确保导入 asyncio
+import datetime
+import hashlib
+import re
 import time
-from typing import Dict, Any, Optional, Tuple, List, Union # 确保导入 Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Dict, Any, FrozenSet, Mapping, Optional, Tuple, List, Union, AsyncIterator # 确保导入 Union
 
-# Google Generative AI SDK
-try:
+# Google Generative AI SDK 在首次构造 GeminiProvider 时才导入 (见 _lazy_import_sdk)：
+# SDK 会连带加载 grpc、proto-plus 及大量 pb2 模块，未使用 Gemini 的进程无需承担这部分启动时间与内存
+if TYPE_CHECKING:
     import google.generativeai as genai
     from google.generativeai.types import GenerationConfig, ContentDict, PartDict # type: ignore[attr-defined]
     from google.generativeai.types import HarmCategory, HarmBlockThreshold, SafetySettingDict # type: ignore[attr-defined]
     from google.api_core import exceptions as GoogleAPICoreExceptions # type: ignore[attr-defined]
-    GEMINI_SDK_AVAILABLE = True
-except ImportError:
-    genai = None # type: ignore
-    GenerationConfig = None # type: ignore
-    ContentDict = None # type: ignore
-    PartDict = None # type: ignore
-    HarmCategory = None # type: ignore
-    HarmBlockThreshold = None # type: ignore
-    SafetySettingDict = None # type: ignore
-    GoogleAPICoreExceptions = None # type: ignore
-    GEMINI_SDK_AVAILABLE = False
-    logging.warning(
-        "Google Generative AI SDK (google-generativeai) 未安装。"
-        "GeminiProvider 将不可用。请运行 'pip install google-generativeai'"
-    )
+    from google.generativeai import caching as genai_caching # type: ignore[attr-defined]
+else:
+    genai = None
+    GenerationConfig = None
+    ContentDict = None
+    PartDict = None
+    HarmCategory = None
+    HarmBlockThreshold = None
+    SafetySettingDict = None
+    GoogleAPICoreExceptions = None
+    genai_caching = None
+
+GEMINI_SDK_AVAILABLE = False
+# 显式上下文缓存 (Context Caching) 需要 google-generativeai >= 0.7；旧版本 SDK 下该功能自动关闭
+CONTEXT_CACHING_AVAILABLE = False
+_SDK_IMPORT_ATTEMPTED = False
 
 # 导入新的基类和响应模型
-from .base_llm_provider import BaseLLMProvider, LLMResponse
+from .base_llm_provider import DEFAULT_GENERATE_MANY_CONCURRENCY, BaseLLMProvider, LLMResponse
+from .provider_utils import HTTPX_AVAILABLE, compute_backoff_delay, get_retry_after_seconds, httpx, json_dumps_bytes, json_loads
+from .response_cache import ResponseCache, SemanticResponseCache, build_response_cache_key
 # 导入类型化的配置模型和全局配置服务
 from app import schemas, config_service
 
@@ -48,14 +59,275 @@ logger = logging.getLogger(__name__)
 # class ContentSafetyException(RuntimeError):
 # ... (本地定义已移除)
 
-# 将字符串映射到 HarmCategory 和 HarmBlockThreshold 枚举成员
-HARM_CATEGORY_MAP: Dict[str, Any] = {
-    name: getattr(HarmCategory, name) for name in dir(HarmCategory) if name.startswith("HARM_CATEGORY_")
-} if HarmCategory else {}
+# 将字符串映射到 HarmCategory 和 HarmBlockThreshold 枚举成员 (导入 SDK 后填充)。
+# 对外暴露只读视图，底层字典仅由 _lazy_import_sdk 写入
+_HARM_CATEGORY_MEMBERS: Dict[str, Any] = {}
+_HARM_BLOCK_THRESHOLD_MEMBERS: Dict[str, Any] = {}
+HARM_CATEGORY_MAP: Mapping[str, Any] = MappingProxyType(_HARM_CATEGORY_MEMBERS)
+HARM_BLOCK_THRESHOLD_MAP: Mapping[str, Any] = MappingProxyType(_HARM_BLOCK_THRESHOLD_MEMBERS)
+# 上述两张映射表的合法键 (导入 SDK 后一次性生成)，解析配置时做 O(1) 的成员判断
+_SAFETY_CATEGORY_KEYS: FrozenSet[str] = frozenset()
+_SAFETY_THRESHOLD_KEYS: FrozenSet[str] = frozenset()
+
+
+def _lazy_import_sdk() -> bool:
+    """导入 google-generativeai 并填充本模块的 SDK 全局名称；仅首次调用时执行导入，返回 SDK 是否可用。"""
+    global genai, GenerationConfig, ContentDict, PartDict, HarmCategory, HarmBlockThreshold, SafetySettingDict
+    global GoogleAPICoreExceptions, genai_caching, GEMINI_SDK_AVAILABLE, CONTEXT_CACHING_AVAILABLE, _SDK_IMPORT_ATTEMPTED
+    global _SAFETY_CATEGORY_KEYS, _SAFETY_THRESHOLD_KEYS
+    if _SDK_IMPORT_ATTEMPTED:
+        return GEMINI_SDK_AVAILABLE
+    _SDK_IMPORT_ATTEMPTED = True
+    try:
+        import google.generativeai as _genai
+        from google.generativeai import types as _genai_types
+        from google.api_core import exceptions as _google_api_core_exceptions # type: ignore[attr-defined]
+    except ImportError:
+        logging.warning(
+            "Google Generative AI SDK (google-generativeai) 未安装。"
+            "GeminiProvider 将不可用。请运行 'pip install google-generativeai'"
+        )
+        return False
+    genai = _genai
+    GenerationConfig = _genai_types.GenerationConfig
+    ContentDict = _genai_types.ContentDict
+    PartDict = _genai_types.PartDict
+    HarmCategory = _genai_types.HarmCategory
+    HarmBlockThreshold = _genai_types.HarmBlockThreshold
+    SafetySettingDict = _genai_types.SafetySettingDict
+    GoogleAPICoreExceptions = _google_api_core_exceptions
+    _HARM_CATEGORY_MEMBERS.update({
+        name: member for name, member in HarmCategory.__members__.items() if name.startswith("HARM_CATEGORY_")
+    })
+    _HARM_BLOCK_THRESHOLD_MEMBERS.update({
+        name: member for name, member in HarmBlockThreshold.__members__.items() if name.startswith("BLOCK_")
+    })
+    _SAFETY_CATEGORY_KEYS = frozenset(HARM_CATEGORY_MAP)
+    _SAFETY_THRESHOLD_KEYS = frozenset(HARM_BLOCK_THRESHOLD_MAP)
+    GEMINI_SDK_AVAILABLE = True
+    try:
+        from google.generativeai import caching as _genai_caching # type: ignore[attr-defined]
+        genai_caching = _genai_caching
+        CONTEXT_CACHING_AVAILABLE = True
+    except ImportError:
+        pass
+    return True
+
+# 当前 genai.configure 使用的 API 密钥哈希。genai.configure 会重建 SDK 的全局客户端（及其 gRPC 通道），
+# 密钥未变化时跳过重复配置，使所有提供商实例共用同一个已建立的异步通道
+_CONFIGURED_API_KEY_HASH: Optional[str] = None
+# 已预热 (建立过 TLS/HTTP2 连接) 的 API 密钥哈希，每个密钥只预热一次
+_PREWARMED_API_KEY_HASHES: set = set()
+# 持有后台预热任务的引用，避免任务在完成前被垃圾回收
+_BACKGROUND_TASKS: set = set()
+
+DEFAULT_MAX_RETRIES = 2 # provider_config.max_retries 未设置时的重试次数
+
+# 每个提供商实例缓存的 GenerativeModel 实例上限 (按模型ID与系统提示区分)
+MAX_CACHED_MODEL_INSTANCES = 32
+
+# Gemini Batch API (REST)。google-generativeai 0.6 未封装 batches 接口，直接以内联请求调用
+GEMINI_API_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+BATCH_API_MAX_POLL_INTERVAL_SECONDS = 60.0
+BATCH_API_TERMINAL_STATES = frozenset({
+    "BATCH_STATE_SUCCEEDED", "BATCH_STATE_FAILED", "BATCH_STATE_CANCELLED", "BATCH_STATE_EXPIRED",
+    "JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED",
+})
+# GenerationConfig 字段名 (snake_case) 到 REST 请求体字段名 (camelCase) 的映射
+REST_GENERATION_CONFIG_FIELDS: Dict[str, str] = {
+    "temperature": "temperature",
+    "max_output_tokens": "maxOutputTokens",
+    "top_p": "topP",
+    "top_k": "topK",
+    "stop_sequences": "stopSequences",
+    "response_mime_type": "responseMimeType",
+    "response_schema": "responseSchema",
+}
+
+# 已知模型系列：(API模型ID前缀, 是否支持 response_mime_type 强制JSON输出, 上下文窗口 token 数)
+# 按前缀匹配，较长的前缀需排在其更短的前缀之前
+_MODEL_FAMILY_PROFILES: Tuple[Tuple[str, bool, Optional[int]], ...] = (
+    ("gemini-2.5-pro", True, 1048576),
+    ("gemini-2.5-flash", True, 1048576),
+    ("gemini-2.0-flash", True, 1048576),
+    ("gemini-1.5-pro", True, 1048576),
+    ("gemini-1.5-flash", True, 1048576),
+    ("gemini-1.0-pro", False, 32768),
+    ("gemini-pro", False, 32768),
+)
+# 未列出的型号按版本号推断：1.5 及以后的版本均支持 JSON 输出模式
+_GEMINI_VERSION_PATTERN = re.compile(r"^gemini-(\d+)(?:\.(\d+))?-")
+
+# 通用 GoogleAPIError 的消息中出现这些词时视为内容安全相关错误，但涉及 API 密钥、权限或配额的错误除外
+_SAFETY_ERROR_INCLUDE_RE = re.compile(r"safety|blocked|policy violation|recitation|prohibited", re.IGNORECASE)
+_SAFETY_ERROR_EXCLUDE_RE = re.compile(r"api key|permission|quota", re.IGNORECASE)
+
+# 同步 SDK 调用 (list_models、上下文缓存的创建与续期) 使用的专用线程池，避免占满 asyncio 默认执行器
+GEMINI_SYNC_EXECUTOR_MAX_WORKERS = 8
+_GEMINI_SYNC_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+
+def _get_sync_executor() -> ThreadPoolExecutor:
+    global _GEMINI_SYNC_EXECUTOR
+    if _GEMINI_SYNC_EXECUTOR is None:
+        _GEMINI_SYNC_EXECUTOR = ThreadPoolExecutor(max_workers=GEMINI_SYNC_EXECUTOR_MAX_WORKERS, thread_name_prefix="gemini-sync")
+    return _GEMINI_SYNC_EXECUTOR
+
+
+async def _run_sync_sdk_call(func: Any, *args: Any, **kwargs: Any) -> Any:
+    """在专用线程池中执行同步的 SDK 调用。"""
+    return await asyncio.get_running_loop().run_in_executor(_get_sync_executor(), partial(func, *args, **kwargs))
+
+
+def _delete_cached_contents(cached_contents: List[Any], model_display_name: str) -> None:
+    """逐个删除服务端 CachedContent（同步 SDK 调用）；删除失败只记录日志，缓存最终会在有效期结束后自动过期。"""
+    for cached_content in cached_contents:
+        try:
+            cached_content.delete()
+            logger.debug("GeminiProvider (模型: %s) 已删除上下文缓存 %s。", model_display_name, getattr(cached_content, "name", ""))
+        except Exception as e_delete:
+            logger.warning(f"GeminiProvider (模型: {model_display_name}) 删除上下文缓存 {getattr(cached_content, 'name', '')} 失败: {e_delete}")
+
+
+def _safety_settings_cache_key(safety_settings: Optional[Any]) -> Optional[Tuple[Tuple[str, str], ...]]:
+    """将 [{category, threshold}, ...] 形式的安全设置归一化为可哈希的排序元组；其他形式返回 None。"""
+    if not safety_settings:
+        return ()
+    if not isinstance(safety_settings, (list, tuple)):
+        return None
+    try:
+        return tuple(sorted(
+            (getattr(setting["category"], "name", str(setting["category"])), getattr(setting["threshold"], "name", str(setting["threshold"])))
+            for setting in safety_settings
+        ))
+    except (KeyError, TypeError):
+        return None
+
+
+def _join_candidate_text(candidate: Any) -> str:
+    """拼接候选结果中各文本片段。纯文本响应通常只有一个片段，直接返回其文本，不再构造生成器。"""
+    content = candidate.content
+    if not content:
+        return ""
+    parts = content.parts
+    if len(parts) == 1:
+        return getattr(parts[0], "text", None) or ""
+    return "".join([part_text for part in parts if (part_text := getattr(part, "text", None))])
+
+
+# 模型不支持独立系统提示时，系统提示作为对话开头的一轮用户消息发送，并附上模型的确认回复
+SYSTEM_PROMPT_ACK_TEXT = "好的，我会遵循以上要求。"
+
+
+def _build_contents_for_api(prompt: str, leading_system_prompt: Optional[str] = None) -> Union[str, List[Any]]:
+    """
+    构造 generate_content 的 contents。单轮纯文本请求直接返回提示字符串 (SDK 同样接受 str)，不再包一层列表；
+    leading_system_prompt 以独立的轮次置于用户提示之前，
+    而不是与提示拼接成一个新字符串：避免复制较长的系统提示，且该前缀在各次调用间保持不变。
+    """
+    if not leading_system_prompt:
+        return prompt
+    return [
+        {"role": "user", "parts": [{"text": leading_system_prompt}]},
+        {"role": "model", "parts": [{"text": SYSTEM_PROMPT_ACK_TEXT}]},
+        {"role": "user", "parts": [{"text": prompt}]},
+    ]
+
+
+def _build_request_options(timeout_seconds: Any) -> Optional[Dict[str, Any]]:
+    """由超时秒数构造 SDK 调用的 request_options；为空或 0 时不设置超时，非正数或非数值抛出 ValueError。"""
+    if not timeout_seconds:
+        return None
+    try:
+        timeout_value = float(timeout_seconds)
+    except (TypeError, ValueError):
+        raise ValueError(f"Gemini 请求超时必须为正数 (秒)，收到: {timeout_seconds!r}") from None
+    if timeout_value <= 0:
+        raise ValueError(f"Gemini 请求超时必须为正数 (秒)，收到: {timeout_seconds!r}")
+    return {"timeout": timeout_value}
+
+
+def _coerce_stop_sequences(stop_seq: Any) -> Optional[List[str]]:
+    """stop_sequences 接受字符串或字符串列表；其他类型返回 None (忽略)。"""
+    if isinstance(stop_seq, str):
+        return [stop_seq]
+    if isinstance(stop_seq, list) and all(isinstance(s, str) for s in stop_seq):
+        return stop_seq
+    return None
+
+
+# llm_override_parameters 到 GenerationConfig 的映射：(覆盖参数名, GenerationConfig 字段名, 类型转换)
+# 多个覆盖参数对应同一字段时，排在前面的优先 (max_output_tokens 优先于 max_tokens)
+_GENERATION_OVERRIDE_SPEC: Tuple[Tuple[str, str, Any], ...] = (
+    ("max_output_tokens", "max_output_tokens", int),
+    ("max_tokens", "max_output_tokens", int),
+    ("top_p", "top_p", float),
+    ("top_k", "top_k", int),
+    ("stop_sequences", "stop_sequences", _coerce_stop_sequences),
+)
+
+
+@lru_cache(maxsize=64)
+def _get_model_family_profile(model_api_id: str) -> Tuple[bool, Optional[int]]:
+    """返回 (是否支持JSON输出模式, 推断的上下文窗口)。每个模型ID只解析一次。"""
+    normalized_model_id = model_api_id.lower()
+    if normalized_model_id.startswith("models/"):
+        normalized_model_id = normalized_model_id[len("models/"):]
+    for model_prefix, supports_json_mode, context_window in _MODEL_FAMILY_PROFILES:
+        if normalized_model_id.startswith(model_prefix):
+            return supports_json_mode, context_window
+    version_match = _GEMINI_VERSION_PATTERN.match(normalized_model_id)
+    if version_match:
+        version = (int(version_match.group(1)), int(version_match.group(2) or 0))
+        return version >= (1, 5), None
+    return False, None
+
+
+def _sdk_model_to_info(model_info: Any) -> Dict[str, Any]:
+    """将 SDK / generativelanguage 的 Model 对象转换为与 REST models.list 解析结果相同的字典。"""
+    return {
+        "name": model_info.name,
+        "display_name": model_info.display_name,
+        "description": model_info.description,
+        "input_token_limit": model_info.input_token_limit,
+        "supported_generation_methods": list(model_info.supported_generation_methods),
+    }
+
+
+def _configure_genai_once(api_key: str) -> None:
+    """仅在 API 密钥变化时调用 genai.configure，避免每次构造提供商都丢弃 SDK 已建立的连接。"""
+    global _CONFIGURED_API_KEY_HASH
+    api_key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    if api_key_hash == _CONFIGURED_API_KEY_HASH:
+        return
+    genai.configure(api_key=api_key)
+    _CONFIGURED_API_KEY_HASH = api_key_hash
+
 
-HARM_BLOCK_THRESHOLD_MAP: Dict[str, Any] = {
-    name: getattr(HarmBlockThreshold, name) for name in dir(HarmBlockThreshold) if name.startswith("BLOCK_")
-} if HarmBlockThreshold else {}
+def _normalize_safety_name(raw_name: str, prefix: str) -> str:
+    """统一大小写与空白，并允许省略枚举前缀 (如 "harassment" -> "HARM_CATEGORY_HARASSMENT")。"""
+    normalized_name = raw_name.strip().upper()
+    return normalized_name if normalized_name.startswith(prefix) else prefix + normalized_name
+
+
+@lru_cache(maxsize=32)
+def _parse_safety_settings(safety_config_items: Tuple[Tuple[str, str], ...]) -> Tuple[Dict[str, Any], ...]:
+    """
+    将配置中的 {类别: 阈值} 字符串对 (按键排序的元组) 解析为 SDK 的安全设置。
+    结果按配置内容缓存：配置重载后内容变化即得到新的键，无需显式失效。
+    """
+    parsed_settings: List[Dict[str, Any]] = []
+    for category_str, threshold_str in safety_config_items:
+        category_name = _normalize_safety_name(category_str, "HARM_CATEGORY_")
+        threshold_name = _normalize_safety_name(threshold_str, "BLOCK_")
+        if category_name in _SAFETY_CATEGORY_KEYS and threshold_name in _SAFETY_THRESHOLD_KEYS:
+            parsed_settings.append({
+                "category": HARM_CATEGORY_MAP[category_name],
+                "threshold": HARM_BLOCK_THRESHOLD_MAP[threshold_name]
+            })
+        else:
+            logger.warning(f"GeminiProvider: 无效的安全设置类别 '{category_str}' 或阈值 '{threshold_str}'。将忽略。")
+    return tuple(parsed_settings)
 
 
 class GeminiProvider(BaseLLMProvider):
@@ -63,24 +335,67 @@ class GeminiProvider(BaseLLMProvider):
     Google Gemini LLM 提供商实现。
     """
     PROVIDER_TAG = "google_gemini" # 与 llm_providers/__init__.py 中注册的键一致
+    SUPPORTS_SEMANTIC_CACHE = True
+
+    # API密钥哈希 -> (获取时间, 模型列表)；有效期由 provider_config.models_list_ttl_seconds 控制
+    _MODELS_CACHE: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+    # 缓存未命中时只发起一次 list_models，并发到达的请求等待同一结果
+    _MODELS_CACHE_LOCK = asyncio.Lock()
 
     def __init__(
         self,
         model_config: schemas.UserDefinedLLMConfigSchema,
-        provider_config: schemas.LLMProviderConfigSchema
+        provider_config: schemas.LLMProviderConfigSchema,
+        semantic_cache: Optional[SemanticResponseCache] = None
     ):
         """
         初始化 Google Gemini 提供商。
+        semantic_cache: 可选的语义响应缓存（编排器在 enable_semantic_cache 启用时注入），在精确匹配缓存未命中后使用。
         """
         super().__init__(model_config, provider_config)
+        # 模型ID与日志前缀在实例生命周期内不变，初始化时算好，避免每次请求重复调用方法和格式化字符串
+        self._api_model_id: str = self.get_model_identifier_for_api()
+        self._user_model_id: str = self.get_user_defined_model_id()
+        self._log_prefix = f"[GeminiProvider(ModelUserCfg:'{self._user_model_id}', APIModel:'{self._api_model_id}')]"
+        # 是否可通过 response_mime_type 强制JSON输出、是否使用独立系统提示，同样只取决于模型配置
+        self._supports_response_mime_json: bool = _get_model_family_profile(self._api_model_id)[0]
+        self._effective_supports_system_prompt: bool = bool(self.model_config.supports_system_prompt)
+        # 确定性调用 (temperature=0) 的精确匹配响应缓存；cache_ttl_seconds 为空或模型配置关闭 enable_response_cache 时禁用
+        self._response_cache: Optional[ResponseCache] = (
+            ResponseCache.from_provider_config(self.provider_config) if self.model_config.enable_response_cache else None
+        )
+        self._semantic_cache: Optional[SemanticResponseCache] = semantic_cache
+        # (API模型ID, 系统提示, 安全设置) -> GenerativeModel；三者都是模型的构造参数，相同组合可复用同一实例
+        self._model_cache: "OrderedDict[Tuple[str, Optional[str], Tuple[Tuple[str, str], ...]], Any]" = OrderedDict()
+        # (API模型ID, 系统提示) 的哈希 -> (CachedContent, 绑定该缓存的 GenerativeModel, 本地记录的过期时间)
+        self._context_caches: Dict[str, Tuple[Any, Any, float]] = {}
+        # 服务端拒绝创建上下文缓存 (如内容低于最小 token 数) 的键，不再重复尝试
+        self._context_cache_ineligible: set = set()
+        self._context_cache_lock = asyncio.Lock()
+        # (default_temperature, default_max_completion_tokens)；初始化及配置重载时从同一份配置快照刷新
+        self._cached_llm_defaults: Optional[Tuple[Optional[float], Optional[int]]] = None
+        self.default_safety_settings: Optional[List[SafetySettingDict]] = None
+        # 默认安全设置的模型缓存键，随安全设置一起更新，避免每次取模型实例时重新排序
+        self._default_safety_key: Optional[Tuple[Tuple[str, str], ...]] = ()
+        self._capabilities_cached: Optional[Dict[str, Any]] = None
+        # 超时设置在提供商生命周期内不变，各次请求共用同一个 request_options；配置无效时在构造阶段即报错
+        self._request_options: Optional[Dict[str, Any]] = _build_request_options(self.provider_config.api_timeout_seconds)
+        config_service.add_config_reload_listener(self._on_config_reload)
+        # 首次遇到不带 usage_metadata 的响应时记录一次警告
+        self._usage_metadata_missing_logged = False
+        # 进行中的确定性请求：缓存键 -> 结果 Future，相同请求并发到达时共享同一次 API 调用
+        self._inflight_requests: Dict[str, "asyncio.Future[LLMResponse]"] = {}
+        # 客户端侧的并发上限，避免突发请求同时打到服务端触发 429/503
+        self._request_semaphore = asyncio.Semaphore(self.provider_config.max_concurrent_requests or 32)
 
-        if not GEMINI_SDK_AVAILABLE or not genai:
+        if not _lazy_import_sdk() or not genai:
             logger.error("GeminiProvider 初始化失败：google-generativeai SDK 未安装或未成功导入。")
             self.client = None
             self._sdk_ready = False
             return
 
         self._sdk_ready = True
+        self._api_key: Optional[str] = None
         api_key_to_use = self.model_config.api_key
 
         if not api_key_to_use:
@@ -97,33 +412,22 @@ class GeminiProvider(BaseLLMProvider):
                 self._sdk_ready = False
                 return
         try:
-            genai.configure(api_key=api_key_to_use)
+            _configure_genai_once(api_key_to_use)
+            self._api_key = api_key_to_use
             self.client = genai # 表示 genai 已配置
             
-            app_config_obj = config_service.get_config()
-            gemini_safety_config_dict = app_config_obj.llm_settings.gemini_safety_settings or {}
-            
-            self.default_safety_settings: Optional[List[SafetySettingDict]] = None
-            if isinstance(gemini_safety_config_dict, dict) and gemini_safety_config_dict:
-                parsed_settings: List[SafetySettingDict] = []
-                for category_str, threshold_str in gemini_safety_config_dict.items():
-                    category_enum = HARM_CATEGORY_MAP.get(category_str.upper())
-                    threshold_enum = HARM_BLOCK_THRESHOLD_MAP.get(threshold_str.upper())
-                    if category_enum and threshold_enum:
-                        parsed_settings.append({ # type: ignore[misc]
-                            "category": category_enum,
-                            "threshold": threshold_enum
-                        })
-                    else:
-                        logger.warning(f"GeminiProvider: 无效的安全设置类别 '{category_str}' 或阈值 '{threshold_str}'。将忽略。")
-                if parsed_settings:
-                    self.default_safety_settings = parsed_settings
+            global_llm_settings = config_service.get_config().llm_settings
+            self._cached_llm_defaults = (global_llm_settings.default_temperature, global_llm_settings.default_max_completion_tokens)
+            self.default_safety_settings: Optional[List[SafetySettingDict]] = self._load_default_safety_settings(global_llm_settings)
+            self._default_safety_key = _safety_settings_cache_key(self.default_safety_settings)
             
             logger.info(
-                f"GeminiProvider for model '{self.model_config.user_given_name}' (API ID: {self.get_model_identifier_for_api()}) "
+                f"GeminiProvider for model '{self.model_config.user_given_name}' (API ID: {self._api_model_id}) "
                 f"已配置。API Key来源: {'模型配置' if self.model_config.api_key else '环境变量或先前配置'}。 "
                 f"安全设置: {self.default_safety_settings or 'SDK默认'}."
             )
+            if self.provider_config.prewarm_connection:
+                self._schedule_connection_prewarm()
         except Exception as e:
             logger.error(f"GeminiProvider (模型: {self.model_config.user_given_name}) 配置 google.generativeai 失败: {e}", exc_info=True)
             self.client = None
@@ -132,6 +436,94 @@ class GeminiProvider(BaseLLMProvider):
     def is_client_ready(self) -> bool:
         return bool(self._sdk_ready and self.client is not None)
 
+    def _schedule_connection_prewarm(self) -> None:
+        """
+        在后台发起一次极小的 count_tokens 请求，提前完成 SDK 异步通道的 DNS/TLS/HTTP2 握手，
+        使首个真实的 generate 请求无需承担建连延迟。每个 API 密钥只预热一次；不在事件循环中构造时跳过。
+        """
+        api_key_hash = hashlib.sha256((self._api_key or "").encode("utf-8")).hexdigest()
+        if api_key_hash in _PREWARMED_API_KEY_HASHES:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        _PREWARMED_API_KEY_HASHES.add(api_key_hash)
+        prewarm_task = running_loop.create_task(self._prewarm_connection())
+        _BACKGROUND_TASKS.add(prewarm_task)
+        prewarm_task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+    async def _prewarm_connection(self) -> None:
+        try:
+            model_instance = self._get_model_instance(self._api_model_id, None, None)
+            await model_instance.count_tokens_async("a", request_options=self._request_options)
+            logger.debug("GeminiProvider (模型: %s) 连接预热完成。", self.model_config.user_given_name)
+        except Exception as e_prewarm:
+            # 预热失败不影响正常请求，真实请求会自行建立连接
+            logger.debug("GeminiProvider (模型: %s) 连接预热失败: %s", self.model_config.user_given_name, e_prewarm)
+
+    @classmethod
+    async def aclose_shared_clients(cls) -> None:
+        """关闭同步 SDK 调用使用的专用线程池（在应用关闭时调用；之后再次使用时会重新创建）。"""
+        global _GEMINI_SYNC_EXECUTOR
+        sync_executor, _GEMINI_SYNC_EXECUTOR = _GEMINI_SYNC_EXECUTOR, None
+        if sync_executor is not None:
+            sync_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load_default_safety_settings(self, global_llm_settings: Any) -> Optional[List[SafetySettingDict]]:
+        gemini_safety_config_dict = global_llm_settings.gemini_safety_settings or {}
+        if isinstance(gemini_safety_config_dict, dict) and gemini_safety_config_dict:
+            parsed_settings = _parse_safety_settings(tuple(sorted(
+                (str(category_str), str(threshold_str)) for category_str, threshold_str in gemini_safety_config_dict.items()
+            )))
+            if parsed_settings:
+                return list(parsed_settings) # type: ignore[arg-type]
+        return None
+
+    def _on_config_reload(self) -> None:
+        # 重载后立即从新配置取一次快照，稳态请求路径不再调用 get_config()
+        global_llm_settings = config_service.get_config().llm_settings
+        self._cached_llm_defaults = (global_llm_settings.default_temperature, global_llm_settings.default_max_completion_tokens)
+        if not self.is_client_ready():
+            return
+        reloaded_safety_settings = self._load_default_safety_settings(global_llm_settings)
+        if reloaded_safety_settings != self.default_safety_settings:
+            # 安全设置是 GenerativeModel 的构造参数，已缓存的模型实例需随之重建
+            self.default_safety_settings = reloaded_safety_settings
+            self._default_safety_key = _safety_settings_cache_key(reloaded_safety_settings)
+            self._model_cache.clear()
+            # 上下文缓存绑定了旧的安全设置：先取出待丢弃的条目，再删除对应的服务端 CachedContent，
+            # 否则它们在剩余有效期内仍按存储时长计费
+            dropped_cached_contents = [context_cache_entry[0] for context_cache_entry in self._context_caches.values()]
+            self._context_caches.clear()
+            self._schedule_cached_content_deletion(dropped_cached_contents)
+
+    def _schedule_cached_content_deletion(self, cached_contents: List[Any]) -> None:
+        """在后台（专用线程池）删除服务端 CachedContent；不在事件循环中调用时（如同步路由的工作线程）直接同步删除。"""
+        if not cached_contents:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            _delete_cached_contents(cached_contents, self.model_config.user_given_name)
+            return
+        deletion_task = running_loop.create_task(_run_sync_sdk_call(_delete_cached_contents, cached_contents, self.model_config.user_given_name))
+        _BACKGROUND_TASKS.add(deletion_task)
+        deletion_task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+    def _get_llm_defaults(self) -> Tuple[Optional[float], Optional[int]]:
+        """返回 (default_temperature, default_max_completion_tokens)，热路径上无需再访问配置对象。"""
+        if self._cached_llm_defaults is None:
+            global_llm_settings = config_service.get_config().llm_settings
+            self._cached_llm_defaults = (global_llm_settings.default_temperature, global_llm_settings.default_max_completion_tokens)
+        return self._cached_llm_defaults
+
+    def _resolve_request_options(self, llm_override_parameters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """llm_override_parameters 指定 timeout 时为本次调用单独构造 request_options，否则复用初始化时的字典。"""
+        if llm_override_parameters and llm_override_parameters.get("timeout") is not None:
+            return _build_request_options(llm_override_parameters["timeout"])
+        return self._request_options
+
     async def generate(
         self,
         prompt: str,
@@ -143,96 +535,159 @@ class GeminiProvider(BaseLLMProvider):
         **kwargs: Any
     ) -> LLMResponse:
 
-        if not self.is_client_ready() or not genai or not GenerationConfig:
+        if not self._sdk_ready or self.client is None or not genai or not GenerationConfig:
             logger.error(f"GeminiProvider (模型: {self.model_config.user_given_name}) 客户端未就绪或SDK组件缺失，无法执行生成。")
             raise LLMConnectionError("Gemini客户端未初始化或SDK组件缺失", provider=self.PROVIDER_TAG)
 
-        effective_model_api_id = self.get_model_identifier_for_api()
-        log_prefix = f"[GeminiProvider(ModelUserCfg:'{self.get_user_defined_model_id()}', APIModel:'{effective_model_api_id}')]"
+        effective_model_api_id = self._api_model_id
+        log_prefix = self._log_prefix
 
-        gen_config_dict: Dict[str, Any] = {}
-        global_llm_settings = config_service.get_config().llm_settings
-
-        final_temp = temperature if temperature is not None else global_llm_settings.default_temperature
-        if final_temp is not None: gen_config_dict["temperature"] = float(final_temp)
-        
-        final_max_tokens = max_tokens
-        if llm_override_parameters and llm_override_parameters.get("max_output_tokens") is not None:
-            final_max_tokens = int(llm_override_parameters["max_output_tokens"])
-        elif llm_override_parameters and llm_override_parameters.get("max_tokens") is not None:
-            final_max_tokens = int(llm_override_parameters["max_tokens"])
-        elif max_tokens is None:
-            final_max_tokens = global_llm_settings.default_max_completion_tokens
-
-        if final_max_tokens is not None: gen_config_dict["max_output_tokens"] = int(final_max_tokens)
-
-        if llm_override_parameters:
-            if "top_p" in llm_override_parameters and llm_override_parameters["top_p"] is not None:
-                gen_config_dict["top_p"] = float(llm_override_parameters["top_p"])
-            if "top_k" in llm_override_parameters and llm_override_parameters["top_k"] is not None:
-                gen_config_dict["top_k"] = int(llm_override_parameters["top_k"])
-            if "stop_sequences" in llm_override_parameters and llm_override_parameters["stop_sequences"] is not None:
-                stop_seq = llm_override_parameters["stop_sequences"]
-                if isinstance(stop_seq, list) and all(isinstance(s, str) for s in stop_seq):
-                    gen_config_dict["stop_sequences"] = stop_seq
-                elif isinstance(stop_seq, str):
-                    gen_config_dict["stop_sequences"] = [stop_seq]
-        
-        if is_json_output and ("1.5" in effective_model_api_id or "2.5" in effective_model_api_id):
-            gen_config_dict["response_mime_type"] = "application/json"
-            logger.debug(f"{log_prefix} 已为模型 '{effective_model_api_id}' 启用JSON输出模式 (response_mime_type)。")
-        elif is_json_output:
-            logger.warning(f"{log_prefix} 模型 '{effective_model_api_id}' 可能不支持通过 response_mime_type 强制JSON输出。建议在Prompt中明确指示JSON格式。")
+        gen_config_dict = self._build_generation_config_dict(is_json_output, temperature, max_tokens, llm_override_parameters, log_prefix)
+        request_options = self._resolve_request_options(llm_override_parameters)
 
         generation_config_obj = GenerationConfig(**gen_config_dict) if gen_config_dict else None
         
         model_init_params: Dict[str, Any] = {}
-        if system_prompt and self.model_config.supports_system_prompt:
+        if system_prompt and self._effective_supports_system_prompt:
             model_init_params["system_instruction"] = system_prompt
-        elif system_prompt:
-            logger.warning(f"{log_prefix} 模型 '{self.get_user_defined_model_id()}' 配置为不支持独立系统提示，但调用时提供了。将尝试合并到用户提示。")
-            prompt = f"{system_prompt}\n\n---\n\n用户请求：\n{prompt}"
+        merged_system_prompt: Optional[str] = None
+        if system_prompt and not self._effective_supports_system_prompt:
+            logger.warning(f"{log_prefix} 模型 '{self._user_model_id}' 配置为不支持独立系统提示，但调用时提供了。将作为对话开头的独立轮次发送。")
+            merged_system_prompt = system_prompt
+
+        contents_for_api = _build_contents_for_api(prompt, merged_system_prompt)
 
-        contents_for_api: List[Union[str, ContentDict]] = [prompt] # type: ignore[assignment]
+        # 仅缓存确定性调用：相同的 (模型, 系统提示, 提示, 生成配置) 必然得到可复用的结果。
+        # 调用方单独指定安全设置时，结果可能与默认安全设置下不同，既不查找也不写入缓存
+        is_deterministic_call = gen_config_dict.get("temperature") == 0
+        call_safety_settings = kwargs.get("safety_settings")
+        is_cacheable_call = is_deterministic_call and not call_safety_settings
+        request_key_params = {
+            "model": effective_model_api_id,
+            "messages": [model_init_params.get("system_instruction"), merged_system_prompt, prompt],
+            "response_format": gen_config_dict,
+        }
+        cache_key: Optional[str] = None
+        if self._response_cache is not None and is_cacheable_call:
+            cache_key = build_response_cache_key(request_key_params)
+            cached_response = await self._response_cache.get(cache_key)
+            if cached_response is not None:
+                logger.debug("%s 命中响应缓存。缓存统计: %s", log_prefix, self._response_cache.stats)
+                return cached_response._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
 
+        # 精确匹配未命中时，再在同一 (模型, 系统提示, 生成配置) 范围内按提示的语义相似度查找（JSON 输出不参与）
+        semantic_scope: Optional[str] = None
+        semantic_vector: Optional[Any] = None
+        if self._semantic_cache is not None and is_cacheable_call and not is_json_output:
+            semantic_hit, semantic_scope, semantic_vector = await self._semantic_cache.lookup_prompt(request_key_params, system_prompt, prompt, self.provider_config.semantic_cache_threshold)
+            if semantic_hit is not None:
+                logger.debug("%s 命中语义缓存。缓存统计: %s", log_prefix, self._semantic_cache.stats)
+                return semantic_hit._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+        if not is_cacheable_call:
+            return await self._request_generation(
+                model_init_params.get("system_instruction"), contents_for_api, generation_config_obj, call_safety_settings,
+                log_prefix, cache_key, semantic_scope, semantic_vector, request_options
+            )
+
+        # 单飞合并：相同的确定性请求正在进行时，等待其结果而不是再发起一次 API 调用
+        inflight_key = cache_key or build_response_cache_key(request_key_params)
+        inflight_future = self._inflight_requests.get(inflight_key)
+        if inflight_future is not None:
+            try:
+                shared_response = await asyncio.shield(inflight_future)
+            except asyncio.CancelledError:
+                if not inflight_future.cancelled():
+                    raise
+                # 发起请求的调用方被取消，由当前调用方自行请求
+            else:
+                logger.debug("%s 合并到进行中的相同请求。", log_prefix)
+                return shared_response._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+        inflight_future = asyncio.get_running_loop().create_future()
+        # 没有等待者时也标记异常已被读取，避免 "Future exception was never retrieved" 警告
+        inflight_future.add_done_callback(lambda done_future: done_future.cancelled() or done_future.exception())
+        self._inflight_requests[inflight_key] = inflight_future
         try:
-            model_instance = genai.GenerativeModel(
-                model_name=effective_model_api_id,
-                **model_init_params,
-                safety_settings=self.default_safety_settings or kwargs.get("safety_settings")
+            llm_response = await self._request_generation(
+                model_init_params.get("system_instruction"), contents_for_api, generation_config_obj, None,
+                log_prefix, cache_key, semantic_scope, semantic_vector, request_options
             )
+        except Exception as e_inflight:
+            inflight_future.set_exception(e_inflight)
+            raise
+        except BaseException:
+            inflight_future.cancel()
+            raise
+        else:
+            inflight_future.set_result(llm_response)
+            return llm_response
+        finally:
+            if self._inflight_requests.get(inflight_key) is inflight_future:
+                del self._inflight_requests[inflight_key]
+
+    async def _request_generation(
+        self,
+        system_instruction: Optional[str],
+        contents_for_api: Union[str, List[Any]],
+        generation_config_obj: Optional[Any],
+        call_safety_settings: Optional[Any],
+        log_prefix: str,
+        cache_key: Optional[str],
+        semantic_scope: Optional[str],
+        semantic_vector: Optional[Any],
+        request_options: Optional[Dict[str, Any]] = None
+    ) -> LLMResponse:
+        """发起一次 generate_content 请求，转换为 LLMResponse 并写入已启用的缓存。"""
+        effective_model_api_id = self._api_model_id
+        # 足够长的系统提示使用服务端上下文缓存，跳过每次调用对该前缀的重复 prefill；调用方单独指定安全设置时不使用
+        context_cache_key: Optional[str] = None
+        context_cache_entry: Optional[Tuple[Any, Any, float]] = None
+        if system_instruction and not call_safety_settings:
+            context_cache_key, context_cache_entry = await self._ensure_context_cache(effective_model_api_id, system_instruction, log_prefix)
+
+        try:
+            if context_cache_entry is not None:
+                model_instance = context_cache_entry[1]
+            else:
+                model_instance = self._get_model_instance(effective_model_api_id, system_instruction, call_safety_settings)
         except Exception as e_model_init:
-            logger.error(f"{log_prefix} 创建Gemini GenerativeModel实例失败: {e_model_init}", exc_info=True)
+            logger.error(f"{log_prefix} 创建Gemini GenerativeModel实例失败: {e_model_init}", exc_info=logger.isEnabledFor(logging.DEBUG))
             raise LLMAPIError(f"创建Gemini模型实例失败: {e_model_init}", provider=self.PROVIDER_TAG) from e_model_init
 
-        logger.debug(f"{log_prefix} 请求 (部分): System Instruction Provided: {bool(model_init_params.get('system_instruction'))}, GenerationConfig: {generation_config_obj}, SafetySettings: {model_instance.safety_settings}")
+        logger.debug("%s 请求 (部分): System Instruction Provided: %s, GenerationConfig: %s, SafetySettings: %s", log_prefix, bool(system_instruction), generation_config_obj, getattr(model_instance, "safety_settings", None))
         
         prompt_tokens_count_for_exc = 0 # For safety exception
 
         try:
-            start_time_ns = time.perf_counter_ns()
-            # Count prompt tokens before generation for more accurate cost/error reporting
+            start_time = time.monotonic()
             try:
-                prompt_tokens_resp = await model_instance.count_tokens(contents_for_api) # type: ignore
-                prompt_tokens_count_for_exc = prompt_tokens_resp.total_tokens
-            except Exception as e_count_prompt_tokens:
-                logger.warning(f"{log_prefix} 调用 Gemini count_tokens (prompt) 失败: {e_count_prompt_tokens}。Prompt token数将设为0。")
-
+                response = await self._generate_content_with_retry(model_instance, contents_for_api, generation_config_obj, log_prefix, request_options=request_options)
+            except GoogleAPICoreExceptions.NotFound:
+                if context_cache_key is None or context_cache_entry is None:
+                    raise
+                # 上下文缓存已在服务端过期或被删除：丢弃本地记录（下次调用重建），本次改为直接发送系统提示
+                logger.info(f"{log_prefix} 上下文缓存 {getattr(context_cache_entry[0], 'name', '')} 已失效，本次改用完整系统提示。")
+                self._context_caches.pop(context_cache_key, None)
+                model_instance = self._get_model_instance(effective_model_api_id, system_instruction, None)
+                response = await self._generate_content_with_retry(model_instance, contents_for_api, generation_config_obj, log_prefix, request_options=request_options)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%s API调用耗时: %.2fms", log_prefix, (time.monotonic() - start_time) * 1000.0)
 
-            response = await model_instance.generate_content(
-                contents=contents_for_api, # type: ignore
-                generation_config=generation_config_obj,
-                request_options={"timeout": self.provider_config.api_timeout_seconds} if self.provider_config.api_timeout_seconds else None
-            )
-            duration_ms = (time.perf_counter_ns() - start_time_ns) / 1_000_000
-            logger.debug(f"{log_prefix} API调用耗时: {duration_ms:.2f}ms")
+            # 响应自带 usage_metadata，无需额外的 count_tokens 请求
+            usage_metadata = getattr(response, "usage_metadata", None)
+            if usage_metadata is not None:
+                prompt_tokens_count_for_exc = usage_metadata.prompt_token_count or 0
 
             if response.prompt_feedback and response.prompt_feedback.block_reason:
                 block_reason_msg = response.prompt_feedback.block_reason.name
                 logger.error(f"{log_prefix} Gemini API 因提示内容安全问题阻止了请求: {block_reason_msg}. Details: {response.prompt_feedback.safety_ratings}")
+                if usage_metadata is None:
+                    # 仅在抛出安全异常且响应未携带用量时才额外统计提示 token
+                    prompt_tokens_count_for_exc = (await self._count_tokens_fallback(model_instance, contents_for_api, "", log_prefix))[0]
                 raise GlobalContentSafetyException(
                     message=f"Gemini API 因提示内容安全阻止了请求: {block_reason_msg}",
-                    provider=self.PROVIDER_TAG, model_id=self.get_user_defined_model_id(),
+                    provider=self.PROVIDER_TAG, model_id=self._user_model_id,
                     details={"prompt_feedback": str(response.prompt_feedback)},
                     prompt_tokens=prompt_tokens_count_for_exc,
                     finish_reason="prompt_content_filter" # Or map block_reason_msg
@@ -247,9 +702,11 @@ class GeminiProvider(BaseLLMProvider):
 
             if finish_reason_name == "SAFETY":
                 logger.error(f"{log_prefix} Gemini API 响应的完成原因为 'SAFETY'。Safety Ratings: {candidate.safety_ratings}")
+                if usage_metadata is None:
+                    prompt_tokens_count_for_exc = (await self._count_tokens_fallback(model_instance, contents_for_api, "", log_prefix))[0]
                 raise GlobalContentSafetyException(
                     message=f"Gemini API 因生成内容安全问题阻止了响应 (finish_reason: SAFETY)。",
-                    provider=self.PROVIDER_TAG, model_id=self.get_user_defined_model_id(),
+                    provider=self.PROVIDER_TAG, model_id=self._user_model_id,
                     details={"candidate_feedback": str(candidate)},
                     prompt_tokens=prompt_tokens_count_for_exc,
                     finish_reason=finish_reason_name
@@ -258,119 +715,620 @@ class GeminiProvider(BaseLLMProvider):
                 logger.error(f"{log_prefix} Gemini API 响应的完成原因为 '{finish_reason_name}' (非预期)。Safety Ratings: {candidate.safety_ratings}")
                 raise LLMAPIError(f"Gemini API 响应的完成原因为 '{finish_reason_name}' (非预期，模型: {effective_model_api_id})", provider=self.PROVIDER_TAG)
 
-            generated_text = "".join(part.text for part in candidate.content.parts if hasattr(part, 'text') and part.text)
+            generated_text = _join_candidate_text(candidate)
             if not generated_text.strip() and finish_reason_name != "STOP":
                  logger.warning(f"{log_prefix} Gemini API 返回空文本，但完成原因不是 STOP (而是 {finish_reason_name})。")
             
-            completion_tokens_count = 0
-            try:
-                completion_tokens_resp = await model_instance.count_tokens(generated_text)
-                completion_tokens_count = completion_tokens_resp.total_tokens
-            except Exception as e_count_completion_tokens:
-                logger.warning(f"{log_prefix} 调用 Gemini count_tokens (completion) 失败: {e_count_completion_tokens}。Completion token数将设为0。")
-
-            total_tokens_count = prompt_tokens_count_for_exc + completion_tokens_count
-            logger.debug(f"{log_prefix} Token 使用情况: Prompt={prompt_tokens_count_for_exc}, Completion={completion_tokens_count}, Total={total_tokens_count}")
+            if usage_metadata is not None:
+                completion_tokens_count = usage_metadata.candidates_token_count or 0
+                total_tokens_count = usage_metadata.total_token_count or (prompt_tokens_count_for_exc + completion_tokens_count)
+            else:
+                if not self._usage_metadata_missing_logged:
+                    self._usage_metadata_missing_logged = True
+                    logger.warning(f"{log_prefix} 响应未携带 usage_metadata，将通过额外的 count_tokens 请求统计用量 (此提示每个提供商实例只记录一次)。")
+                prompt_tokens_count_for_exc, completion_tokens_count = await self._count_tokens_fallback(model_instance, contents_for_api, generated_text, log_prefix)
+                total_tokens_count = prompt_tokens_count_for_exc + completion_tokens_count
+            logger.debug("%s Token 使用情况: Prompt=%d, Completion=%d, Total=%d", log_prefix, prompt_tokens_count_for_exc, completion_tokens_count, total_tokens_count)
             
-            return LLMResponse(
+            llm_response = LLMResponse(
                 text=generated_text,
-                model_id_used=self.get_user_defined_model_id(),
+                model_id_used=self._user_model_id,
                 prompt_tokens=prompt_tokens_count_for_exc,
                 completion_tokens=completion_tokens_count,
                 total_tokens=total_tokens_count,
                 finish_reason=finish_reason_name,
                 error=None
             )
+            if cache_key is not None and self._response_cache is not None:
+                await self._response_cache.set(cache_key, llm_response)
+            if semantic_vector is not None and semantic_scope is not None and self._semantic_cache is not None:
+                self._semantic_cache.store(semantic_scope, semantic_vector, llm_response)
+            return llm_response
         
-        except GlobalContentSafetyException: # Re-raise our specific safety exception
+        except LLMAPIError: # 已转换的异常 (含内容安全异常) 直接抛出
             raise
-        except GoogleAPICoreExceptions.PermissionDenied as e:
+        except Exception as e_generate:
+            raise self._translate_api_error(e_generate, log_prefix, prompt_tokens_count_for_exc) from e_generate
+
+    def _translate_api_error(self, e: Exception, log_prefix: str, prompt_tokens: int = 0) -> LLMAPIError:
+        """将 SDK / google.api_core 异常转换为统一的 LLMAPIError 子类 (generate 与 generate_stream 共用)。"""
+        if isinstance(e, GoogleAPICoreExceptions.PermissionDenied):
             error_message = f"Gemini API 权限被拒绝: {e.message if hasattr(e, 'message') else str(e)}"
             logger.error(f"{log_prefix} {error_message}", exc_info=False)
-            raise LLMAuthenticationError(error_message, provider=self.PROVIDER_TAG) from e
-        except GoogleAPICoreExceptions.ResourceExhausted as e: # Often for rate limits
+            return LLMAuthenticationError(error_message, provider=self.PROVIDER_TAG)
+        if isinstance(e, GoogleAPICoreExceptions.ResourceExhausted): # Often for rate limits
             error_message = f"Gemini API 资源耗尽 (可能速率限制): {e.message if hasattr(e, 'message') else str(e)}"
             logger.warning(f"{log_prefix} {error_message}")
-            raise LLMRateLimitError(error_message, provider=self.PROVIDER_TAG) from e
-        except (GoogleAPICoreExceptions.DeadlineExceeded, GoogleAPICoreExceptions.ServiceUnavailable) as e:
+            return LLMRateLimitError(error_message, provider=self.PROVIDER_TAG)
+        if isinstance(e, (GoogleAPICoreExceptions.DeadlineExceeded, GoogleAPICoreExceptions.ServiceUnavailable)):
             error_message = f"Gemini API 连接或超时错误: {e.message if hasattr(e, 'message') else str(e)}"
             logger.warning(f"{log_prefix} {error_message}")
-            raise LLMConnectionError(error_message, provider=self.PROVIDER_TAG) from e
-        except GoogleAPICoreExceptions.GoogleAPIError as e_google_api:
-            error_message_str = getattr(e_google_api, 'message', str(e_google_api))
-            logger.error(f"{log_prefix} Google API 通用错误 (模型: {effective_model_api_id}): {error_message_str}", exc_info=False)
+            return LLMConnectionError(error_message, provider=self.PROVIDER_TAG)
+        if isinstance(e, GoogleAPICoreExceptions.GoogleAPIError):
+            error_message_str = getattr(e, 'message', str(e))
+            # 服务端错误属于运行事件而非代码缺陷：只记录异常类型与状态码，不输出堆栈
+            logger.error(f"{log_prefix} Google API 通用错误 {type(e).__name__} (code: {getattr(e, 'code', None)}, 模型: {self._api_model_id}): {error_message_str}")
             
-            err_str_lower = error_message_str.lower()
             # Check for safety related terms, excluding known non-safety permission/API key errors
-            is_api_safety_error = any(keyword in err_str_lower for keyword in ["safety", "blocked", "policy violation", "recitation", "prohibited"]) and \
-                                  not ("api key" in err_str_lower or "permission" in err_str_lower or "quota" in err_str_lower)
+            is_api_safety_error = bool(_SAFETY_ERROR_INCLUDE_RE.search(error_message_str)) and not _SAFETY_ERROR_EXCLUDE_RE.search(error_message_str)
 
             if is_api_safety_error:
-                logger.error(f"{log_prefix} Google API 错误似乎与内容安全相关: {e_google_api}")
-                raise GlobalContentSafetyException(
+                logger.error(f"{log_prefix} Google API 错误似乎与内容安全相关: {e}")
+                return GlobalContentSafetyException(
                     message=f"Google API 错误可能与内容安全相关: {error_message_str}",
-                    provider=self.PROVIDER_TAG, model_id=self.get_user_defined_model_id(),
-                    details={"error_type": type(e_google_api).__name__, "error_details": str(e_google_api)},
-                    prompt_tokens=prompt_tokens_count_for_exc,
+                    provider=self.PROVIDER_TAG, model_id=self._user_model_id,
+                    details={"error_type": type(e).__name__, "error_details": str(e)},
+                    prompt_tokens=prompt_tokens,
                     finish_reason="safety_related_api_error"
                 )
-            raise LLMAPIError(f"Google API 错误: {error_message_str}", provider=self.PROVIDER_TAG) from e_google_api
-        except Exception as e_generate_unknown:
-            logger.error(f"{log_prefix} 调用 Gemini API generate 时发生未知错误: {e_generate_unknown}", exc_info=True)
-            raise LLMAPIError(f"调用 Gemini 模型时发生未知错误: {str(e_generate_unknown)}", provider=self.PROVIDER_TAG) from e_generate_unknown
+            return LLMAPIError(f"Google API 错误: {error_message_str}", provider=self.PROVIDER_TAG)
+        # 完整堆栈仅在 DEBUG 级别输出：服务端故障期间大量失败请求逐一格式化 traceback 会阻塞事件循环
+        logger.error(f"{log_prefix} 调用 Gemini API generate 时发生未知错误 ({type(e).__name__}): {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
+        return LLMAPIError(f"调用 Gemini 模型时发生未知错误: {str(e)}", provider=self.PROVIDER_TAG)
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[LLMResponse]:
+        """
+        流式生成。每收到一段增量文本即产出一个 LLMResponse（text 为本段增量）；
+        最后产出一个 text 为空的 LLMResponse，携带 finish_reason 与整次调用的 token 用量 (取自最后一个数据块的 usage_metadata)。
+        JSON 输出模式需要完整响应才能解析，此时退化为一次 generate() 调用并产出其完整结果。
+        """
+        if is_json_output:
+            yield await self.generate(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters, **kwargs)
+            return
+
+        if not self.is_client_ready() or not genai or not GenerationConfig:
+            logger.error(f"GeminiProvider (模型: {self.model_config.user_given_name}) 客户端未就绪或SDK组件缺失，无法执行生成。")
+            raise LLMConnectionError("Gemini客户端未初始化或SDK组件缺失", provider=self.PROVIDER_TAG)
+
+        effective_model_api_id = self._api_model_id
+        log_prefix = f"[GeminiProvider(ModelUserCfg:'{self._user_model_id}', APIModel:'{effective_model_api_id}', Stream)]"
+        gen_config_dict = self._build_generation_config_dict(is_json_output, temperature, max_tokens, llm_override_parameters, log_prefix)
+        request_options = self._resolve_request_options(llm_override_parameters)
+        generation_config_obj = GenerationConfig(**gen_config_dict) if gen_config_dict else None
+
+        system_instruction: Optional[str] = None
+        if system_prompt and self._effective_supports_system_prompt:
+            system_instruction = system_prompt
+        contents_for_api = _build_contents_for_api(prompt, None if system_instruction else system_prompt)
+
+        context_cache_entry: Optional[Tuple[Any, Any, float]] = None
+        if system_instruction and not kwargs.get("safety_settings"):
+            _, context_cache_entry = await self._ensure_context_cache(effective_model_api_id, system_instruction, log_prefix)
+        try:
+            if context_cache_entry is not None:
+                model_instance = context_cache_entry[1]
+            else:
+                model_instance = self._get_model_instance(effective_model_api_id, system_instruction, kwargs.get("safety_settings"))
+        except Exception as e_model_init:
+            logger.error(f"{log_prefix} 创建Gemini GenerativeModel实例失败: {e_model_init}", exc_info=logger.isEnabledFor(logging.DEBUG))
+            raise LLMAPIError(f"创建Gemini模型实例失败: {e_model_init}", provider=self.PROVIDER_TAG) from e_model_init
+
+        model_id_used = self._user_model_id
+        prompt_tokens = 0
+        completion_tokens = 0
+        total_tokens = 0
+        finish_reason_name: Optional[str] = None
+        streamed_text_parts: List[str] = [] # 仅在数据块均未携带 usage_metadata 时用于 count_tokens 回退
+
+        try:
+            start_time = time.monotonic()
+            first_chunk_logged = not logger.isEnabledFor(logging.DEBUG)
+            response_stream = await self._generate_content_with_retry(model_instance, contents_for_api, generation_config_obj, log_prefix, stream=True, request_options=request_options)
+            async for chunk in response_stream:
+                usage_metadata = getattr(chunk, "usage_metadata", None)
+                if usage_metadata is not None and usage_metadata.total_token_count:
+                    prompt_tokens = usage_metadata.prompt_token_count or 0
+                    completion_tokens = usage_metadata.candidates_token_count or 0
+                    total_tokens = usage_metadata.total_token_count
+
+                if chunk.prompt_feedback and chunk.prompt_feedback.block_reason:
+                    block_reason_msg = chunk.prompt_feedback.block_reason.name
+                    logger.error(f"{log_prefix} Gemini API 因提示内容安全问题阻止了请求: {block_reason_msg}. Details: {chunk.prompt_feedback.safety_ratings}")
+                    raise GlobalContentSafetyException(
+                        message=f"Gemini API 因提示内容安全阻止了请求: {block_reason_msg}",
+                        provider=self.PROVIDER_TAG, model_id=model_id_used,
+                        details={"prompt_feedback": str(chunk.prompt_feedback)},
+                        prompt_tokens=prompt_tokens,
+                        finish_reason="prompt_content_filter"
+                    )
+                if not chunk.candidates:
+                    continue
+                candidate = chunk.candidates[0]
+                if candidate.finish_reason:
+                    finish_reason_name = candidate.finish_reason.name
+                if finish_reason_name == "SAFETY":
+                    logger.error(f"{log_prefix} Gemini 在流式输出过程中因内容安全终止 (finish_reason: SAFETY)。Safety Ratings: {candidate.safety_ratings}")
+                    raise GlobalContentSafetyException(
+                        message="Gemini API 因生成内容安全问题中止了流式响应 (finish_reason: SAFETY)。",
+                        provider=self.PROVIDER_TAG, model_id=model_id_used,
+                        details={"finish_reason": finish_reason_name},
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        total_tokens=total_tokens,
+                        finish_reason=finish_reason_name
+                    )
+                delta_text = _join_candidate_text(candidate)
+                if delta_text:
+                    streamed_text_parts.append(delta_text)
+                    if not first_chunk_logged:
+                        first_chunk_logged = True
+                        logger.debug("%s 首个 token 耗时: %.2fms", log_prefix, (time.monotonic() - start_time) * 1000.0)
+                    yield LLMResponse(
+                        text=delta_text,
+                        model_id_used=model_id_used,
+                        prompt_tokens=0,
+                        completion_tokens=0,
+                        total_tokens=0,
+                        finish_reason=None,
+                        error=None
+                    )
+        except LLMAPIError:
+            raise
+        except Exception as e_stream:
+            raise self._translate_api_error(e_stream, log_prefix, prompt_tokens) from e_stream
+
+        if not total_tokens:
+            prompt_tokens, completion_tokens = await self._count_tokens_fallback(model_instance, contents_for_api, "".join(streamed_text_parts), log_prefix)
+
+        yield LLMResponse(
+            text="",
+            model_id_used=model_id_used,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=total_tokens or prompt_tokens + completion_tokens,
+            finish_reason=finish_reason_name,
+            error=None
+        )
+
+    async def generate_many(
+        self,
+        prompts: List[str],
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        *,
+        max_concurrency: int = DEFAULT_GENERATE_MANY_CONCURRENCY,
+        rate_limit_per_min: Optional[float] = None
+    ) -> List[LLMResponse]:
+        """
+        为大量相互独立的提示生成结果，返回顺序与 prompts 一致。
+        provider_config.use_batch_api 开启且提示数不少于 batch_api_min_prompts 时，通过 Gemini Batch API 异步提交
+        （单价约为在线调用的一半，但完成时间可能长达数小时）；否则由基类按 max_concurrency / rate_limit_per_min 并发调用 generate()。
+        """
+        if not self.provider_config.use_batch_api or len(prompts) < self.provider_config.batch_api_min_prompts:
+            return await super().generate_many(
+                prompts, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters,
+                max_concurrency=max_concurrency, rate_limit_per_min=rate_limit_per_min
+            )
+
+        if not self.is_client_ready() or not self._api_key:
+            logger.error(f"GeminiProvider (模型: {self.model_config.user_given_name}) 客户端未就绪，无法提交 Batch 任务。")
+            raise LLMConnectionError("Gemini客户端未初始化或SDK组件缺失", provider=self.PROVIDER_TAG)
+        if not HTTPX_AVAILABLE or httpx is None:
+            raise LLMAPIError("httpx 未安装，无法使用 Gemini Batch API。请运行 'pip install httpx'", provider=self.PROVIDER_TAG)
+
+        effective_model_api_id = self._api_model_id
+        log_prefix = f"[GeminiProvider(Model:'{self._user_model_id}', BatchAPI)]"
+        gen_config_dict = self._build_generation_config_dict(is_json_output, temperature, max_tokens, llm_override_parameters, log_prefix)
+        request_bodies = [self._build_rest_request_body(prompt, system_prompt, gen_config_dict) for prompt in prompts]
+        try:
+            inlined_responses = await self._run_batch_job(effective_model_api_id, request_bodies, log_prefix)
+        except LLMAPIError:
+            raise
+        except Exception as e_batch:
+            logger.error(f"{log_prefix} Gemini Batch 任务失败: {e_batch}")
+            raise LLMAPIError(f"Gemini Batch 任务失败: {e_batch}", provider=self.PROVIDER_TAG) from e_batch
+
+        results: List[Optional[LLMResponse]] = [None] * len(prompts)
+        for fallback_position, inlined_response in enumerate(inlined_responses):
+            position = self._parse_batch_request_key((inlined_response.get("metadata") or {}).get("key"))
+            if position is None:
+                position = fallback_position # 未返回 metadata 时，结果按提交顺序排列
+            if position >= len(prompts):
+                continue
+            results[position] = self._batch_output_to_llm_response(inlined_response)
+
+        missing_positions = [position for position, result in enumerate(results) if result is None]
+        if missing_positions:
+            logger.warning(f"{log_prefix} Batch 结果缺少或失败 {len(missing_positions)}/{len(prompts)} 条，将单独请求这些提示。")
+            fallback_responses = await super().generate_many(
+                [prompts[position] for position in missing_positions], system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters,
+                max_concurrency=max_concurrency, rate_limit_per_min=rate_limit_per_min
+            )
+            for position, fallback_response in zip(missing_positions, fallback_responses):
+                results[position] = fallback_response
+        return results # type: ignore[return-value]
+
+    def _build_rest_request_body(self, prompt: str, system_prompt: Optional[str], gen_config_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """构造单个 GenerateContentRequest 的 REST 请求体（Batch API 内联请求使用）。"""
+        request_body: Dict[str, Any] = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        if system_prompt and not self._effective_supports_system_prompt:
+            request_body["contents"] = _build_contents_for_api(prompt, system_prompt)
+        elif system_prompt:
+            request_body["systemInstruction"] = {"parts": [{"text": system_prompt}]}
+        generation_config = {
+            REST_GENERATION_CONFIG_FIELDS[field_name]: value
+            for field_name, value in gen_config_dict.items() if field_name in REST_GENERATION_CONFIG_FIELDS
+        }
+        if generation_config:
+            request_body["generationConfig"] = generation_config
+        if self.default_safety_settings:
+            request_body["safetySettings"] = [
+                {"category": setting["category"].name, "threshold": setting["threshold"].name} # type: ignore[index]
+                for setting in self.default_safety_settings
+            ]
+        return request_body
+
+    async def _run_batch_job(self, model_api_id: str, request_bodies: List[Dict[str, Any]], log_prefix: str) -> List[Dict[str, Any]]:
+        """以内联请求创建 Batch 任务，按指数退避轮询直至结束，返回各条内联响应。"""
+        model_resource = model_api_id if model_api_id.startswith("models/") else f"models/{model_api_id}"
+        batch_payload = {
+            "batch": {
+                "display_name": f"novel-adapter-{model_api_id}-{int(time.time())}",
+                "input_config": {
+                    "requests": {
+                        "requests": [
+                            {"request": request_body, "metadata": {"key": f"request-{position}"}}
+                            for position, request_body in enumerate(request_bodies)
+                        ]
+                    }
+                }
+            }
+        }
+        headers = {"x-goog-api-key": self._api_key or "", "Content-Type": "application/json"}
+        async with httpx.AsyncClient(base_url=GEMINI_API_BASE_URL, headers=headers, timeout=self.provider_config.api_timeout_seconds or 60.0) as http_client:
+            create_response = await http_client.post(f"/{model_resource}:batchGenerateContent", content=json_dumps_bytes(batch_payload))
+            self._raise_for_batch_status(create_response, log_prefix)
+            batch_operation = json_loads(create_response.content)
+            batch_name = batch_operation.get("name")
+            if not batch_name:
+                raise LLMAPIError(f"Gemini Batch API 未返回任务名称: {batch_operation}", provider=self.PROVIDER_TAG)
+            logger.info(f"{log_prefix} 已提交 Batch 任务 {batch_name}，共 {len(request_bodies)} 个请求。")
+
+            poll_interval = self.provider_config.batch_api_poll_interval_seconds
+            while not batch_operation.get("done") and (batch_operation.get("metadata") or {}).get("state") not in BATCH_API_TERMINAL_STATES:
+                await asyncio.sleep(poll_interval)
+                poll_interval = min(BATCH_API_MAX_POLL_INTERVAL_SECONDS, poll_interval * 2)
+                poll_response = await http_client.get(f"/{batch_name}")
+                self._raise_for_batch_status(poll_response, log_prefix)
+                batch_operation = json_loads(poll_response.content)
+                logger.debug("%s Batch 任务 %s 状态: %s", log_prefix, batch_name, (batch_operation.get("metadata") or {}).get("state"))
+
+        batch_state = (batch_operation.get("metadata") or {}).get("state")
+        if batch_operation.get("error") or batch_state not in (None, "BATCH_STATE_SUCCEEDED", "JOB_STATE_SUCCEEDED"):
+            raise LLMAPIError(
+                f"Gemini Batch 任务 {batch_name} 未成功完成 (状态: {batch_state}, 错误: {batch_operation.get('error')})。",
+                provider=self.PROVIDER_TAG
+            )
+        # 结果位于 response.inlinedResponses.inlinedResponses（部分版本为 metadata.output.inlinedResponses）
+        batch_output = batch_operation.get("response") or (batch_operation.get("metadata") or {}).get("output") or {}
+        inlined_responses = batch_output.get("inlinedResponses") or {}
+        if isinstance(inlined_responses, dict):
+            inlined_responses = inlined_responses.get("inlinedResponses") or []
+        return list(inlined_responses)
+
+    def _raise_for_batch_status(self, http_response: Any, log_prefix: str) -> None:
+        if http_response.status_code < 400:
+            return
+        error_message = f"Gemini Batch API 请求失败 (HTTP {http_response.status_code}): {http_response.text[:500]}"
+        logger.error(f"{log_prefix} {error_message}")
+        if http_response.status_code in (401, 403):
+            raise LLMAuthenticationError(error_message, provider=self.PROVIDER_TAG)
+        if http_response.status_code == 429:
+            raise LLMRateLimitError(error_message, provider=self.PROVIDER_TAG)
+        raise LLMAPIError(error_message, provider=self.PROVIDER_TAG)
+
+    @staticmethod
+    def _parse_batch_request_key(request_key: Optional[str]) -> Optional[int]:
+        if not request_key or not request_key.startswith("request-"):
+            return None
+        try:
+            return int(request_key[len("request-"):])
+        except ValueError:
+            return None
+
+    def _batch_output_to_llm_response(self, inlined_response: Dict[str, Any]) -> Optional[LLMResponse]:
+        """把 Batch 的一条内联响应转换为 LLMResponse；失败的条目返回 None，由调用方单独重试。"""
+        response_body = inlined_response.get("response")
+        if inlined_response.get("error") or not response_body:
+            return None
+        usage = response_body.get("usageMetadata") or {}
+        prompt_tokens = usage.get("promptTokenCount", 0)
+        completion_tokens = usage.get("candidatesTokenCount", 0)
+        total_tokens = usage.get("totalTokenCount", prompt_tokens + completion_tokens)
+        block_reason = (response_body.get("promptFeedback") or {}).get("blockReason")
+        candidates = response_body.get("candidates") or []
+        finish_reason = candidates[0].get("finishReason") if candidates else None
+        if block_reason or finish_reason == "SAFETY":
+            # 单条被安全策略拦截不应让整批失败，以带 error 的 LLMResponse 返回
+            return LLMResponse(
+                text="",
+                model_id_used=self._user_model_id,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=total_tokens,
+                finish_reason="prompt_content_filter" if block_reason else finish_reason,
+                error=f"Gemini API 因内容安全问题阻止了响应 ({block_reason or 'finish_reason: SAFETY'})。"
+            )
+        if not candidates:
+            return None
+        generated_text = "".join(part.get("text", "") for part in (candidates[0].get("content") or {}).get("parts") or [])
+        return LLMResponse(
+            text=generated_text,
+            model_id_used=self._user_model_id,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=total_tokens,
+            finish_reason=finish_reason,
+            error=None
+        )
+
+    def _is_retryable_error(self, e: Exception) -> bool:
+        """资源耗尽 (429) 与服务不可用 (503) 为暂时性错误，可重试。"""
+        return isinstance(e, (GoogleAPICoreExceptions.ResourceExhausted, GoogleAPICoreExceptions.ServiceUnavailable))
+
+    async def _generate_content_with_retry(
+        self,
+        model_instance: Any,
+        contents_for_api: Union[str, List[Any]],
+        generation_config_obj: Optional[Any],
+        log_prefix: str,
+        stream: bool = False,
+        request_options: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        """
+        在并发信号量的保护下调用 generate_content_async。
+        对 429/503 按带抖动的指数退避重试（服务端给出 Retry-After 时至少等待该时长），最多 provider_config.max_retries 次；
+        等待期间不占用并发名额。stream=True 时仅保护建立流的请求，返回的异步迭代器在信号量之外消费。
+        request_options 为空时使用初始化时构造的 self._request_options。
+        """
+        if request_options is None:
+            request_options = self._request_options
+        max_request_retries = self.provider_config.max_retries if self.provider_config.max_retries is not None else DEFAULT_MAX_RETRIES
+        attempt = 0
+        while True:
+            try:
+                async with self._request_semaphore:
+                    return await model_instance.generate_content_async(
+                        contents=contents_for_api, # type: ignore
+                        generation_config=generation_config_obj,
+                        request_options=request_options,
+                        stream=stream
+                    )
+            except Exception as e_request:
+                if attempt >= max_request_retries or not self._is_retryable_error(e_request):
+                    raise
+                retry_delay = compute_backoff_delay(attempt, retry_after=get_retry_after_seconds(e_request))
+                attempt += 1
+                logger.warning(f"{log_prefix} 请求失败 ({type(e_request).__name__})，{retry_delay:.2f}秒后进行第 {attempt}/{max_request_retries} 次重试。")
+                await asyncio.sleep(retry_delay)
+
+    async def _count_tokens_fallback(self, model_instance: Any, contents_for_api: Union[str, List[Any]], generated_text: str, log_prefix: str) -> Tuple[int, int]:
+        """
+        响应缺少 usage_metadata 时，并发调用 count_tokens 统计提示与生成内容的 token 数；失败的一项记为0。
+        生成内容为空时其 token 数必为0，只发起提示一次请求。
+        """
+        count_requests = [model_instance.count_tokens_async(contents_for_api, request_options=self._request_options)]
+        if generated_text:
+            count_requests.append(model_instance.count_tokens_async(generated_text, request_options=self._request_options))
+        count_results = await asyncio.gather(*count_requests, return_exceptions=True)
+        token_counts: List[int] = []
+        for count_label, count_result in zip(("prompt", "completion"), count_results):
+            if isinstance(count_result, BaseException):
+                logger.warning(f"{log_prefix} 调用 Gemini count_tokens ({count_label}) 失败: {count_result}。对应 token 数将设为0。")
+                token_counts.append(0)
+            else:
+                token_counts.append(count_result.total_tokens)
+        return token_counts[0], token_counts[1] if len(token_counts) > 1 else 0
+
+    def _build_generation_config_dict(
+        self,
+        is_json_output: bool,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        llm_override_parameters: Optional[Dict[str, Any]],
+        log_prefix: str
+    ) -> Dict[str, Any]:
+        """构造 GenerationConfig 的参数字典（generate 与 generate_many 共用）。"""
+        effective_model_api_id = self._api_model_id
+        gen_config_dict: Dict[str, Any] = {}
+        default_temperature, default_max_completion_tokens = self._get_llm_defaults()
+
+        final_temp = temperature if temperature is not None else default_temperature
+        if final_temp is not None: gen_config_dict["temperature"] = float(final_temp)
+        
+        if llm_override_parameters:
+            for override_key, config_key, coerce_value in _GENERATION_OVERRIDE_SPEC:
+                override_value = llm_override_parameters.get(override_key)
+                if override_value is not None:
+                    coerced_value = coerce_value(override_value)
+                    if coerced_value is not None:
+                        gen_config_dict.setdefault(config_key, coerced_value)
+
+        if "max_output_tokens" not in gen_config_dict:
+            final_max_tokens = max_tokens if max_tokens is not None else default_max_completion_tokens
+            if final_max_tokens is not None: gen_config_dict["max_output_tokens"] = int(final_max_tokens)
+        
+        if is_json_output and self._supports_response_mime_json:
+            gen_config_dict["response_mime_type"] = "application/json"
+            logger.debug("%s 已为模型 '%s' 启用JSON输出模式 (response_mime_type)。", log_prefix, effective_model_api_id)
+            # 提供 response_schema (OpenAPI Schema 子集的字典) 时由服务端约束输出结构，返回文本仍是 JSON 字符串
+            response_schema = llm_override_parameters.get("response_schema") if llm_override_parameters else None
+            if isinstance(response_schema, dict):
+                gen_config_dict["response_schema"] = response_schema
+            elif response_schema is not None:
+                logger.warning(f"{log_prefix} response_schema 须为字典形式的 Schema，收到 {type(response_schema).__name__}。将忽略。")
+        elif is_json_output:
+            logger.warning(f"{log_prefix} 模型 '{effective_model_api_id}' 可能不支持通过 response_mime_type 强制JSON输出。建议在Prompt中明确指示JSON格式。")
+
+        return gen_config_dict
+
+    async def _ensure_context_cache(self, model_api_id: str, system_instruction: str, log_prefix: str) -> Tuple[Optional[str], Optional[Tuple[Any, Any, float]]]:
+        """
+        返回 (缓存键, 上下文缓存条目)。系统提示达到 context_cache_min_chars 个字符时，为其创建 CachedContent 并复用；
+        剩余有效期不足一半时续期。功能未开启、SDK 不支持或服务端拒绝时返回 (None, None)，调用方退回普通系统提示。
+        """
+        cache_ttl_seconds = self.provider_config.context_cache_ttl_seconds
+        # 按字符数粗筛，排除明显过短的提示，避免无谓的创建请求；是否达到最小缓存 token 数由服务端判定
+        if (not CONTEXT_CACHING_AVAILABLE or genai_caching is None or not cache_ttl_seconds or cache_ttl_seconds <= 0
+                or len(system_instruction) < self.provider_config.context_cache_min_chars):
+            return None, None
+        context_cache_key = hashlib.sha256(f"{model_api_id}\n{system_instruction}".encode("utf-8")).hexdigest()
+        if context_cache_key in self._context_cache_ineligible:
+            return None, None
+
+        async with self._context_cache_lock:
+            context_cache_entry = self._context_caches.get(context_cache_key)
+            now = time.monotonic()
+            if context_cache_entry is not None and context_cache_entry[2] - now > cache_ttl_seconds / 2:
+                return context_cache_key, context_cache_entry
+
+            cache_ttl = datetime.timedelta(seconds=cache_ttl_seconds)
+            if context_cache_entry is not None and context_cache_entry[2] > now:
+                try:
+                    await _run_sync_sdk_call(context_cache_entry[0].update, ttl=cache_ttl)
+                    context_cache_entry = (context_cache_entry[0], context_cache_entry[1], now + cache_ttl_seconds)
+                    self._context_caches[context_cache_key] = context_cache_entry
+                    return context_cache_key, context_cache_entry
+                except Exception as e_refresh:
+                    logger.warning(f"{log_prefix} 上下文缓存续期失败，将重新创建: {e_refresh}")
+            self._context_caches.pop(context_cache_key, None)
+
+            try:
+                cached_content = await _run_sync_sdk_call(
+                    genai_caching.CachedContent.create,
+                    model=model_api_id if model_api_id.startswith("models/") else f"models/{model_api_id}",
+                    system_instruction=system_instruction,
+                    ttl=cache_ttl
+                )
+                model_instance = genai.GenerativeModel.from_cached_content(
+                    cached_content=cached_content,
+                    safety_settings=self.default_safety_settings
+                )
+            except Exception as e_create:
+                logger.info(f"{log_prefix} 无法为系统提示创建上下文缓存，将直接发送系统提示: {e_create}")
+                if isinstance(e_create, GoogleAPICoreExceptions.InvalidArgument):
+                    self._context_cache_ineligible.add(context_cache_key)
+                return None, None
+            context_cache_entry = (cached_content, model_instance, now + cache_ttl_seconds)
+            self._context_caches[context_cache_key] = context_cache_entry
+            logger.debug("%s 已创建上下文缓存 %s。", log_prefix, getattr(cached_content, "name", ""))
+            return context_cache_key, context_cache_entry
+
+    def _get_model_instance(self, model_api_id: str, system_instruction: Optional[str], call_safety_settings: Optional[Any]) -> Any:
+        """
+        返回 (模型ID, 系统提示, 安全设置) 对应的 GenerativeModel，按 LRU 缓存复用。
+        配置了默认安全设置时使用默认设置，否则使用调用方传入的 safety_settings；
+        无法归一化为缓存键的安全设置 (非 {category, threshold} 列表) 每次单独构造，不进入缓存。
+        """
+        if self.default_safety_settings:
+            effective_safety_settings = self.default_safety_settings
+            safety_key = self._default_safety_key
+        else:
+            effective_safety_settings = call_safety_settings
+            safety_key = _safety_settings_cache_key(call_safety_settings)
+        if safety_key is None:
+            return genai.GenerativeModel(model_name=model_api_id, system_instruction=system_instruction, safety_settings=effective_safety_settings)
+        cache_key = (model_api_id, system_instruction, safety_key)
+        model_instance = self._model_cache.get(cache_key)
+        if model_instance is not None:
+            self._model_cache.move_to_end(cache_key)
+            return model_instance
+        model_instance = genai.GenerativeModel(model_name=model_api_id, system_instruction=system_instruction, safety_settings=effective_safety_settings)
+        self._model_cache[cache_key] = model_instance
+        if len(self._model_cache) > MAX_CACHED_MODEL_INSTANCES:
+            self._model_cache.popitem(last=False)
+        return model_instance
 
     def get_model_capabilities(self) -> Dict[str, Any]:
+        # 能力信息只取决于本实例的模型配置，首次推断后缓存；返回副本，避免调用方修改缓存内容
+        if self._capabilities_cached is None:
+            self._capabilities_cached = self._infer_model_capabilities()
+        return dict(self._capabilities_cached)
+
+    def _infer_model_capabilities(self) -> Dict[str, Any]:
         base_capabilities = {
             "max_context_tokens": self.model_config.max_context_tokens,
             "supports_system_prompt": self.model_config.supports_system_prompt,
         }
         
         if base_capabilities["max_context_tokens"] is None:
-            model_api_id = self.get_model_identifier_for_api().lower()
-            inferred_max_tokens = None
-            if "gemini-1.5-pro" in model_api_id or "gemini-1.5-flash" in model_api_id: inferred_max_tokens = 1048576
-            elif "gemini-2.5-pro" in model_api_id or "gemini-2.5-flash" in model_api_id: inferred_max_tokens = 1048576
-            elif "gemini-1.0-pro" in model_api_id or model_api_id == "gemini-pro": inferred_max_tokens = 32768
-            
+            model_api_id = self._api_model_id
+            inferred_max_tokens = _get_model_family_profile(model_api_id)[1]
+
             if inferred_max_tokens is not None:
                 base_capabilities["max_context_tokens"] = inferred_max_tokens
-                logger.debug(f"GeminiProvider for '{self.get_user_defined_model_id()}': 根据API模型ID '{model_api_id}' 推断 max_context_tokens 为 {inferred_max_tokens} (因用户未配置)。")
+                logger.debug("GeminiProvider for '%s': 根据API模型ID '%s' 推断 max_context_tokens 为 %s (因用户未配置)。", self._user_model_id, model_api_id, inferred_max_tokens)
 
         return base_capabilities
 
     async def get_available_models_from_api(self) -> List[Dict[str, Any]]:
-        log_prefix_list = f"[GeminiProvider(ListModels for UserCfg:'{self.get_user_defined_model_id()}')]"
+        log_prefix_list = f"[GeminiProvider(ListModels for UserCfg:'{self._user_model_id}')]"
         if not self.is_client_ready() or not genai:
             logger.warning(f"{log_prefix_list} SDK 未就绪，无法从API列出模型。")
             return []
-        
+
+        models_cache_key = hashlib.sha256((self._api_key or "").encode("utf-8")).hexdigest()
+        async with self._MODELS_CACHE_LOCK:
+            cached_models_entry = self._MODELS_CACHE.get(models_cache_key)
+            if cached_models_entry is not None and time.monotonic() - cached_models_entry[0] < self.provider_config.models_list_ttl_seconds:
+                logger.debug("%s 使用缓存的模型列表。", log_prefix_list)
+                return [dict(model_info) for model_info in cached_models_entry[1]]
+            available_models_result = await self._list_models_from_api(log_prefix_list)
+            if available_models_result and self.provider_config.models_list_ttl_seconds > 0:
+                self._MODELS_CACHE[models_cache_key] = (time.monotonic(), [dict(model_info) for model_info in available_models_result])
+            return available_models_result
+
+    async def _list_models_from_api(self, log_prefix_list: str) -> List[Dict[str, Any]]:
         try:
             logger.info(f"{log_prefix_list} 尝试从Google API列出可用模型...")
             
-            # list_models is synchronous, so wrap in to_thread for async context
-            def sync_list_models():
-                if not genai: return []
-                model_infos_list = []
-                for m in genai.list_models():
-                    if 'generateContent' in m.supported_generation_methods and \
-                       m.name.startswith("models/gemini-"): # Ensure it's a Gemini text generation model
-                        model_infos_list.append(m)
-                return model_infos_list
-
-            model_infos_iterator = await asyncio.to_thread(sync_list_models)
+            model_infos = await self._fetch_model_infos()
             
-            available_models_result: List[Dict[str, Any]] = []
-            for model_info in model_infos_iterator:
-                api_model_id = model_info.name.replace("models/", "")
-                model_dict = {
-                    "id": api_model_id,
-                    "name": model_info.display_name or api_model_id,
+            # Ensure it's a Gemini text generation model
+            available_models_result: List[Dict[str, Any]] = [
+                {
+                    "id": model_info["name"].replace("models/", ""),
+                    "name": model_info.get("display_name") or model_info["name"].replace("models/", ""),
                     "provider_tag": self.PROVIDER_TAG,
-                    "notes": model_info.description or f"由 Google Gemini API 发现。",
-                    "max_context_tokens": model_info.input_token_limit or None,
+                    "notes": model_info.get("description") or f"由 Google Gemini API 发现。",
+                    "max_context_tokens": model_info.get("input_token_limit") or None,
                     "supports_system_prompt": True # Gemini models generally support system prompts
                 }
-                available_models_result.append(model_dict)
+                for model_info in model_infos
+                if 'generateContent' in model_info["supported_generation_methods"] and model_info["name"].startswith("models/gemini-")
+            ]
             
             if not available_models_result: # Fallback if API returns empty or filtered list is empty
                 logger.warning(f"{log_prefix_list} Google API 未返回任何 Gemini 生成模型，或过滤后为空。返回已知模型列表。")
@@ -394,6 +1352,53 @@ class GeminiProvider(BaseLLMProvider):
             logger.error(f"{log_prefix_list} 从Google API列出模型时发生错误: {e_list_models}", exc_info=True)
             return []
 
+    async def _fetch_model_infos(self) -> List[Dict[str, Any]]:
+        """
+        列出模型的原始信息。安装了 httpx 时直接异步调用 REST models.list (分页读取)，
+        否则使用 grpc_asyncio 的 ModelServiceAsyncClient；两者都不可用时才在专用线程池中执行同步的 genai.list_models()。
+        """
+        if HTTPX_AVAILABLE and httpx is not None and self._api_key:
+            model_infos: List[Dict[str, Any]] = []
+            headers = {"x-goog-api-key": self._api_key}
+            async with httpx.AsyncClient(base_url=GEMINI_API_BASE_URL, headers=headers, timeout=self.provider_config.api_timeout_seconds or 60.0) as http_client:
+                page_params: Dict[str, Any] = {"pageSize": 1000}
+                while True:
+                    list_response = await http_client.get("/models", params=page_params)
+                    list_response.raise_for_status()
+                    list_page = json_loads(list_response.content)
+                    for model_data in list_page.get("models") or []:
+                        model_infos.append({
+                            "name": model_data.get("name", ""),
+                            "display_name": model_data.get("displayName"),
+                            "description": model_data.get("description"),
+                            "input_token_limit": model_data.get("inputTokenLimit"),
+                            "supported_generation_methods": model_data.get("supportedGenerationMethods") or [],
+                        })
+                    next_page_token = list_page.get("nextPageToken")
+                    if not next_page_token:
+                        return model_infos
+                    page_params["pageToken"] = next_page_token
+
+        try:
+            # google-generativeai 依赖的底层客户端库提供基于 grpc_asyncio 的模型服务客户端，直接在事件循环上分页读取
+            from google.ai import generativelanguage as glm # type: ignore[attr-defined]
+            from google.api_core.client_options import ClientOptions # type: ignore[attr-defined]
+            model_service_client = glm.ModelServiceAsyncClient(client_options=ClientOptions(api_key=self._api_key))
+        except (ImportError, AttributeError):
+            model_service_client = None
+        if model_service_client is not None:
+            return [
+                _sdk_model_to_info(model_info)
+                async for model_info in await model_service_client.list_models(page_size=1000)
+            ]
+
+        # 兼容缺少异步模型服务客户端的旧版本：在专用线程池中执行同步的 genai.list_models()
+        def sync_list_models() -> List[Dict[str, Any]]:
+            if not genai: return []
+            return [_sdk_model_to_info(model_info) for model_info in genai.list_models()]
+
+        return await _run_sync_sdk_call(sync_list_models)
+
     async def test_connection(
         self,
         model_api_id_for_test: Optional[str] = None,
@@ -401,7 +1406,7 @@ class GeminiProvider(BaseLLMProvider):
         if not self.is_client_ready() or not genai:
             return False, "Gemini SDK未初始化或不可用。", ["请检查依赖库 google-generativeai 是否已正确安装和配置API密钥。"]
 
-        test_model_id = model_api_id_for_test or self.provider_config.default_test_model_id or self.get_model_identifier_for_api()
+        test_model_id = model_api_id_for_test or self.provider_config.default_test_model_id or self._api_model_id
         if not test_model_id:
             return False, "无法确定用于测试的Gemini模型ID。", ["请在配置中指定 default_test_model_id 或确保当前模型配置了 model_identifier_for_api。"]
         
@@ -415,10 +1420,8 @@ class GeminiProvider(BaseLLMProvider):
         
         model_instance_for_test: Optional[Any] = None
         try:
-            model_instance_for_test = genai.GenerativeModel(
-                model_name=test_model_id_cleaned,
-                safety_settings=self.default_safety_settings # 使用配置的安全设置
-            )
+            # 使用配置的安全设置；与 generate 共用模型实例缓存
+            model_instance_for_test = self._get_model_instance(test_model_id_cleaned, None, None)
         except Exception as e_model_create_test:
             logger.error(f"[Gemini-TestConnection] 创建测试模型实例 '{test_model_id_cleaned}' 失败: {e_model_create_test}", exc_info=False)
             return False, f"创建Gemini测试模型实例 '{test_model_id_cleaned}' 失败。", [f"错误: {str(e_model_create_test)[:200]}"]
@@ -427,43 +1430,38 @@ class GeminiProvider(BaseLLMProvider):
              return False, f"未能为测试创建Gemini模型 '{test_model_id_cleaned}' 实例。", None
 
         try:
-            # response = await asyncio.to_thread(
-            #     model_instance_for_test.generate_content, "Hello!",
-            #     generation_config=GenerationConfig(max_output_tokens=5, temperature=0.1) if GenerationConfig else None
-            # )
-            response = await model_instance_for_test.generate_content(
+            response = await model_instance_for_test.generate_content_async(
                 "Hello!", # type: ignore
-                generation_config=GenerationConfig(max_output_tokens=5, temperature=0.1) if GenerationConfig else None # type: ignore
+                generation_config=GenerationConfig(max_output_tokens=5, temperature=0.1) if GenerationConfig else None, # type: ignore
+                request_options=self._request_options
             )
 
-
             if response.prompt_feedback and response.prompt_feedback.block_reason:
                 block_reason_msg = response.prompt_feedback.block_reason.name
                 logger.warning(f"[Gemini-TestConnection] 测试请求被安全策略阻止: {block_reason_msg}")
                 return False, f"测试请求被Gemini安全策略阻止 (原因: {block_reason_msg})。", [f"Safety Ratings: {response.prompt_feedback.safety_ratings}"]
 
-            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts[0].text:
-                logger.info(f"[Gemini-TestConnection] 连接成功。模型响应 (预览): {response.candidates[0].content.parts[0].text[:50]}...")
-                return True, f"成功连接到Gemini并从模型 {test_model_id_cleaned} 收到响应。", [f"响应预览: {response.candidates[0].content.parts[0].text[:100]}..."]
+            response_preview = _join_candidate_text(response.candidates[0])[:100] if response.candidates else ""
+            if response_preview:
+                logger.info("[Gemini-TestConnection] 连接成功。模型响应 (预览): %s...", response_preview[:50])
+                return True, f"成功连接到Gemini并从模型 {test_model_id_cleaned} 收到响应。", [f"响应预览: {response_preview}..."]
             else:
                 finish_reason_val = response.candidates[0].finish_reason.name if response.candidates and response.candidates[0].finish_reason else "未知"
                 logger.warning(f"[Gemini-TestConnection] 连接测试：模型 {test_model_id_cleaned} 返回了空内容。完成原因: {finish_reason_val}")
                 return False, f"连接到Gemini模型 {test_model_id_cleaned} 成功，但模型返回了空响应 (完成原因: {finish_reason_val})。", [f"原始响应对象 (部分): {str(response)[:200]}..."]
 
-        except GoogleAPICoreExceptions.PermissionDenied as e_auth:
-            logger.error(f"[Gemini-TestConnection] 认证失败 (模型: {test_model_id_cleaned}): {e_auth}", exc_info=False)
-            return False, "Gemini API认证失败。", [f"请检查您的API密钥是否正确并具有访问模型 {test_model_id_cleaned} 的权限。", f"错误详情: {str(e_auth)[:200]}"]
-        except GoogleAPICoreExceptions.ResourceExhausted as e_rate: # 通常是速率限制
-            logger.warning(f"[Gemini-TestConnection] 遭遇资源耗尽/速率限制 (模型: {test_model_id_cleaned}): {e_rate}")
-            return False, "Gemini API资源耗尽或速率限制。", [f"请稍后再试或检查您的API使用限制。", f"错误详情: {str(e_rate)[:200]}"]
-        except (GoogleAPICoreExceptions.DeadlineExceeded, GoogleAPICoreExceptions.ServiceUnavailable) as e_conn:
-            logger.error(f"[Gemini-TestConnection] 连接或超时错误 (模型: {test_model_id_cleaned}): {e_conn}", exc_info=False)
-            return False, "无法连接到Gemini API或请求超时。", [f"请检查您的网络连接和Google Cloud服务状态。", f"错误详情: {str(e_conn)[:200]}"]
-        except GoogleAPICoreExceptions.GoogleAPIError as e_api:
-            msg = getattr(e_api, 'message', str(e_api))
-            logger.error(f"[Gemini-TestConnection] API调用时发生错误 (模型: {test_model_id_cleaned}): {msg}", exc_info=True)
-            details = [f"错误类型: {type(e_api).__name__}", f"错误消息: {str(msg)[:200]}"]
-            return False, f"调用Gemini API时发生错误 (模型: {test_model_id_cleaned})。", details
-        except Exception as e_unknown_test:
-            logger.error(f"[Gemini-TestConnection] 测试连接时发生未知错误 (模型: {test_model_id_cleaned}): {e_unknown_test}", exc_info=True)
-            return False, "测试Gemini连接时发生未知错误。", [f"错误详情: {str(e_unknown_test)[:200]}"]
\ No newline at end of file
+        except Exception as e_test:
+            # 与 generate 共用异常分类，再转换为连接测试的 (成功与否, 消息, 详情) 结果
+            translated_error = self._translate_api_error(e_test, f"[Gemini-TestConnection(Model:'{test_model_id_cleaned}')]")
+            error_details = f"错误详情: {str(e_test)[:200]}"
+            if isinstance(translated_error, LLMAuthenticationError):
+                return False, "Gemini API认证失败。", [f"请检查您的API密钥是否正确并具有访问模型 {test_model_id_cleaned} 的权限。", error_details]
+            if isinstance(translated_error, LLMRateLimitError):
+                return False, "Gemini API资源耗尽或速率限制。", ["请稍后再试或检查您的API使用限制。", error_details]
+            if isinstance(translated_error, LLMConnectionError):
+                return False, "无法连接到Gemini API或请求超时。", ["请检查您的网络连接和Google Cloud服务状态。", error_details]
+            if isinstance(translated_error, GlobalContentSafetyException):
+                return False, "测试请求被Gemini安全策略阻止。", [error_details]
+            if isinstance(e_test, GoogleAPICoreExceptions.GoogleAPIError):
+                return False, f"调用Gemini API时发生错误 (模型: {test_model_id_cleaned})。", [f"错误类型: {type(e_test).__name__}", f"错误消息: {str(getattr(e_test, 'message', e_test))[:200]}"]
+            return False, "测试Gemini连接时发生未知错误。", [error_details]
\ No newline at end of file
@@ -1,8 +1,11 @@
 # backend/app/llm_providers/grok_provider.py
+import asyncio
+import hashlib
 import logging
 import os
+import re
 import time
-from typing import Dict, Any, Optional, Tuple, List, Union
+from typing import Dict, Any, Optional, Tuple, List, Union, AsyncIterator, Callable, TypeVar
 
 # Grok API 与 OpenAI API 兼容，因此使用 openai SDK
 try:
@@ -19,10 +22,20 @@ except ImportError:
     OPENAI_SDK_FOR_GROK_AVAILABLE = False
     logging.warning("OpenAI SDK (用于GrokProvider) 未安装。GrokProvider 将不可用。请运行 'pip install openai'")
 
+# HTTP/2 多路复用需要 h2 (pip install "httpx[http2]")；未安装时回退到 HTTP/1.1
+try:
+    import h2 # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
 # 导入新的基类和响应模型
 from .base_llm_provider import BaseLLMProvider, LLMResponse
+from .provider_utils import HTTPX_AVAILABLE, AsyncTokenBucket, LazyJson, OrjsonAsyncHTTPClient, estimate_message_tokens, get_account_rate_limiters, httpx, settle_token_usage
+from .response_cache import ResponseCache, SemanticResponseCache, build_response_cache_key
 # 导入类型化的配置模型和全局配置服务
 from app import schemas, config_service
+from app.services import tokenizer_service
 
 # 从 app.exceptions 导入统一的异常类
 from app.exceptions import (
@@ -36,8 +49,35 @@ from app.exceptions import (
 
 logger = logging.getLogger(__name__)
 
+_T = TypeVar("_T")
+
 DEFAULT_GROK_BASE_URL = "https://api.groq.com/openai/v1" # Groq (注意是'q') 官方 API 地址
 
+# 共享连接池的上限与空闲连接保活时间
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 50
+HTTP_KEEPALIVE_EXPIRY_SECONDS = 60.0
+# HTTP/2 下并发请求在同一连接上多路复用，所需连接数少得多
+HTTP2_MAX_KEEPALIVE_CONNECTIONS = 20
+
+# 进程级共享的 httpx 客户端，键为 (base_url, 是否启用HTTP/2)。
+# 按请求创建 GrokProvider 时（如 FastAPI 依赖注入），各实例的 AsyncOpenAI 复用同一个连接池，避免每次调用都重新进行 DNS 解析和 TLS 握手。
+# 客户端在同步的 __init__ 中创建（期间没有 await，不会发生并发插入）；关闭时由 _SHARED_HTTPX_LOCK 保护。
+_SHARED_HTTPX: Dict[Tuple[str, bool], "httpx.AsyncClient"] = {}
+_SHARED_HTTPX_LOCK = asyncio.Lock()
+# 表示内容安全拦截的错误码与错误信息关键字（新增关键字只需加在这里）
+CONTENT_SAFETY_ERROR_CODES = frozenset({"content_filter"})
+CONTENT_SAFETY_ERROR_KEYWORDS = ("safety policy", "content blocked", "content_filter", "unsafe content")
+# 关键字合并为一个预编译的忽略大小写正则，一次扫描即可完成匹配，且无需先复制一份小写文本
+CONTENT_SAFETY_ERROR_PATTERN = re.compile("|".join(re.escape(keyword) for keyword in CONTENT_SAFETY_ERROR_KEYWORDS), re.IGNORECASE)
+
+# 进行中的确定性请求：(账号范围, 缓存键) -> 结果 Future。按请求创建的多个实例之间也共享同一次 API 调用；
+# 键包含 base_url 与 api_key 的哈希，不同账号或代理地址的请求不会合并（否则无效密钥的调用可能拿到其他账号的结果）
+_INFLIGHT: Dict[Tuple[str, str], "asyncio.Future[LLMResponse]"] = {}
+_TOKEN_ENCODER_UNSET = object()
+# 配置要求 HTTP/2 但未安装 h2 时只警告一次
+_h2_fallback_warned = False
+
 # 移除本地定义的 ContentSafetyException
 # class ContentSafetyException(RuntimeError):
 # ... (本地定义已移除)
@@ -48,17 +88,48 @@ class GrokProvider(BaseLLMProvider):
     使用 openai Python 库与 Groq 的 OpenAI 兼容 API 进行交互。
     """
     PROVIDER_TAG = "grok" # 注意：这里指 xAI 的 Grok 模型，但通过 Groq API 访问
+    SUPPORTS_SEMANTIC_CACHE = True
+    # /models 列表缓存，键为 base_url，值为 (获取时间 monotonic, 模型列表)；Groq 的模型目录很少变化
+    _MODELS_CACHE: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
+    # llm_override_parameters 中允许透传给 Groq API 的参数
+    _VALID_OVERRIDE_KEYS = frozenset({"top_p", "stop", "stream", "seed"})
 
     def __init__(
         self,
         model_config: schemas.UserDefinedLLMConfigSchema,
-        provider_config: schemas.LLMProviderConfigSchema
+        provider_config: schemas.LLMProviderConfigSchema,
+        semantic_cache: Optional[SemanticResponseCache] = None
     ):
         """
         初始化 Groq API 的客户端。
+        semantic_cache: 可选的语义响应缓存（编排器在 enable_semantic_cache 启用时注入），在精确匹配缓存未命中后使用。
         """
         super().__init__(model_config, provider_config)
 
+        # 确定性调用 (temperature=0) 的精确匹配响应缓存；cache_ttl_seconds 为空或模型配置关闭 enable_response_cache 时禁用
+        self._response_cache: Optional[ResponseCache] = (
+            ResponseCache.from_provider_config(self.provider_config) if self.model_config.enable_response_cache else None
+        )
+        self._semantic_cache: Optional[SemanticResponseCache] = semantic_cache
+        # 每次请求都相同的模型信息与日志前缀预先计算好，热路径上无需重复调用与拼接
+        self._api_model_id: str = self.get_model_identifier_for_api()
+        self._user_model_id: str = self.get_user_defined_model_id()
+        self._log_prefix = f"[GrokProvider(Model:'{self._user_model_id}')]"
+        # 每次请求的 api_params 由此浅拷贝后再填充
+        self._base_api_params: Dict[str, Any] = {"model": self._api_model_id}
+        # 全局 llm_settings 的引用；配置重载时由 config_service 回调刷新，动态配置变更仍能生效
+        self._global_llm_settings: schemas.LLMSettingsConfigSchema = config_service.get_config().llm_settings
+        config_service.add_config_reload_listener(self._on_config_reload)
+
+        # 单飞合并的账号范围，在确定 API 密钥后设置
+        self._inflight_scope = ""
+        # RPM/TPM 主动限流器在确定 API 密钥后按账号获取，见 provider_utils.get_account_rate_limiters
+        self._rate_limiter: Optional[AsyncTokenBucket] = None
+        self._token_rate_limiter: Optional[AsyncTokenBucket] = None
+        # 本地 tiktoken 编码器，首次估算 token 时获取（None 表示不可用，回退到字符数估算）；编码器初始化后可在协程间共享
+        self._token_encoder: Any = _TOKEN_ENCODER_UNSET
+
         if not OPENAI_SDK_FOR_GROK_AVAILABLE or AsyncOpenAI is None:
             logger.error("GrokProvider 初始化失败：OpenAI SDK (用于Grok) 不可用。")
             self.client = None
@@ -82,6 +153,10 @@ class GrokProvider(BaseLLMProvider):
         
         # Groq API 的 base_url 是固定的，但允许用户覆盖以用于代理
         base_url_to_use = self.model_config.base_url if self.model_config.base_url is not None else DEFAULT_GROK_BASE_URL
+        self._rate_limiter, self._token_rate_limiter = get_account_rate_limiters(
+            self.PROVIDER_TAG, base_url_to_use, api_key_to_use, self.provider_config.rate_limit_rpm, self.provider_config.rate_limit_tpm
+        )
+        self._inflight_scope = f"{base_url_to_use}|{hashlib.sha256(api_key_to_use.encode('utf-8')).hexdigest()}"
 
         try:
             client_params: Dict[str, Any] = {
@@ -94,6 +169,9 @@ class GrokProvider(BaseLLMProvider):
                 client_params["max_retries"] = self.provider_config.max_retries
             else:
                 client_params["max_retries"] = 1 # Groq API 速度快，默认重试1次
+            shared_http_client = self._get_shared_http_client(base_url_to_use)
+            if shared_http_client is not None:
+                client_params["http_client"] = shared_http_client
 
             self.client: Optional[AsyncOpenAI] = AsyncOpenAI(**client_params)
             logger.info(f"GrokProvider 客户端 (模型: {self.model_config.user_given_name}) 已成功初始化。Base URL: {base_url_to_use}")
@@ -103,34 +181,97 @@ class GrokProvider(BaseLLMProvider):
             self.client = None
             self._sdk_ready = False
 
+    def _estimate_prompt_tokens(self, api_params: Dict[str, Any]) -> int:
+        """
+        估算请求消息的提示 token 数（见 provider_utils.estimate_message_tokens）。
+        Groq 上的 Llama/Mixtral 等模型没有对应的 tiktoken 编码，tokenizer_service 会回退到 cl100k_base，作为估算已足够接近。
+        """
+        if self._token_encoder is _TOKEN_ENCODER_UNSET:
+            self._token_encoder = tokenizer_service.get_tiktoken_encoding_for_model(self._api_model_id)
+        return estimate_message_tokens(self._token_encoder, api_params.get("messages", ()), self._log_prefix)
+
+    async def _compute_off_loop_if_large(self, func: Callable[[Dict[str, Any]], _T], api_params: Dict[str, Any]) -> _T:
+        """
+        对请求参数执行 CPU 密集的计算（缓存键哈希、本地分词）；消息总字符数超过 threaded_hash_threshold 时
+        改用 asyncio.to_thread 在线程池中执行，长上下文请求不会阻塞事件循环上的其他协程。
+        """
+        threshold = self.provider_config.threaded_hash_threshold
+        if threshold and sum(len(message.get("content") or "") for message in api_params["messages"]) > threshold:
+            return await asyncio.to_thread(func, api_params)
+        return func(api_params)
+
+    def _use_http2(self) -> bool:
+        """enable_http2 未显式关闭且已安装 h2 时使用 HTTP/2；配置显式启用但缺少 h2 时警告一次并回退到 HTTP/1.1。"""
+        global _h2_fallback_warned
+        if self.provider_config.enable_http2 is False:
+            return False
+        if H2_AVAILABLE:
+            return True
+        if self.provider_config.enable_http2 is True and not _h2_fallback_warned:
+            _h2_fallback_warned = True
+            logger.warning("GrokProvider: 配置启用了 HTTP/2，但未安装 h2。将回退到 HTTP/1.1。请运行 'pip install \"httpx[http2]\"'")
+        return False
+
+    def _get_shared_http_client(self, base_url: str) -> Optional["httpx.AsyncClient"]:
+        """返回该 base_url 共享的 httpx 客户端（首次使用时创建）；httpx 不可用时返回 None，由 SDK 自行创建。"""
+        if not HTTPX_AVAILABLE or OrjsonAsyncHTTPClient is None:
+            return None
+        use_http2 = self._use_http2()
+        pool_key = (base_url, use_http2)
+        shared_http_client = _SHARED_HTTPX.get(pool_key)
+        if shared_http_client is None or shared_http_client.is_closed:
+            # 超时由 AsyncOpenAI 按请求传入，这里的超时仅作为直接使用该客户端时的默认值
+            shared_http_client = OrjsonAsyncHTTPClient(
+                http2=use_http2,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    # HTTP/2 下并发的 generate() 请求通过同一条 TCP+TLS 连接多路复用
+                    max_keepalive_connections=HTTP2_MAX_KEEPALIVE_CONNECTIONS if use_http2 else HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+                ),
+                timeout=self.provider_config.api_timeout_seconds or 30.0
+            )
+            _SHARED_HTTPX[pool_key] = shared_http_client
+            logger.debug("GrokProvider: 为 %s 创建了共享 httpx 客户端 (HTTP/2: %s)。", base_url, use_http2)
+        return shared_http_client
+
+    @classmethod
+    async def aclose_shared_clients(cls) -> None:
+        """关闭进程级共享的所有 Groq httpx 客户端（在应用关闭时调用）。"""
+        async with _SHARED_HTTPX_LOCK:
+            shared_clients = list(_SHARED_HTTPX.values())
+            _SHARED_HTTPX.clear()
+            for shared_http_client in shared_clients:
+                try:
+                    await shared_http_client.aclose()
+                except Exception as e_close:
+                    logger.warning(f"关闭共享 Groq httpx 客户端时出错: {e_close}")
+
+    def _on_config_reload(self) -> None:
+        self._global_llm_settings = config_service.get_config().llm_settings
+
     def is_client_ready(self) -> bool:
         return bool(self._sdk_ready and self.client is not None)
 
-    async def generate(
+    def _build_api_params(
         self,
         prompt: str,
-        system_prompt: Optional[str] = None,
-        is_json_output: bool = False,
-        temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None,
-        llm_override_parameters: Optional[Dict[str, Any]] = None,
-        **kwargs: Any
-    ) -> LLMResponse:
-        if not self.is_client_ready() or self.client is None:
-            logger.error(f"GrokProvider (模型: {self.model_config.user_given_name}) 错误：客户端未初始化。")
-            raise LLMConnectionError("Grok客户端未初始化或未就绪", provider=self.PROVIDER_TAG)
-
+        system_prompt: Optional[str],
+        is_json_output: bool,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        llm_override_parameters: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """构造 chat.completions 请求参数（generate 与 generate_stream 共用）。"""
         messages: List[Dict[str, str]] = []
         if system_prompt and self.model_config.supports_system_prompt:
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": prompt})
         
-        global_llm_settings = config_service.get_config().llm_settings
-        
-        api_params: Dict[str, Any] = {
-            "model": self.get_model_identifier_for_api(),
-            "messages": messages,
-        }
+        global_llm_settings = self._global_llm_settings
+
+        api_params = self._base_api_params.copy()
+        api_params["messages"] = messages
 
         final_temp = temperature if temperature is not None else global_llm_settings.default_temperature
         if final_temp is not None: api_params["temperature"] = final_temp
@@ -145,33 +286,134 @@ class GrokProvider(BaseLLMProvider):
 
         if is_json_output:
             api_params["response_format"] = {"type": "json_object"}
-            logger.debug(f"为Grok模型 '{self.get_model_identifier_for_api()}' 启用了JSON输出模式。")
+            logger.debug("为Grok模型 '%s' 启用了JSON输出模式。", self._api_model_id)
 
         if llm_override_parameters:
-            valid_grok_params = ["top_p", "stop", "stream", "seed"]
-            filtered_llm_params = {k: v for k, v in llm_override_parameters.items() if k in valid_grok_params and v is not None}
-            api_params.update(filtered_llm_params)
+            # frozenset 与 dict.keys() 的交集在 C 层完成，直接写入 api_params，无需构造中间字典
+            for override_key in self._VALID_OVERRIDE_KEYS & llm_override_parameters.keys():
+                override_value = llm_override_parameters[override_key]
+                if override_value is not None:
+                    api_params[override_key] = override_value
+
+        return api_params
 
-        log_prefix = f"[GrokProvider(Model:'{self.get_user_defined_model_id()}')]"
-        logger.debug(f"{log_prefix} 请求参数 (部分): messages_count={len(messages)}, other_params_keys={list(set(api_params.keys()) - {'model', 'messages'})}")
+    async def generate(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> LLMResponse:
+        if not self.is_client_ready() or self.client is None:
+            logger.error(f"GrokProvider (模型: {self.model_config.user_given_name}) 错误：客户端未初始化。")
+            raise LLMConnectionError("Grok客户端未初始化或未就绪", provider=self.PROVIDER_TAG)
+
+        if llm_override_parameters and llm_override_parameters.get("stream"):
+            # 调用方通过覆盖参数要求流式：在内部消费流并组装为完整的 LLMResponse，返回类型保持不变
+            return await self._generate_buffered_from_stream(prompt, system_prompt, temperature, max_tokens, llm_override_parameters, **kwargs)
+
+        api_params = self._build_api_params(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters)
+
+        log_prefix = self._log_prefix
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s 请求参数 (部分): messages_count=%d, other_params_keys=%s", log_prefix, len(api_params["messages"]), api_params.keys() - {"model", "messages"})
         
+        # 仅缓存确定性的非流式调用：相同的 (model, messages, temperature, max_tokens, response_format, top_p, seed, stop) 必然得到可复用的结果
+        is_deterministic_call = api_params.get("temperature") == 0 and not api_params.get("stream")
+        cache_key: Optional[str] = None
+        if self._response_cache is not None and is_deterministic_call:
+            cache_key = await self._compute_off_loop_if_large(build_response_cache_key, api_params)
+            cached_response = await self._response_cache.get(cache_key)
+            if cached_response is not None:
+                logger.debug("%s 命中响应缓存。缓存统计: %s", log_prefix, self._response_cache.stats)
+                # 缓存命中没有产生新的 token 消耗
+                return cached_response._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+        # 精确匹配未命中时，再在同一 (模型, 系统提示, 生成参数) 范围内按用户提示的语义相似度查找（JSON 输出对措辞敏感，不参与语义缓存）
+        semantic_scope: Optional[str] = None
+        semantic_vector: Optional[Any] = None
+        if self._semantic_cache is not None and is_deterministic_call and not is_json_output:
+            semantic_hit, semantic_scope, semantic_vector = await self._semantic_cache.lookup_prompt(api_params, system_prompt, prompt, self.provider_config.semantic_cache_threshold)
+            if semantic_hit is not None:
+                logger.debug("%s 命中语义缓存。缓存统计: %s", log_prefix, self._semantic_cache.stats)
+                return semantic_hit._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+        if not is_deterministic_call:
+            return await self._request_completion(api_params, log_prefix, cache_key, semantic_scope, semantic_vector)
+
+        # 单飞合并：相同的确定性请求正在进行时（可能来自其他实例），等待其结果而不是再发起一次 API 调用
+        inflight_key = (self._inflight_scope, cache_key or await self._compute_off_loop_if_large(build_response_cache_key, api_params))
+        inflight_future = _INFLIGHT.get(inflight_key)
+        if inflight_future is not None:
+            try:
+                shared_response = await asyncio.shield(inflight_future)
+            except asyncio.CancelledError:
+                if not inflight_future.cancelled():
+                    raise
+                # 发起请求的调用方被取消，由当前调用方自行请求
+            else:
+                logger.debug("%s 合并到进行中的相同请求。", log_prefix)
+                return shared_response._replace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+        inflight_future = asyncio.get_running_loop().create_future()
+        # 没有等待者时也标记异常已被读取，避免 "Future exception was never retrieved" 警告
+        inflight_future.add_done_callback(lambda done_future: done_future.cancelled() or done_future.exception())
+        _INFLIGHT[inflight_key] = inflight_future
+        try:
+            llm_response = await self._request_completion(api_params, log_prefix, cache_key, semantic_scope, semantic_vector)
+        except Exception as e_inflight:
+            inflight_future.set_exception(e_inflight)
+            raise
+        except BaseException:
+            inflight_future.cancel()
+            raise
+        else:
+            inflight_future.set_result(llm_response)
+            return llm_response
+        finally:
+            if _INFLIGHT.get(inflight_key) is inflight_future:
+                del _INFLIGHT[inflight_key]
+
+    async def _request_completion(
+        self,
+        api_params: Dict[str, Any],
+        log_prefix: str,
+        cache_key: Optional[str],
+        semantic_scope: Optional[str],
+        semantic_vector: Optional[Any]
+    ) -> LLMResponse:
+        """发起一次 chat.completions 请求，转换为 LLMResponse 并写入已启用的缓存。"""
+        # 主动限流：按配置的 RPM/TPM 匀速提交请求，而不是等服务端返回 429 后再重试；
+        # TPM 发送前只预留提示 token，响应返回后按 usage 结算实际用量
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire()
+        reserved_tokens = 0
+        if self._token_rate_limiter is not None:
+            reserved_tokens = await self._compute_off_loop_if_large(self._estimate_prompt_tokens, api_params)
+            await self._token_rate_limiter.acquire(reserved_tokens)
+
         prompt_tokens_for_safety_exc = 0
         completion_tokens_for_safety_exc = 0
 
         try:
             start_time_ns = time.perf_counter_ns()
-            response = await self.client.chat.completions.create(**api_params) # type: ignore[arg-type]
+            response = await self.client.chat.completions.create(**api_params) # type: ignore[union-attr, arg-type]
             duration_ms = (time.perf_counter_ns() - start_time_ns) / 1_000_000
             logger.info(f"{log_prefix} Groq API 调用耗时: {duration_ms:.2f}ms")
 
             if not response.choices or not response.choices[0].message or response.choices[0].message.content is None:
-                logger.warning(f"{log_prefix} Groq API 响应中 choices[0].message.content 为空或不存在。响应: {response.model_dump_json(indent=2)}")
+                # 响应只转换为字典一次，日志与异常详情共用；日志中的 JSON 仅在该条日志实际输出时才序列化 (orjson)
+                response_dump = response.model_dump(exclude_none=True)
+                logger.warning("%s Groq API 响应中 choices[0].message.content 为空或不存在。响应: %s", log_prefix, LazyJson(response_dump))
                 if response.choices and response.choices[0].finish_reason == "content_filter":
                      logger.error(f"{log_prefix} Groq 内容过滤器触发。")
                      raise GlobalContentSafetyException(
                         message="Groq API 因内容过滤阻止了响应 (finish_reason: content_filter)。",
-                        provider=self.PROVIDER_TAG, model_id=self.get_user_defined_model_id(),
-                        details={"finish_reason": "content_filter", "response_dump": response.model_dump(exclude_none=True)},
+                        provider=self.PROVIDER_TAG, model_id=self._user_model_id,
+                        details={"finish_reason": "content_filter", "response_dump": response_dump},
                         prompt_tokens=response.usage.prompt_tokens if response.usage else 0,
                         finish_reason="content_filter"
                      )
@@ -181,65 +423,167 @@ class GrokProvider(BaseLLMProvider):
             
             token_usage_info = response.usage
             if token_usage_info:
+                settle_token_usage(self._token_rate_limiter, reserved_tokens, token_usage_info.total_tokens)
                 prompt_tokens_for_safety_exc = token_usage_info.prompt_tokens
                 completion_tokens_for_safety_exc = token_usage_info.completion_tokens
             
-            return LLMResponse(
+            llm_response = LLMResponse(
                 text=generated_text,
-                model_id_used=self.get_user_defined_model_id(),
+                model_id_used=self._user_model_id,
                 prompt_tokens=token_usage_info.prompt_tokens if token_usage_info else 0,
                 completion_tokens=token_usage_info.completion_tokens if token_usage_info else 0,
                 total_tokens=token_usage_info.total_tokens if token_usage_info else 0,
                 finish_reason=response.choices[0].finish_reason,
                 error=None
             )
-        # Map OpenAI SDK exceptions to custom LLM exceptions
-        except OpenAIAuthenticationError as e:
+            if cache_key is not None and self._response_cache is not None:
+                await self._response_cache.set(cache_key, llm_response)
+            if semantic_vector is not None and semantic_scope is not None and self._semantic_cache is not None:
+                self._semantic_cache.store(semantic_scope, semantic_vector, llm_response)
+            return llm_response
+        except Exception as e:
+            translated_error = self._translate_api_error(e, log_prefix, prompt_tokens_for_safety_exc)
+            if translated_error is e:
+                raise
+            raise translated_error from e
+
+    def _translate_api_error(self, e: Exception, log_prefix: str, prompt_tokens: int = 0) -> Exception:
+        """将 openai SDK 异常映射为应用统一的 LLM 异常并记录日志；已是应用异常的原样返回。"""
+        if isinstance(e, LLMAPIError):
+            return e
+        if isinstance(e, OpenAIAuthenticationError):
             error_message = f"Grok API 认证失败: {e.message if hasattr(e, 'message') else str(e)}"
             logger.error(f"{log_prefix} {error_message}", exc_info=False)
-            raise LLMAuthenticationError(error_message, provider=self.PROVIDER_TAG) from e
-        except RateLimitError as e:
+            return LLMAuthenticationError(error_message, provider=self.PROVIDER_TAG)
+        if isinstance(e, RateLimitError):
+            # 服务端额度已耗尽：清空本地令牌，使后续请求按补充速率等待
+            for rate_limiter in (self._rate_limiter, self._token_rate_limiter):
+                if rate_limiter is not None:
+                    rate_limiter.drain()
             error_message = f"Grok API 速率限制错误: {e.message if hasattr(e, 'message') else str(e)}"
             logger.warning(f"{log_prefix} {error_message}")
-            raise LLMRateLimitError(error_message, provider=self.PROVIDER_TAG) from e
-        except APIConnectionError as e:
-            error_message = f"Grok API 连接错误: {e.message if hasattr(e, 'message') else str(e)}"
-            logger.warning(f"{log_prefix} {error_message}")
-            raise LLMConnectionError(error_message, provider=self.PROVIDER_TAG) from e
-        except APITimeoutError as e:
+            return LLMRateLimitError(error_message, provider=self.PROVIDER_TAG)
+        if isinstance(e, APITimeoutError): # APITimeoutError 是 APIConnectionError 的子类，需先判断
             error_message = f"Grok API 超时错误: {e.message if hasattr(e, 'message') else str(e)}"
             logger.warning(f"{log_prefix} {error_message}")
-            raise LLMConnectionError(error_message, provider=self.PROVIDER_TAG) from e
-        except OpenAIBadRequestError as e: # Catches 400 errors
+            return LLMConnectionError(error_message, provider=self.PROVIDER_TAG)
+        if isinstance(e, APIConnectionError):
+            error_message = f"Grok API 连接错误: {e.message if hasattr(e, 'message') else str(e)}"
+            logger.warning(f"{log_prefix} {error_message}")
+            return LLMConnectionError(error_message, provider=self.PROVIDER_TAG)
+        if isinstance(e, OpenAIBadRequestError): # 400 错误
             error_text = e.message if hasattr(e, 'message') and e.message else str(e)
             error_code_val = getattr(e, 'code', None)
-            
-            is_safety_error = False
-            if error_code_val == 'content_filter' or any(keyword in error_text.lower() for keyword in ["safety policy", "content blocked"]):
-                is_safety_error = True
-            
-            if is_safety_error:
+            if error_code_val in CONTENT_SAFETY_ERROR_CODES or CONTENT_SAFETY_ERROR_PATTERN.search(error_text) is not None:
                 logger.error(f"{log_prefix} Groq API 错误指示内容安全问题 (Code: {error_code_val})。")
-                raise GlobalContentSafetyException(
+                return GlobalContentSafetyException(
                     message=error_text,
-                    provider=self.PROVIDER_TAG, model_id=self.get_user_defined_model_id(),
+                    provider=self.PROVIDER_TAG, model_id=self._user_model_id,
                     details={"http_status": e.status_code, "code": error_code_val, "body": getattr(e, 'body', None)},
-                    prompt_tokens=prompt_tokens_for_safety_exc,
+                    prompt_tokens=prompt_tokens,
                     finish_reason="content_filter"
-                ) from e
-            else:
-                error_message_full = f"Grok API 请求无效 (HTTP Status: {e.status_code}, Code: {error_code_val}): {error_text}"
-                logger.error(f"{log_prefix} {error_message_full}", exc_info=False)
-                raise LLMAPIError(error_message_full, provider=self.PROVIDER_TAG) from e
-        except OpenAIAPIError as e:
+                )
+            error_message_full = f"Grok API 请求无效 (HTTP Status: {e.status_code}, Code: {error_code_val}): {error_text}"
+            logger.error(f"{log_prefix} {error_message_full}", exc_info=False)
+            return LLMAPIError(error_message_full, provider=self.PROVIDER_TAG)
+        if isinstance(e, OpenAIAPIError):
             error_text = e.message if hasattr(e, 'message') and e.message else str(e)
             error_code_val = getattr(e, 'code', None)
-            error_message_full = f"Grok API 通用错误 (HTTP Status: {e.status_code}, Code: {error_code_val}): {error_text}"
+            error_message_full = f"Grok API 通用错误 (HTTP Status: {getattr(e, 'status_code', None)}, Code: {error_code_val}): {error_text}"
             logger.error(f"{log_prefix} {error_message_full}", exc_info=False)
-            raise LLMAPIError(error_message_full, provider=self.PROVIDER_TAG) from e
-        except Exception as e_generate_unknown:
-            logger.error(f"{log_prefix} 调用 Grok API generate 时发生未知错误: {e_generate_unknown}", exc_info=True)
-            raise LLMAPIError(f"调用 Grok 模型时发生未知错误: {str(e_generate_unknown)}", provider=self.PROVIDER_TAG) from e_generate_unknown
+            return LLMAPIError(error_message_full, provider=self.PROVIDER_TAG)
+        logger.error(f"{log_prefix} 调用 Grok API 时发生未知错误: {e}", exc_info=True)
+        return LLMAPIError(f"调用 Grok 模型时发生未知错误: {str(e)}", provider=self.PROVIDER_TAG)
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        is_json_output: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        llm_override_parameters: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[LLMResponse]:
+        """
+        流式生成。每收到一段增量文本即产出一个 LLMResponse（text 为本段增量）；
+        最后产出一个 text 为空的 LLMResponse，携带 finish_reason 与整次调用的 token 用量。
+        JSON 输出模式需要完整响应才能解析，此时退化为一次 generate() 调用并产出其完整结果。
+        """
+        if is_json_output:
+            yield await self.generate(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters, **kwargs)
+            return
+
+        if not self.is_client_ready() or self.client is None:
+            logger.error(f"GrokProvider (模型: {self.model_config.user_given_name}) 错误：客户端未初始化。")
+            raise LLMConnectionError("Grok客户端未初始化或未就绪", provider=self.PROVIDER_TAG)
+
+        api_params = self._build_api_params(prompt, system_prompt, is_json_output, temperature, max_tokens, llm_override_parameters)
+        api_params["stream"] = True
+        api_params["stream_options"] = {"include_usage": True} # 最后一个数据块携带 usage
+
+        log_prefix = self._log_prefix
+        model_id_used = self._user_model_id
+        prompt_tokens = 0
+        completion_tokens = 0
+        total_tokens = 0
+        finish_reason: Optional[str] = None
+
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire()
+        reserved_tokens = 0
+        if self._token_rate_limiter is not None:
+            reserved_tokens = await self._compute_off_loop_if_large(self._estimate_prompt_tokens, api_params)
+            await self._token_rate_limiter.acquire(reserved_tokens)
+
+        try:
+            stream = await self.client.chat.completions.create(**api_params) # type: ignore[arg-type]
+            async for chunk in stream:
+                if chunk.usage:
+                    prompt_tokens = chunk.usage.prompt_tokens
+                    completion_tokens = chunk.usage.completion_tokens
+                    total_tokens = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                if finish_reason == "content_filter":
+                    logger.error(f"{log_prefix} Groq 内容过滤器在流式输出过程中触发，终止读取。")
+                    raise GlobalContentSafetyException(
+                        message="Groq API 因内容过滤中止了流式响应 (finish_reason: content_filter)。",
+                        provider=self.PROVIDER_TAG, model_id=model_id_used,
+                        details={"finish_reason": finish_reason},
+                        prompt_tokens=prompt_tokens,
+                        finish_reason=finish_reason
+                    )
+                delta_text = choice.delta.content if choice.delta else None
+                if delta_text:
+                    yield LLMResponse(
+                        text=delta_text,
+                        model_id_used=model_id_used,
+                        prompt_tokens=0,
+                        completion_tokens=0,
+                        total_tokens=0,
+                        finish_reason=None,
+                        error=None
+                    )
+            settle_token_usage(self._token_rate_limiter, reserved_tokens, total_tokens)
+        except Exception as e:
+            translated_error = self._translate_api_error(e, log_prefix, prompt_tokens)
+            if translated_error is e:
+                raise
+            raise translated_error from e
+
+        yield LLMResponse(
+            text="",
+            model_id_used=model_id_used,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=total_tokens,
+            finish_reason=finish_reason,
+            error=None
+        )
 
     def get_model_capabilities(self) -> Dict[str, Any]:
         base_capabilities = {
@@ -248,13 +592,13 @@ class GrokProvider(BaseLLMProvider):
         }
         
         if base_capabilities["max_context_tokens"] is None:
-            model_api_id_lower = self.get_model_identifier_for_api().lower()
+            model_api_id_lower = self._api_model_id.lower()
             inferred_max_tokens = 8192 # Llama3-8b 和 Mixtral 的默认值
             if "llama3-70b" in model_api_id_lower: inferred_max_tokens = 8192
             elif "gemma" in model_api_id_lower: inferred_max_tokens = 8192
             
             base_capabilities["max_context_tokens"] = inferred_max_tokens
-            logger.debug(f"GrokProvider for '{self.get_user_defined_model_id()}': 推断 max_context_tokens 为 {inferred_max_tokens} (因用户未配置)。")
+            logger.debug(f"GrokProvider for '{self._user_model_id}': 推断 max_context_tokens 为 {inferred_max_tokens} (因用户未配置)。")
         
         if base_capabilities["supports_system_prompt"] is None:
             base_capabilities["supports_system_prompt"] = True # Groq 上的模型通常支持 system prompt
@@ -263,6 +607,13 @@ class GrokProvider(BaseLLMProvider):
 
     async def get_available_models_from_api(self) -> List[Dict[str, Any]]:
         log_prefix_list = f"[GrokProvider(ListModels)]"
+
+        models_cache_key = self.model_config.base_url or DEFAULT_GROK_BASE_URL
+        cached_models_entry = self._MODELS_CACHE.get(models_cache_key)
+        if cached_models_entry is not None and time.monotonic() - cached_models_entry[0] < self.provider_config.models_list_ttl_seconds:
+            logger.debug("%s 使用缓存的模型列表 (Base URL: %s)。", log_prefix_list, models_cache_key)
+            return [dict(model_info) for model_info in cached_models_entry[1]]
+
         client_to_use = self.client
         if not self.is_client_ready() or not client_to_use:
             logger.warning(f"{log_prefix_list} 主客户端未就绪，无法从API列出模型。")
@@ -280,28 +631,66 @@ class GrokProvider(BaseLLMProvider):
                         "notes": f"由 Groq API 提供。Owner: {getattr(model_obj, 'owned_by', 'Groq')}",
                     })
                 logger.info(f"{log_prefix_list} 从 Groq API 成功获取 {len(available_models)} 个可用模型。")
+                self._MODELS_CACHE[models_cache_key] = (time.monotonic(), [dict(model_info) for model_info in available_models])
                 return available_models
             else:
                 logger.warning(f"{log_prefix_list} Groq API models.list() 返回了空响应或无数据。")
                 return []
         except OpenAIAPIError as e:
             logger.error(f"{log_prefix_list} 从 Groq API 获取模型列表失败: {e}")
-            return []
+            return self._stale_models_or_empty(models_cache_key, log_prefix_list)
         except Exception as e_generic:
             logger.error(f"{log_prefix_list} 获取 Groq 模型列表时发生未知错误: {e_generic}", exc_info=True)
+            return self._stale_models_or_empty(models_cache_key, log_prefix_list)
+
+    def _stale_models_or_empty(self, models_cache_key: str, log_prefix_list: str) -> List[Dict[str, Any]]:
+        """获取失败时返回已过期的缓存模型列表（若有），而不是空列表。"""
+        cached_models_entry = self._MODELS_CACHE.get(models_cache_key)
+        if cached_models_entry is None:
             return []
+        logger.warning(f"{log_prefix_list} 使用已过期的缓存模型列表 (缓存于 {time.monotonic() - cached_models_entry[0]:.0f} 秒前)。")
+        return [dict(model_info) for model_info in cached_models_entry[1]]
 
     async def test_connection(
         self,
-        model_api_id_for_test: Optional[str] = None,
+        model_api_id_for_test: Optional[Union[str, List[str]]] = None,
     ) -> Tuple[bool, str, Optional[List[str]]]:
+        """
+        测试与 Groq 的连接。model_api_id_for_test 为列表（或未指定且配置了 test_model_ids）时，
+        并发探测所有候选模型，任一成功即返回并取消其余探测；全部失败时返回第一个候选模型的结果。
+        """
         if not self.is_client_ready() or self.client is None:
             return False, "Grok (Groq) 客户端未初始化或SDK不可用。", ["请检查依赖库 openai 是否已正确安装和配置。"]
 
-        test_model_id = model_api_id_for_test or self.provider_config.default_test_model_id or self.get_model_identifier_for_api()
+        if model_api_id_for_test is None and self.provider_config.test_model_ids:
+            model_api_id_for_test = self.provider_config.test_model_ids
+        if isinstance(model_api_id_for_test, list):
+            candidate_model_ids = list(dict.fromkeys(model_id for model_id in model_api_id_for_test if model_id))
+            if len(candidate_model_ids) > 1:
+                return await self._probe_first_success(candidate_model_ids)
+            model_api_id_for_test = candidate_model_ids[0] if candidate_model_ids else None
+
+        test_model_id = model_api_id_for_test or self.provider_config.default_test_model_id or self._api_model_id
         if not test_model_id:
             return False, "无法确定用于测试的Grok模型ID。", ["请在配置中指定 default_test_model_id 或确保当前模型配置了 model_identifier_for_api。"]
+        return await self._probe(test_model_id)
 
+    async def _probe_first_success(self, candidate_model_ids: List[str]) -> Tuple[bool, str, Optional[List[str]]]:
+        """并发探测多个模型，返回第一个成功的结果；总耗时约为最慢一次探测而非各次之和。"""
+        probe_tasks = [asyncio.ensure_future(self._probe(model_id)) for model_id in candidate_model_ids]
+        try:
+            for next_done in asyncio.as_completed(probe_tasks):
+                probe_result = await next_done
+                if probe_result[0]:
+                    return probe_result
+        finally:
+            for probe_task in probe_tasks:
+                probe_task.cancel()
+        # 全部失败：所有任务均已完成，按候选顺序返回第一个模型的结果
+        return probe_tasks[0].result()
+
+    async def _probe(self, test_model_id: str) -> Tuple[bool, str, Optional[List[str]]]:
+        """用一次极短的生成请求探测指定模型是否可用。"""
         logger.info(f"[Grok-TestConnection] 开始测试连接，使用模型: {test_model_id}")
         test_messages: List[Dict[str, Any]] = [{"role": "user", "content": "Hello. Are you operational?"}]
         test_api_params: Dict[str, Any] = {
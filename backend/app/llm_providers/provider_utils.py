@@ -0,0 +1,288 @@
+# backend/app/llm_providers/provider_utils.py
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+# orjson 为可选依赖，安装后用于缓存键序列化和 JSON 输出解析
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None # type: ignore
+    ORJSON_AVAILABLE = False
+
+# httpx 是 openai SDK 的底层传输库，用于构造使用 orjson 编码请求体的 HTTP 客户端
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    httpx = None # type: ignore
+    HTTPX_AVAILABLE = False
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKOFF_BASE_SECONDS = 0.5
+DEFAULT_BACKOFF_JITTER_SECONDS = 1.0
+DEFAULT_BACKOFF_MAX_SECONDS = 30.0
+DEFAULT_BATCH_WINDOW_MS = 10.0
+DEFAULT_MAX_BATCH_SIZE = 8
+# tiktoken 不可用时，预估请求 token 数所用的每 token 平均字符数（粗略估计）
+ESTIMATED_CHARS_PER_TOKEN = 4
+
+
+def json_dumps_bytes(value: Any, sort_keys: bool = False) -> bytes:
+    """将对象序列化为 UTF-8 编码的紧凑 JSON；优先使用 orjson。"""
+    if ORJSON_AVAILABLE and orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(value, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(raw_value: Union[str, bytes]) -> Any:
+    """解析 JSON 文本；优先使用 orjson。解析失败时抛出 ValueError 的子类。"""
+    if ORJSON_AVAILABLE and orjson is not None:
+        return orjson.loads(raw_value)
+    return json.loads(raw_value)
+
+
+class LazyJson:
+    """
+    延迟序列化的日志参数：只有日志记录真正被格式化时才调用 json_dumps_bytes，
+    用法为 logger.warning("%s", LazyJson(obj))，日志级别被过滤时不产生任何序列化开销。
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        try:
+            return json_dumps_bytes(self.value).decode("utf-8")
+        except (TypeError, ValueError):
+            return repr(self.value)
+
+
+if HTTPX_AVAILABLE and httpx is not None:
+    class OrjsonAsyncHTTPClient(httpx.AsyncClient):
+        """
+        请求体改用 orjson 编码的 httpx.AsyncClient，传给 AsyncOpenAI(http_client=...) 使用。
+        openai SDK 以 json= 传入请求体，httpx 默认用标准库 json 编码；长上下文请求的编码开销因此可观。
+        orjson 未安装或遇到无法编码的值时退回 httpx 默认行为。
+        """
+
+        def build_request(self, method: str, url: Any, *, content: Any = None, json: Any = None, headers: Any = None, **kwargs: Any) -> "httpx.Request":
+            if json is not None and content is None and ORJSON_AVAILABLE and orjson is not None:
+                try:
+                    content = orjson.dumps(json)
+                except TypeError:
+                    pass
+                else:
+                    json = None
+                    headers = httpx.Headers(headers)
+                    headers.setdefault("Content-Type", "application/json")
+            return super().build_request(method, url, content=content, json=json, headers=headers, **kwargs)
+else:
+    OrjsonAsyncHTTPClient = None # type: ignore
+
+
+class AsyncTokenBucket:
+    """
+    异步令牌桶限流器，按“每分钟配额”（请求数或 token 数）匀速补充令牌。
+    默认容量为一分钟的配额，与服务端按分钟统计的限额一致，空闲后的突发请求无需等待。
+    令牌不足时在锁内等待，保证等待者按先来先服务的顺序获得令牌。
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute 必须大于0。")
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, float(rate_per_minute))
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        # 单次请求超过桶容量时按容量计，否则永远等不到足够的令牌
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate_per_second)
+                self._refill()
+            self._tokens -= tokens
+
+    def charge(self, tokens: float) -> None:
+        """
+        按实际用量结算（不等待）：tokens 为正表示补扣，为负表示退还多预留的部分。
+        余额可以为负，后续 acquire 会等到补足后再放行。
+        """
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - tokens)
+
+    def drain(self) -> None:
+        """清空当前令牌（如服务端返回 429 时），使后续 acquire 按补充速率重新等待，与服务端额度保持同步。"""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+    async def __aenter__(self) -> "AsyncTokenBucket":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
+
+
+# 按 (提供商, base_url, api_key 的哈希) 及限流配置共享的 (RPM 令牌桶, TPM 令牌桶)。
+# 同一账号下的多个模型配置共用额度，限流器也必须共用，否则各实例分别限流仍会合计超出账号额度。
+_ACCOUNT_RATE_LIMITERS: Dict[Tuple[str, str, str, Optional[float], Optional[float]], Tuple[Optional[AsyncTokenBucket], Optional[AsyncTokenBucket]]] = {}
+
+
+def get_account_rate_limiters(
+    provider_tag: str,
+    base_url: str,
+    api_key: str,
+    rate_limit_rpm: Optional[float],
+    rate_limit_tpm: Optional[float]
+) -> Tuple[Optional[AsyncTokenBucket], Optional[AsyncTokenBucket]]:
+    """返回该账号共享的 (RPM, TPM) 令牌桶；对应配置未设置时为 None。"""
+    if not rate_limit_rpm and not rate_limit_tpm:
+        return None, None
+    limiter_key = (provider_tag, base_url, hashlib.sha256(api_key.encode("utf-8")).hexdigest(), rate_limit_rpm, rate_limit_tpm)
+    limiters = _ACCOUNT_RATE_LIMITERS.get(limiter_key)
+    if limiters is None:
+        limiters = (
+            AsyncTokenBucket(rate_limit_rpm) if rate_limit_rpm else None,
+            AsyncTokenBucket(rate_limit_tpm) if rate_limit_tpm else None
+        )
+        _ACCOUNT_RATE_LIMITERS[limiter_key] = limiters
+    return limiters
+
+
+def settle_token_usage(token_rate_limiter: Optional[AsyncTokenBucket], reserved_tokens: int, actual_total_tokens: int) -> None:
+    """请求完成后按 usage 中的实际 token 数与发送前预留的提示 token 数结算 TPM 令牌桶的差额；未返回 usage 时保留预留量。"""
+    if token_rate_limiter is not None and actual_total_tokens:
+        token_rate_limiter.charge(actual_total_tokens - reserved_tokens)
+
+
+def estimate_message_tokens(token_encoder: Any, messages: Any, log_prefix: str = "") -> int:
+    """
+    用 tiktoken 编码器估算 OpenAI 格式消息列表的提示 token 数（用于 TPM 预留和内容安全异常的补充信息）；
+    token_encoder 为 None 或分词失败时按字符数/ESTIMATED_CHARS_PER_TOKEN 估算。
+    """
+    message_contents = [message.get("content") or "" for message in messages]
+    if token_encoder is not None:
+        try:
+            return sum(len(token_encoder.encode(content, disallowed_special=())) for content in message_contents)
+        except Exception as e_encode:
+            logger.warning(f"{log_prefix} 本地分词失败，将按字符数估算 token: {e_encode}")
+    return sum(len(content) for content in message_contents) // ESTIMATED_CHARS_PER_TOKEN
+
+
+def get_retry_after_seconds(error: Exception) -> Optional[float]:
+    """从 SDK 异常附带的 HTTP 响应中读取 Retry-After (秒) 或 retry-after-ms 头；无法解析时返回 None。"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            # HTTP 日期格式的 Retry-After 不常见，交由指数退避处理
+            return None
+    return None
+
+
+def compute_backoff_delay(
+    attempt: int,
+    retry_after: Optional[float] = None,
+    base_seconds: float = DEFAULT_BACKOFF_BASE_SECONDS,
+    max_seconds: float = DEFAULT_BACKOFF_MAX_SECONDS,
+    jitter_seconds: float = DEFAULT_BACKOFF_JITTER_SECONDS
+) -> float:
+    """
+    计算第 attempt 次重试（从0开始）前的等待时间：带随机抖动的指数退避，
+    抖动使大量同时被限流的请求错开重试时间。服务端给出 Retry-After 时至少等待该时长。
+    """
+    backoff_delay = min(max_seconds, base_seconds * (2 ** attempt) + random.uniform(0, jitter_seconds))
+    if retry_after is not None:
+        return max(backoff_delay, min(max_seconds, retry_after))
+    return backoff_delay
+
+
+class DynamicBatcher:
+    """
+    动态批处理器：把短时间窗口内提交的请求收集成批，交给 flush_fn 一次性处理。
+    达到 max_batch_size 或距第一个请求超过 batch_window_ms 时立即刷新。
+    flush_fn 接收请求列表并按相同顺序返回结果列表；抛出的异常会传递给该批次的所有调用方。
+    后台收集任务按需启动，队列清空后自动退出。
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS
+    ):
+        self._flush_fn = flush_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window_seconds = max(0.0, batch_window_ms) / 1000.0
+        self._queue: "asyncio.Queue[Tuple[Any, asyncio.Future]]" = asyncio.Queue()
+        self._collector_task: Optional[asyncio.Task] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        if self._collector_task is None or self._collector_task.done():
+            self._collector_task = asyncio.create_task(self._collect())
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._queue.empty():
+            batch = [self._queue.get_nowait()]
+            deadline = loop.time() + self.batch_window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            # 刷新在独立任务中进行，收集下一批不必等待上一批的网络往返
+            flush_task = asyncio.create_task(self._flush(batch))
+            self._flush_tasks.add(flush_task)
+            flush_task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self._flush_fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"批处理结果数量 ({len(results)}) 与请求数量 ({len(batch)}) 不一致。")
+        except Exception as e_flush:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e_flush)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,354 @@
+# backend/app/llm_providers/response_cache.py
+import asyncio
+import hashlib
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, List, Callable
+
+# Redis 为可选依赖，仅在配置了 response_cache_redis_url 时使用
+try:
+    import redis.asyncio as redis_asyncio # type: ignore
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis_asyncio = None # type: ignore
+    REDIS_AVAILABLE = False
+
+# numpy 用于语义缓存的向量相似度计算
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None # type: ignore
+    NUMPY_AVAILABLE = False
+
+from .base_llm_provider import LLMResponse
+from .provider_utils import json_dumps_bytes, json_loads
+from app import schemas
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESPONSE_CACHE_MAX_ENTRIES = 4096
+REDIS_CACHE_KEY_PREFIX = "llmcache:"
+DEFAULT_SEMANTIC_CACHE_MAX_ENTRIES = 1024
+DEFAULT_SEMANTIC_CACHE_THRESHOLD = 0.92
+
+
+# 只影响传输方式、不影响输出内容的请求参数，不参与缓存键
+CACHE_KEY_EXCLUDED_PARAMS = frozenset({"stream", "stream_options"})
+
+
+def build_response_cache_key(api_params: Dict[str, Any]) -> str:
+    """
+    根据请求参数计算缓存键。除 CACHE_KEY_EXCLUDED_PARAMS 外的所有参数都参与哈希，
+    因此 frequency_penalty、logprobs 等任何影响输出的参数不同，都会得到不同的键（响应缓存与单飞合并共用此键）。
+    """
+    key_payload = {param_name: param_value for param_name, param_value in api_params.items() if param_name not in CACHE_KEY_EXCLUDED_PARAMS}
+    return hashlib.blake2b(json_dumps_bytes(key_payload, sort_keys=True), digest_size=32).hexdigest()
+
+
+def build_semantic_cache_scope(request_params: Dict[str, Any], system_prompt: Optional[str]) -> str:
+    """
+    语义缓存的 scope：除 messages 外的请求参数（模型、生成参数等）与系统提示都相同的请求才会相互命中。
+    系统提示显式传入，不依赖各提供商把它放在哪条消息中（独立 system 消息、合并进用户消息或 Gemini 的 system_instruction）。
+    """
+    scope_payload = {param_name: param_value for param_name, param_value in request_params.items() if param_name != "messages"}
+    scope_payload["system_prompt"] = system_prompt
+    return build_response_cache_key(scope_payload)
+
+
+class CacheBackend(ABC):
+    """响应缓存的存储后端接口。"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[LLMResponse]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: LLMResponse, ttl_seconds: float) -> None:
+        pass
+
+
+class InMemoryLRUCacheBackend(CacheBackend):
+    """进程内 LRU 缓存，条目带过期时间。"""
+
+    def __init__(self, max_entries: int = DEFAULT_RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, LLMResponse]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[LLMResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: LLMResponse, ttl_seconds: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisCacheBackend(CacheBackend):
+    """基于 Redis 的缓存后端，便于多个工作进程共享缓存。"""
+
+    def __init__(self, redis_url: str):
+        if not REDIS_AVAILABLE or redis_asyncio is None:
+            raise ImportError("redis 未安装，无法使用 Redis 响应缓存。请运行 'pip install redis'")
+        self._redis = redis_asyncio.from_url(redis_url)
+
+    async def get(self, key: str) -> Optional[LLMResponse]:
+        raw_value = await self._redis.get(REDIS_CACHE_KEY_PREFIX + key)
+        if raw_value is None:
+            return None
+        return LLMResponse(**json_loads(raw_value))
+
+    async def set(self, key: str, value: LLMResponse, ttl_seconds: float) -> None:
+        await self._redis.set(
+            REDIS_CACHE_KEY_PREFIX + key,
+            json_dumps_bytes(value._asdict()),
+            ex=max(1, int(ttl_seconds))
+        )
+
+
+# 进程内共享的 LRU 后端：缓存键已包含模型标识，所有提供商实例可安全共用同一份条目和容量上限
+_shared_in_memory_backend: Optional["InMemoryLRUCacheBackend"] = None
+
+
+def get_shared_in_memory_backend() -> "InMemoryLRUCacheBackend":
+    global _shared_in_memory_backend
+    if _shared_in_memory_backend is None:
+        _shared_in_memory_backend = InMemoryLRUCacheBackend()
+    return _shared_in_memory_backend
+
+
+class ResponseCache:
+    """
+    确定性 LLM 调用的精确匹配响应缓存。
+    记录命中/未命中次数；后端读写失败只记录警告，不影响正常的 API 调用。
+    """
+
+    def __init__(self, backend: CacheBackend, ttl_seconds: float):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_provider_config(cls, provider_config: schemas.LLMProviderConfigSchema) -> Optional["ResponseCache"]:
+        """根据提供商配置创建缓存；cache_ttl_seconds 未设置或不大于0时返回 None（禁用缓存）。"""
+        ttl_seconds = provider_config.cache_ttl_seconds
+        if not ttl_seconds or ttl_seconds <= 0:
+            return None
+        backend: CacheBackend
+        if provider_config.response_cache_redis_url:
+            try:
+                backend = RedisCacheBackend(provider_config.response_cache_redis_url)
+            except Exception as e_redis:
+                logger.warning(f"无法创建 Redis 响应缓存后端，将回退到进程内缓存: {e_redis}")
+                backend = get_shared_in_memory_backend()
+        else:
+            backend = get_shared_in_memory_backend()
+        return cls(backend, ttl_seconds)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    async def get(self, key: str) -> Optional[LLMResponse]:
+        try:
+            cached_value = await self.backend.get(key)
+        except Exception as e_get:
+            logger.warning(f"读取响应缓存失败: {e_get}")
+            cached_value = None
+        if cached_value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cached_value
+
+    async def set(self, key: str, value: LLMResponse) -> None:
+        try:
+            await self.backend.set(key, value, self.ttl_seconds)
+        except Exception as e_set:
+            logger.warning(f"写入响应缓存失败: {e_set}")
+
+
+class EmbeddingClient(ABC):
+    """语义缓存使用的文本向量化接口。"""
+
+    @abstractmethod
+    async def embed(self, text: str) -> List[float]:
+        pass
+
+
+class LangchainEmbeddingClient(EmbeddingClient):
+    """将 langchain Embeddings 对象 (如 vector_store_service 中的 HuggingFaceEmbeddings) 适配为 EmbeddingClient。"""
+
+    def __init__(self, embeddings: Any):
+        self._embeddings = embeddings
+
+    async def embed(self, text: str) -> List[float]:
+        # 本地嵌入模型的 embed_query 是同步且CPU密集的，放到线程中执行以免阻塞事件循环
+        return await asyncio.to_thread(self._embeddings.embed_query, text)
+
+
+class LazyEmbeddingClient(EmbeddingClient):
+    """
+    首次 embed 时才调用 embeddings_loader 加载嵌入模型（在线程中执行，加载本地模型可能耗时数秒），之后复用。
+    加载失败会被记住，后续调用直接抛出同一异常而不再重复加载。
+    """
+
+    def __init__(self, embeddings_loader: Callable[[], Any]):
+        self._embeddings_loader = embeddings_loader
+        self._client: Optional[LangchainEmbeddingClient] = None
+        self._load_error: Optional[Exception] = None
+        self._load_lock = asyncio.Lock()
+
+    async def _get_client(self) -> LangchainEmbeddingClient:
+        if self._client is None:
+            async with self._load_lock:
+                if self._load_error is not None:
+                    raise self._load_error
+                if self._client is None:
+                    try:
+                        self._client = LangchainEmbeddingClient(await asyncio.to_thread(self._embeddings_loader))
+                    except Exception as e_load:
+                        logger.error(f"语义缓存加载嵌入模型失败，语义缓存将不可用: {e_load}")
+                        self._load_error = e_load
+                        raise
+        return self._client
+
+    async def embed(self, text: str) -> List[float]:
+        return await (await self._get_client()).embed(text)
+
+
+class SemanticResponseCache:
+    """
+    基于嵌入向量余弦相似度的语义响应缓存，作为精确匹配缓存之后的第二级查找。
+    条目按 scope (模型、max_tokens 等) 隔离，带过期时间并按 LRU 淘汰；相似度检索为基于 numpy 的暴力检索，
+    对于 max_entries 量级的条目足够快，无需引入 FAISS/hnswlib。
+    """
+
+    def __init__(
+        self,
+        embedding_client: EmbeddingClient,
+        ttl_seconds: float = 3600.0,
+        max_entries: int = DEFAULT_SEMANTIC_CACHE_MAX_ENTRIES,
+        threshold: float = DEFAULT_SEMANTIC_CACHE_THRESHOLD
+    ):
+        if not NUMPY_AVAILABLE or np is None:
+            raise ImportError("numpy 未安装，无法使用语义响应缓存。请运行 'pip install numpy'")
+        self.embedding_client = embedding_client
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._next_entry_id = 0
+        # entry_id -> (expires_at, scope, 归一化向量, 响应)
+        self._entries: "OrderedDict[int, Tuple[float, str, Any, LLMResponse]]" = OrderedDict()
+        # scope -> (entry_id 列表, 向量矩阵)；条目增删时失效，下次查找时重建
+        self._scope_matrices: Dict[str, Tuple[List[int], Any]] = {}
+
+    @classmethod
+    def from_provider_config(cls, provider_config: schemas.LLMProviderConfigSchema, embedding_client: EmbeddingClient) -> Optional["SemanticResponseCache"]:
+        """
+        根据提供商配置创建语义缓存；未启用 enable_semantic_cache、cache_ttl_seconds 未设置或不大于0、
+        或 numpy 不可用时返回 None（禁用语义缓存）。
+        """
+        ttl_seconds = provider_config.cache_ttl_seconds
+        if not provider_config.enable_semantic_cache or not ttl_seconds or ttl_seconds <= 0:
+            return None
+        if not NUMPY_AVAILABLE:
+            logger.warning(f"提供商 '{provider_config.provider_tag}' 启用了语义缓存，但 numpy 未安装，语义缓存将被禁用。请运行 'pip install numpy'")
+            return None
+        return cls(embedding_client, ttl_seconds=ttl_seconds, threshold=provider_config.semantic_cache_threshold)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    async def embed(self, text: str) -> Optional[Any]:
+        """计算归一化后的嵌入向量；失败时返回 None（仅记录警告）。"""
+        try:
+            raw_vector = await self.embedding_client.embed(text)
+        except Exception as e_embed:
+            logger.warning(f"语义缓存向量化失败: {e_embed}")
+            return None
+        vector = np.asarray(raw_vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return vector / norm
+
+    async def lookup_prompt(
+        self,
+        request_params: Dict[str, Any],
+        system_prompt: Optional[str],
+        prompt: str,
+        threshold: Optional[float] = None
+    ) -> Tuple[Optional[LLMResponse], str, Optional[Any]]:
+        """
+        提供商使用的语义查找入口，返回 (命中的响应或 None, scope, 向量)；未命中时调用方在请求完成后以 scope 与向量调用 store。
+        系统提示进入 scope（见 build_semantic_cache_scope），只有用户提示 prompt 参与向量化：
+        系统提示（文风指南、人物设定等）往往很长且被大量调用共用，若参与向量化，不同提示的向量会过于接近而误命中。
+        """
+        scope = build_semantic_cache_scope(request_params, system_prompt)
+        vector = await self.embed(prompt)
+        if vector is None:
+            return None, scope, None
+        return self.lookup(scope, vector, threshold), scope, vector
+
+    def lookup(self, scope: str, vector: Any, threshold: Optional[float] = None) -> Optional[LLMResponse]:
+        """在同一 scope 内查找余弦相似度最高的条目，达到阈值时返回其响应。"""
+        min_similarity = self.threshold if threshold is None else threshold
+        self._evict_expired()
+        scope_index = self._get_scope_matrix(scope)
+        if scope_index is None:
+            self.misses += 1
+            return None
+        entry_ids, matrix = scope_index
+        similarities = matrix @ vector
+        best_position = int(np.argmax(similarities))
+        if float(similarities[best_position]) < min_similarity:
+            self.misses += 1
+            return None
+        best_entry_id = entry_ids[best_position]
+        self._entries.move_to_end(best_entry_id)
+        self.hits += 1
+        return self._entries[best_entry_id][3]
+
+    def store(self, scope: str, vector: Any, value: LLMResponse) -> None:
+        entry_id = self._next_entry_id
+        self._next_entry_id += 1
+        self._entries[entry_id] = (time.monotonic() + self.ttl_seconds, scope, vector, value)
+        self._scope_matrices.pop(scope, None)
+        while len(self._entries) > self.max_entries:
+            _, (_, evicted_scope, _, _) = self._entries.popitem(last=False)
+            self._scope_matrices.pop(evicted_scope, None)
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        expired_ids = [entry_id for entry_id, entry in self._entries.items() if entry[0] <= now]
+        for entry_id in expired_ids:
+            _, expired_scope, _, _ = self._entries.pop(entry_id)
+            self._scope_matrices.pop(expired_scope, None)
+
+    def _get_scope_matrix(self, scope: str) -> Optional[Tuple[List[int], Any]]:
+        scope_index = self._scope_matrices.get(scope)
+        if scope_index is None:
+            entry_ids = [entry_id for entry_id, entry in self._entries.items() if entry[1] == scope]
+            if not entry_ids:
+                return None
+            matrix = np.stack([self._entries[entry_id][2] for entry_id in entry_ids])
+            scope_index = (entry_ids, matrix)
+            self._scope_matrices[scope] = scope_index
+        return scope_index
@@ -1,5 +1,6 @@
 # backend/app/main.py
 
+import asyncio
 import logging
 import logging.config
 import os
@@ -25,9 +26,30 @@ from .routers.events import global_event_router # 全局事件ID操作 (用于 /
 from .routers.events import event_relationship_router # 事件关系路由
 
 from .services.config_service import load_config, get_config # 导入配置加载和获取函数
+from .llm_providers import close_shared_provider_clients # 关闭时释放共享的LLM客户端连接池
+from .llm_providers.provider_utils import json_dumps_bytes
 
 # --- 日志配置 ---
+class JsonLogFormatter(logging.Formatter):
+    """
+    将日志记录输出为单行 JSON (application_settings.log_format 为 "json" 时使用)。
+    使用 orjson 序列化 (未安装时回退到标准库 json)，便于日志采集系统直接解析。
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        log_entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            log_entry["exc_info"] = self.formatException(record.exc_info)
+        return json_dumps_bytes(log_entry).decode("utf-8")
+
+
 # 与您提供的版本一致，从配置服务动态设置日志级别
+_application_settings = get_config().get("application_settings", {})
 LOGGING_CONFIG = { #
     "version": 1, #
     "disable_existing_loggers": False, #
@@ -35,16 +57,19 @@ LOGGING_CONFIG = { #
         "default": { #
             "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s", #
         },
+        "json": {
+            "()": JsonLogFormatter,
+        },
     },
     "handlers": { #
         "console": { #
             "class": "logging.StreamHandler", #
-            "formatter": "default", #
+            "formatter": "json" if str(_application_settings.get("log_format", "text")).lower() == "json" else "default", #
         },
     },
     "root": { #
         "handlers": ["console"], #
-        "level": get_config().get("application_settings", {}).get("log_level", "INFO").upper(), #
+        "level": _application_settings.get("log_level", "INFO").upper(), #
     },
 }
 
@@ -117,6 +142,9 @@ async def on_startup(): # 【重要】将启动函数改为异步
     应用启动时执行的逻辑。
     """
     logger_main_module.info("应用正在启动...")
+    # 便于确认 uvloop 是否生效 (uvicorn --loop auto 在已安装 uvloop 时使用 uvloop.Loop)
+    running_loop = asyncio.get_running_loop()
+    logger_main_module.info(f"事件循环实现: {type(running_loop).__module__}.{type(running_loop).__name__}")
     try:
         # 加载应用配置
         load_config()
@@ -130,11 +158,13 @@ async def on_startup(): # 【重要】将启动函数改为异步
 
 
 @app.on_event("shutdown")
-def on_shutdown():
+async def on_shutdown():
     """
     应用关闭时执行的逻辑。
     """
     logger_main_module.info("应用正在关闭...")
+    # 关闭各 LLM 提供商在进程内共享的 HTTP 客户端（连接池）
+    await close_shared_provider_clients()
     # 在异步模式下，SQLAlchemy 引擎会自动处理连接池的关闭，通常无需手动操作。
     # from .database import engine
     # await engine.dispose() # 如果需要显式关闭，应该是异步操作
@@ -869,7 +869,26 @@ class LLMProviderConfigSchema(BaseModel): # 新增 (基于原始 config.json)
     max_retries: Optional[int] = Field(2, description="API请求失败时的最大重试次数。")
     default_jailbreak_prefix: Optional[str] = Field(None, description="Grok等模型可能需要的默认引导前缀。")
     default_test_model_id: Optional[str] = Field(None, description="测试连接时默认使用的模型API ID。")
+    test_model_ids: Optional[List[str]] = Field(None, description="测试连接时并发探测的候选模型API ID列表，任一模型成功即视为连接正常。为空时使用 default_test_model_id。")
     api_key_source: Optional[Literal['env', 'config', 'not_set']] = Field("not_set", description="API密钥的来源指示。")
+    enable_http2: Optional[bool] = Field(None, description="是否对兼容OpenAI的客户端启用HTTP/2多路复用 (需安装 h2)。为空时在已安装 h2 的情况下自动启用。")
+    cache_ttl_seconds: Optional[float] = Field(3600.0, description="确定性调用(temperature=0)响应缓存的过期时间（秒）。为空或0时禁用缓存。")
+    response_cache_redis_url: Optional[str] = Field(None, description="响应缓存的Redis地址 (需安装 redis)。为空时使用进程内LRU缓存。")
+    enable_semantic_cache: bool = Field(False, description="是否在精确匹配缓存未命中后按提示的语义相似度查找缓存 (需安装 numpy；首次使用时加载 embedding_settings 中的嵌入模型，TTL 沿用 cache_ttl_seconds)。")
+    semantic_cache_threshold: float = Field(0.92, ge=0.0, le=1.0, description="语义缓存命中所需的最小余弦相似度 (仅在 enable_semantic_cache 启用时生效)。")
+    threaded_hash_threshold: Optional[int] = Field(50000, ge=0, description="请求消息总字符数超过该值时，缓存键哈希与本地 token 估算改在线程池中执行，避免阻塞事件循环。为空或0时始终在事件循环中执行。")
+    models_list_ttl_seconds: float = Field(300.0, ge=0.0, description="从API获取的可用模型列表的缓存时间（秒）。0表示不缓存。")
+    max_concurrent_requests: Optional[int] = Field(32, ge=1, description="单个模型配置同时进行中的API请求数上限。")
+    rate_limit_rpm: Optional[float] = Field(None, gt=0, description="客户端限流：每分钟最多发起的请求数。为空时不限流。")
+    rate_limit_tpm: Optional[float] = Field(None, gt=0, description="客户端限流：每分钟最多消耗的 token 数（发送前按提示长度预留，响应返回后按实际用量结算）。为空时不限流。")
+    batch_window_ms: float = Field(10.0, ge=0.0, description="generate_batch 动态批处理的收集窗口（毫秒）。")
+    max_batch_size: int = Field(8, ge=1, description="generate_batch 合并到单次请求中的最大提示数。")
+    use_batch_api: bool = Field(False, description="generate_many 在提示数量较多时是否通过 OpenAI 兼容的 Batch API 异步提交 (适用于对延迟不敏感的任务)。")
+    batch_api_min_prompts: int = Field(50, ge=1, description="generate_many 使用 Batch API 的最小提示数量，低于此值时逐个并发调用。")
+    batch_api_poll_interval_seconds: float = Field(5.0, gt=0, description="轮询 Batch 任务状态的初始间隔（秒），之后按指数增长。")
+    context_cache_ttl_seconds: Optional[float] = Field(None, description="Gemini 显式上下文缓存 (系统提示) 的有效期（秒）。默认禁用：每个 CachedContent 在有效期内按存储时长计费，适合多次复用同一长系统提示的场景；设为正数 (如 3600) 启用。")
+    context_cache_min_chars: int = Field(4096, ge=1, description="系统提示字符数达到此值时才尝试创建上下文缓存 (仅在 context_cache_ttl_seconds 启用时生效)。字符数只是粗筛，不足服务端最小缓存 token 数的提示会被拒绝，之后不再为其尝试。")
+    prewarm_connection: bool = Field(True, description="创建提供商实例时是否在后台发起一次轻量请求以预先建立连接 (每个API密钥一次，目前用于 Gemini)。")
 
 class UserDefinedLLMConfigSchema(BaseModel): # 新增 (基于原始 config.json)
     user_given_id: str = Field(..., description="用户定义的唯一ID，用于在应用中引用此模型配置。")
@@ -883,6 +902,7 @@ class UserDefinedLLMConfigSchema(BaseModel): # 新增 (基于原始 config.json)
     enabled: bool = Field(True, description="是否启用此模型配置。")
     notes: Optional[str] = Field(None, description="关于此模型配置的备注。")
     api_key_is_from_env: bool = Field(False, description="指示API密钥和Base URL是否优先从环境变量加载（如果此处未填写）。")
+    enable_response_cache: bool = Field(True, description="是否为此模型启用确定性调用的响应缓存 (TTL 由提供商的 cache_ttl_seconds 控制)。")
 
 class TokenizerOptionsSchema(BaseModel): # 新增
     local_model_token_estimation_factors: Optional[Dict[str, Dict[str, float]]] = Field(default_factory=dict)
@@ -960,6 +980,7 @@ class FileStorageSettingsConfigSchema(BaseModel): # 新增 (基于原始 config.
 
 class ApplicationGeneralSettingsConfigSchema(BaseModel): # 新增 (基于原始 config.json)
     log_level: str = Field("INFO", description="应用全局日志级别。")
+    log_format: Literal['text', 'json'] = Field("text", description="日志输出格式：text 为普通文本，json 为单行 JSON (使用 orjson 序列化，便于日志采集)。")
     allow_config_writes_via_api: bool = Field(False, description="是否允许通过API接口修改配置文件。")
     cors_origins: Optional[List[str]] = Field(default_factory=lambda: ["http://localhost:3000", "http://localhost:5173"])
     database_url: Optional[str] = Field("sqlite:///./novel_adapter_tool.db") # 后端database.py会用
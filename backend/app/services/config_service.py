@@ -4,6 +4,7 @@ import os
 from pathlib import Path
 from typing import Dict, Any, Optional, List, Union, TypeVar, Type
 import logging
+import weakref
 
 from pydantic import BaseModel, Field, ValidationError # model_validator 未在此文件中直接使用，但与Pydantic相关
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -93,6 +94,33 @@ class ApplicationSettingsModel(BaseSettings, schemas.TopLevelApplicationConfigSc
 _app_config_instance: Optional[ApplicationSettingsModel] = None
 _config_load_error: Optional[str] = None
 _is_loading_config: bool = False # 防止并发加载
+# 配置重新加载/更新后的回调。使用弱引用，不会阻止注册方（如 LLM 提供商实例）被回收
+_config_reload_listeners: List[Any] = []
+
+
+def add_config_reload_listener(callback: Any) -> None:
+    """
+    注册一个在配置实例被替换后调用的无参回调。
+    绑定方法以 WeakMethod 保存，其他可调用对象以普通弱引用保存；对象被回收后自动移除。
+    """
+    if hasattr(callback, "__self__") and hasattr(callback, "__func__"):
+        _config_reload_listeners.append(weakref.WeakMethod(callback))
+    else:
+        _config_reload_listeners.append(weakref.ref(callback))
+
+
+def _notify_config_reload_listeners() -> None:
+    alive_listeners = []
+    for listener_ref in _config_reload_listeners:
+        callback = listener_ref()
+        if callback is None:
+            continue
+        alive_listeners.append(listener_ref)
+        try:
+            callback()
+        except Exception as e_listener:
+            logger.warning(f"执行配置重载回调时出错: {e_listener}")
+    _config_reload_listeners[:] = alive_listeners
 
 
 def load_config(force_reload: bool = False) -> ApplicationSettingsModel:
@@ -119,6 +147,7 @@ def load_config(force_reload: bool = False) -> ApplicationSettingsModel:
         # 使用从JSON加载的数据初始化BaseSettings模型。
         # Pydantic会自动处理环境变量的覆盖（如果 .env 文件被指定且存在）。
         _app_config_instance = ApplicationSettingsModel(**raw_config_data_from_json)
+        _notify_config_reload_listeners()
         
         logger.info("应用配置已成功加载和验证。")
         _config_load_error = None
@@ -306,6 +335,7 @@ def update_config(config_update_data: schemas.ApplicationConfigSchema) -> schema
         # 更新内存中的配置实例，需要确保它是 ApplicationSettingsModel 类型，
         # 因为 get_config() 和 _app_config_instance 期望的是这个类型。
         _app_config_instance = ApplicationSettingsModel(**config_dict_to_write)
+        _notify_config_reload_listeners()
         _config_load_error = None
         logger.info(f"应用配置已成功保存到 '{CONFIG_FILE_PATH}' 并更新到内存。")
         return _app_config_instance # 返回更新后的实例 (类型是 ApplicationSettingsModel，但兼容 ApplicationConfigSchema)
@@ -77,6 +77,13 @@ def _get_tiktoken_encoding_for_model(model_name: str) -> Optional[Any]: # 返回
         # 在异常情况下，也回退到最通用的编码器
         return _get_tiktoken_encoding("cl100k_base") #
 
+def get_tiktoken_encoding_for_model(model_name: str) -> Optional[Any]:
+    """
+    返回模型对应的（已缓存的）tiktoken 编码器；tiktoken 不可用时返回 None。
+    供需要反复计数的调用方（如 LLM 提供商的限流逻辑）直接持有编码器，避免每次计数都查找用户模型配置。
+    """
+    return _get_tiktoken_encoding_for_model(model_name)
+
 def _estimate_tokens_by_chars(text: str, model_user_id_for_factor: Optional[str] = None, specific_chars_per_token: Optional[float] = None) -> int: #
     """
     通过字符数估算token数量。
@@ -0,0 +1,135 @@
+# backend/tests/conftest.py
+import asyncio
+import importlib
+import os
+import sys
+import uuid
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytest
+
+# 使测试可以直接以 "app" 包的形式导入后端代码（无论从哪个目录运行 pytest）
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# 兼容 OpenAI 接口的提供商：(模块名, SDK 可用标志, 提供商标签, 模型 API 标识)
+OPENAI_COMPATIBLE_PROVIDERS = {
+    "deepseek": ("app.llm_providers.deepseek_provider", "OPENAI_SDK_FOR_DEEPSEEK_AVAILABLE", "deepseek", "deepseek-chat"),
+    "grok": ("app.llm_providers.grok_provider", "OPENAI_SDK_FOR_GROK_AVAILABLE", "grok", "llama3-8b-8192"),
+}
+TEST_BASE_URL = "http://llm.test.invalid/v1"
+
+
+class FakeClock:
+    """替代 provider_utils 中的 time.monotonic 与 asyncio.sleep：sleep 只推进时钟并记录等待时长。"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps: List[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    from app.llm_providers import provider_utils
+
+    clock = FakeClock()
+    monkeypatch.setattr(provider_utils, "time", SimpleNamespace(monotonic=clock.monotonic))
+    patched_asyncio = SimpleNamespace(**{name: getattr(asyncio, name) for name in dir(asyncio) if not name.startswith("__")})
+    patched_asyncio.sleep = clock.sleep
+    monkeypatch.setattr(provider_utils, "asyncio", patched_asyncio)
+    return clock
+
+
+class FakeChatCompletions:
+    """
+    记录请求参数并返回固定格式响应的 chat.completions 替身。
+    failures 中的异常按顺序在前几次调用时抛出；回复文本为 echo:{最后一条消息}|fp={frequency_penalty}，usage 为 3/2/5。
+    """
+
+    def __init__(self, delay_seconds: float = 0.0, failures: Optional[List[Exception]] = None):
+        self.delay_seconds = delay_seconds
+        self.failures = list(failures or [])
+        self.calls: List[Dict[str, Any]] = []
+
+    async def create(self, **api_params: Any) -> Any:
+        self.calls.append(api_params)
+        await asyncio.sleep(self.delay_seconds)
+        if self.failures:
+            raise self.failures.pop(0)
+        reply_text = f"echo:{api_params['messages'][-1]['content']}|fp={api_params.get('frequency_penalty')}"
+        return SimpleNamespace(
+            id=f"resp-{len(self.calls)}",
+            choices=[SimpleNamespace(message=SimpleNamespace(content=reply_text), finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=3, completion_tokens=2, total_tokens=5),
+        )
+
+
+def _load_provider_module(provider_name: str) -> Any:
+    module_name, sdk_flag_name, _, _ = OPENAI_COMPATIBLE_PROVIDERS[provider_name]
+    provider_module = pytest.importorskip(module_name)
+    if not getattr(provider_module, sdk_flag_name):
+        pytest.skip("openai SDK 未安装")
+    return provider_module
+
+
+def _build_provider_factory(provider_name: str) -> Callable[..., Tuple[Any, FakeChatCompletions]]:
+    from app import schemas
+
+    provider_module = _load_provider_module(provider_name)
+    _, _, provider_tag, model_api_id = OPENAI_COMPATIBLE_PROVIDERS[provider_name]
+    provider_class = next(
+        candidate for candidate in vars(provider_module).values()
+        if isinstance(candidate, type) and getattr(candidate, "PROVIDER_TAG", None) == provider_tag
+    )
+
+    def make_provider(
+        api_key: Optional[str] = None,
+        failures: Optional[List[Exception]] = None,
+        semantic_cache: Any = None,
+        **provider_overrides: Any
+    ) -> Tuple[Any, FakeChatCompletions]:
+        """
+        创建带假 chat.completions 客户端的提供商实例。默认使用随机 API 密钥，
+        因此按账号共享的限流器与单飞合并不会在测试之间串用。
+        """
+        model_config = schemas.UserDefinedLLMConfigSchema(
+            user_given_id=f"{provider_tag}/test",
+            user_given_name=f"{provider_name} test",
+            model_identifier_for_api=model_api_id,
+            provider_tag=provider_tag,
+            api_key=api_key or f"sk-{uuid.uuid4().hex}",
+            base_url=TEST_BASE_URL,
+        )
+        provider_config = schemas.LLMProviderConfigSchema(**{"provider_tag": provider_tag, "cache_ttl_seconds": 0, "max_retries": 0, **provider_overrides})
+        provider = provider_class(model_config, provider_config, semantic_cache=semantic_cache)
+        fake_completions = FakeChatCompletions(delay_seconds=0.05, failures=failures)
+        provider.client = SimpleNamespace(chat=SimpleNamespace(completions=fake_completions))
+        return provider, fake_completions
+
+    make_provider.provider_module = provider_module # type: ignore[attr-defined]
+    return make_provider
+
+
+@pytest.fixture(params=sorted(OPENAI_COMPATIBLE_PROVIDERS))
+def make_openai_compatible_provider(request):
+    """按兼容 OpenAI 接口的各个提供商参数化的提供商工厂，见 _build_provider_factory。"""
+    return _build_provider_factory(request.param)
+
+
+@pytest.fixture
+def make_deepseek_provider():
+    return _build_provider_factory("deepseek")
+
+
+@pytest.fixture
+def make_grok_provider():
+    return _build_provider_factory("grok")
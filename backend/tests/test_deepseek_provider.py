@@ -0,0 +1,137 @@
+# backend/tests/test_deepseek_provider.py
+# 与 Grok 共同的行为见 test_openai_compatible_providers.py
+import asyncio
+import json
+from typing import Any, Dict, List
+
+import pytest
+
+deepseek_provider = pytest.importorskip("app.llm_providers.deepseek_provider")
+if not deepseek_provider.OPENAI_SDK_FOR_DEEPSEEK_AVAILABLE:
+    pytest.skip("openai SDK 未安装", allow_module_level=True)
+
+
+def test_concurrent_calls_with_different_penalties_are_not_coalesced(make_deepseek_provider):
+    provider, fake_completions = make_deepseek_provider()
+
+    async def _run() -> List[Any]:
+        return await asyncio.gather(
+            provider.generate("你好", temperature=0),
+            provider.generate("你好", temperature=0, llm_override_parameters={"frequency_penalty": 0.5}),
+        )
+
+    plain_response, penalized_response = asyncio.run(_run())
+    assert len(fake_completions.calls) == 2
+    assert plain_response.text == "echo:你好|fp=None"
+    assert penalized_response.text == "echo:你好|fp=0.5"
+
+
+class _FakeMergedGenerate:
+    """替代 provider.generate：合并请求（JSON 输出）按编号回答全部请求，单独请求原样回显。"""
+
+    def __init__(self, merged_reply_builder: Any = None):
+        self.calls: List[Dict[str, Any]] = []
+        self.merged_reply_builder = merged_reply_builder or (lambda count: json.dumps(
+            {"responses": [{"index": index, "response": f"answer-{index}"} for index in range(1, count + 1)]}
+        ))
+
+    async def __call__(self, prompt: str, **call_kwargs: Any) -> Any:
+        self.calls.append({"prompt": prompt, **call_kwargs})
+        if call_kwargs.get("is_json_output"):
+            reply_text = self.merged_reply_builder(prompt.count("### 请求 "))
+        else:
+            reply_text = f"single:{prompt}"
+        return deepseek_provider.LLMResponse(reply_text, "deepseek/test", 10, 20, 30, "stop", None)
+
+
+def _merged_calls(fake_generate: _FakeMergedGenerate) -> List[Dict[str, Any]]:
+    return [call for call in fake_generate.calls if call.get("is_json_output")]
+
+
+def test_generate_merged_scales_default_budget_by_prompt_count(make_deepseek_provider):
+    provider, _ = make_deepseek_provider()
+    provider.generate = fake_generate = _FakeMergedGenerate()
+    default_max_tokens = provider._get_llm_defaults()[1]
+    prompt_count = min(3, deepseek_provider.DEEPSEEK_MAX_OUTPUT_TOKENS // default_max_tokens)
+
+    responses = asyncio.run(provider._generate_merged([f"p{index}" for index in range(prompt_count)], None, None, None))
+
+    assert [call["max_tokens"] for call in _merged_calls(fake_generate)] == [default_max_tokens * prompt_count]
+    assert [response.text for response in responses] == [f"answer-{index}" for index in range(1, prompt_count + 1)]
+
+
+def test_generate_merged_splits_prompts_beyond_output_limit(make_deepseek_provider):
+    provider, _ = make_deepseek_provider()
+    provider.generate = fake_generate = _FakeMergedGenerate()
+    per_prompt_max_tokens = deepseek_provider.DEEPSEEK_MAX_OUTPUT_TOKENS // 4
+
+    responses = asyncio.run(provider._generate_merged([f"p{index}" for index in range(6)], None, per_prompt_max_tokens, None))
+
+    assert sorted(call["max_tokens"] for call in _merged_calls(fake_generate)) == [per_prompt_max_tokens * 2, per_prompt_max_tokens * 4]
+    assert [response.text for response in responses] == ["answer-1", "answer-2", "answer-3", "answer-4", "answer-1", "answer-2"]
+
+
+def test_generate_merged_does_not_merge_when_budget_does_not_fit(make_deepseek_provider):
+    provider, _ = make_deepseek_provider()
+    provider.generate = fake_generate = _FakeMergedGenerate()
+
+    responses = asyncio.run(provider._generate_merged(["a", "b"], None, deepseek_provider.DEEPSEEK_MAX_OUTPUT_TOKENS, None))
+
+    assert _merged_calls(fake_generate) == []
+    assert [response.text for response in responses] == ["single:a", "single:b"]
+
+
+def test_generate_merged_falls_back_for_missing_entries(make_deepseek_provider):
+    provider, _ = make_deepseek_provider()
+    provider.generate = fake_generate = _FakeMergedGenerate(lambda count: json.dumps({"responses": [{"index": 2, "response": "answer-2"}]}))
+
+    responses = asyncio.run(provider._generate_merged(["a", "b", "c"], None, 100, None))
+
+    assert [response.text for response in responses] == ["single:a", "answer-2", "single:c"]
+    # 合并请求的用量按提示数平均分摊
+    assert (responses[1].prompt_tokens, responses[1].completion_tokens) == (10 // 3, 20 // 3)
+
+
+def test_generate_merged_falls_back_when_json_is_invalid(make_deepseek_provider):
+    provider, _ = make_deepseek_provider()
+    provider.generate = _FakeMergedGenerate(lambda count: "not json")
+
+    responses = asyncio.run(provider._generate_merged(["a", "b"], None, 100, None))
+
+    assert [response.text for response in responses] == ["single:a", "single:b"]
+
+
+def _retryable_errors() -> Any:
+    httpx = pytest.importorskip("httpx")
+    request = httpx.Request("POST", "http://llm.test.invalid/v1/chat/completions")
+    connection_error = deepseek_provider.APIConnectionError(request=request)
+    rate_limit_error = deepseek_provider.RateLimitError("too many requests", response=httpx.Response(429, request=request), body=None)
+    return connection_error, rate_limit_error
+
+
+def test_failed_attempt_refunds_token_reservation(make_deepseek_provider, fake_clock, monkeypatch):
+    monkeypatch.setattr(deepseek_provider, "compute_backoff_delay", lambda attempt, retry_after=None: 0)
+    connection_error, _ = _retryable_errors()
+    api_key = "sk-refund-test"
+    provider, fake_completions = make_deepseek_provider(api_key=api_key, failures=[connection_error], max_retries=1, rate_limit_tpm=60)
+    _, token_bucket = deepseek_provider.get_account_rate_limiters(provider.PROVIDER_TAG, provider.model_config.base_url, api_key, None, 60)
+
+    async def _run() -> None:
+        await provider.generate("章节内容" * 50, temperature=0.7)
+        await token_bucket.acquire(60)
+
+    asyncio.run(_run())
+    assert len(fake_completions.calls) == 2
+    # 失败的一次预留已退还，只剩成功请求的实际用量 5：再取满桶只需等待 5 秒
+    assert fake_clock.sleeps == [pytest.approx(5.0)]
+
+
+def test_rate_limit_error_drains_account_buckets(make_deepseek_provider, fake_clock, monkeypatch):
+    monkeypatch.setattr(deepseek_provider, "compute_backoff_delay", lambda attempt, retry_after=None: 0)
+    _, rate_limit_error = _retryable_errors()
+    provider, fake_completions = make_deepseek_provider(failures=[rate_limit_error], max_retries=1, rate_limit_rpm=60)
+
+    asyncio.run(provider.generate("你好", temperature=0.7))
+    assert len(fake_completions.calls) == 2
+    # 429 后 RPM 令牌桶被清空，重试需按补充速率 (每秒 1 个) 等待
+    assert fake_clock.sleeps == [pytest.approx(1.0)]
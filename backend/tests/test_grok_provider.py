@@ -0,0 +1,27 @@
+# backend/tests/test_grok_provider.py
+# 与 DeepSeek 共同的行为见 test_openai_compatible_providers.py
+import asyncio
+from typing import Any, List
+
+
+def test_identical_calls_on_same_account_share_one_request(make_grok_provider):
+    (first_provider, first_completions), (second_provider, second_completions) = (
+        make_grok_provider(api_key="gsk-shared"), make_grok_provider(api_key="gsk-shared")
+    )
+
+    async def _run() -> List[Any]:
+        return await asyncio.gather(first_provider.generate("你好", temperature=0), second_provider.generate("你好", temperature=0))
+
+    asyncio.run(_run())
+    assert len(first_completions.calls) + len(second_completions.calls) == 1
+
+
+def test_identical_calls_on_different_accounts_are_not_coalesced(make_grok_provider):
+    (first_provider, first_completions), (second_provider, second_completions) = make_grok_provider(), make_grok_provider()
+
+    async def _run() -> List[Any]:
+        return await asyncio.gather(first_provider.generate("你好", temperature=0), second_provider.generate("你好", temperature=0))
+
+    asyncio.run(_run())
+    assert len(first_completions.calls) == 1
+    assert len(second_completions.calls) == 1
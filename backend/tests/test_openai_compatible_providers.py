@@ -0,0 +1,82 @@
+# backend/tests/test_openai_compatible_providers.py
+# 兼容 OpenAI 接口的提供商 (DeepSeek / Grok) 的共同行为；提供商工厂见 conftest.make_openai_compatible_provider
+import asyncio
+from typing import Any, List
+
+import pytest
+
+from app.llm_providers.provider_utils import get_account_rate_limiters
+
+
+def test_identical_concurrent_calls_share_one_request(make_openai_compatible_provider):
+    provider, fake_completions = make_openai_compatible_provider()
+
+    async def _run() -> List[Any]:
+        return await asyncio.gather(*[provider.generate("你好", temperature=0) for _ in range(3)])
+
+    responses = asyncio.run(_run())
+    assert len(fake_completions.calls) == 1
+    assert {response.text for response in responses} == {"echo:你好|fp=None"}
+
+
+def test_token_rate_limiter_is_charged_actual_usage(make_openai_compatible_provider, fake_clock):
+    api_key = "sk-token-rate-test"
+    provider, fake_completions = make_openai_compatible_provider(api_key=api_key, rate_limit_tpm=60)
+    _, token_bucket = get_account_rate_limiters(provider.PROVIDER_TAG, provider.model_config.base_url, api_key, None, 60)
+
+    async def _run() -> None:
+        for _ in range(2):
+            await provider.generate("你好", temperature=0.7, max_tokens=4000)
+        await token_bucket.acquire(60)
+
+    asyncio.run(_run())
+    assert len(fake_completions.calls) == 2
+    # 只按 usage.total_tokens (每次 5) 计费而不是预留 max_tokens：两次调用后余额 50，再取满桶需等待 10 秒
+    assert fake_clock.sleeps == [pytest.approx(10.0)]
+
+
+class _RecordingEmbeddingClient:
+    """记录被向量化的文本；所有文本返回同一向量，只有 scope 能区分不同请求。"""
+
+    def __init__(self):
+        self.embedded_texts: List[str] = []
+
+    async def embed(self, text: str) -> List[float]:
+        self.embedded_texts.append(text)
+        return [1.0, 0.0]
+
+
+def test_semantic_cache_scopes_by_system_prompt_and_embeds_user_prompt_only(make_openai_compatible_provider):
+    pytest.importorskip("numpy")
+    from app.llm_providers.response_cache import SemanticResponseCache
+
+    embedding_client = _RecordingEmbeddingClient()
+    provider, fake_completions = make_openai_compatible_provider(semantic_cache=SemanticResponseCache(embedding_client))
+
+    async def _run() -> List[Any]:
+        return [
+            await provider.generate("第一章", system_prompt="文风指南A", temperature=0),
+            await provider.generate("第一章", system_prompt="文风指南B", temperature=0),
+            await provider.generate("第一章", system_prompt="文风指南A", temperature=0),
+        ]
+
+    responses = asyncio.run(_run())
+    # 不同系统提示下的相同用户提示不会相互命中；相同系统提示下的第三次调用命中语义缓存
+    assert len(fake_completions.calls) == 2
+    assert responses[2].text == responses[0].text
+    assert embedding_client.embedded_texts == ["第一章"] * 3
+
+
+def test_stream_override_is_buffered_into_one_response(make_openai_compatible_provider):
+    provider, fake_completions = make_openai_compatible_provider()
+    provider_module = make_openai_compatible_provider.provider_module
+
+    async def fake_generate_stream(*args: Any, **kwargs: Any) -> Any:
+        for text_part in ("你", "好"):
+            yield provider_module.LLMResponse(text_part, "test", 0, 0, 0, None, None)
+        yield provider_module.LLMResponse("", "test", 3, 2, 5, "stop", None)
+
+    provider.generate_stream = fake_generate_stream
+    response = asyncio.run(provider.generate("你好", temperature=0.7, llm_override_parameters={"stream": True}))
+    assert fake_completions.calls == []
+    assert (response.text, response.total_tokens, response.finish_reason) == ("你好", 5, "stop")
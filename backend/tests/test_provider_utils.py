@@ -0,0 +1,157 @@
+# backend/tests/test_provider_utils.py
+import asyncio
+
+import pytest
+
+from app.llm_providers.provider_utils import ESTIMATED_CHARS_PER_TOKEN, AsyncTokenBucket, DynamicBatcher, estimate_message_tokens
+
+
+def test_token_bucket_default_capacity_is_one_minute_of_budget(fake_clock):
+    bucket = AsyncTokenBucket(rate_per_minute=60000)
+
+    async def acquire_burst():
+        for _ in range(10):
+            await bucket.acquire(5000)
+
+    asyncio.run(acquire_burst())
+    assert bucket.capacity == 60000
+    assert fake_clock.sleeps == []
+
+
+def test_token_bucket_waits_when_budget_is_exhausted(fake_clock):
+    bucket = AsyncTokenBucket(rate_per_minute=60)
+
+    async def acquire_twice():
+        await bucket.acquire(60)
+        await bucket.acquire(30)
+
+    asyncio.run(acquire_twice())
+    assert fake_clock.sleeps == [pytest.approx(30.0)]
+
+
+def test_token_bucket_clamps_oversized_request_to_capacity(fake_clock):
+    bucket = AsyncTokenBucket(rate_per_minute=60, capacity=10)
+
+    async def acquire_oversized():
+        await bucket.acquire(10)
+        await bucket.acquire(1000)
+
+    asyncio.run(acquire_oversized())
+    assert fake_clock.sleeps == [pytest.approx(10.0)]
+
+
+def test_token_bucket_charge_settles_actual_usage(fake_clock):
+    bucket = AsyncTokenBucket(rate_per_minute=600)
+
+    async def reserve_then_settle():
+        await bucket.acquire(100)
+        bucket.charge(-100)
+        await bucket.acquire(600)
+        bucket.charge(120)
+        await bucket.acquire(60)
+
+    asyncio.run(reserve_then_settle())
+    # 退还后满桶放行 600；补扣 120 后余额为 -120，再取 60 需等待 (120 + 60) / 10 秒
+    assert fake_clock.sleeps == [pytest.approx(18.0)]
+
+
+def test_token_bucket_refund_does_not_exceed_capacity(fake_clock):
+    bucket = AsyncTokenBucket(rate_per_minute=60)
+
+    async def refund_then_acquire():
+        bucket.charge(-1000)
+        await bucket.acquire(60)
+        await bucket.acquire(6)
+
+    asyncio.run(refund_then_acquire())
+    # 超额退还被截断在容量内：满桶放行 60 后，再取 6 仍需等待 6 秒
+    assert fake_clock.sleeps == [pytest.approx(6.0)]
+
+
+def test_token_bucket_drain_forces_wait(fake_clock):
+    bucket = AsyncTokenBucket(rate_per_minute=60)
+    bucket.drain()
+    asyncio.run(bucket.acquire(6))
+    assert fake_clock.sleeps == [pytest.approx(6.0)]
+
+
+class _RecordingFlush:
+    """DynamicBatcher 的刷新回调替身：记录每批请求，并按顺序返回 item * 10。"""
+
+    def __init__(self, error: Exception = None):
+        self.batches = []
+        self.error = error
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        if self.error is not None:
+            raise self.error
+        return [item * 10 for item in items]
+
+
+def test_dynamic_batcher_splits_by_max_batch_size_and_keeps_order():
+    flush = _RecordingFlush()
+
+    async def submit_all():
+        batcher = DynamicBatcher(flush, max_batch_size=3, batch_window_ms=50)
+        return await asyncio.gather(*[batcher.submit(item) for item in range(7)])
+
+    assert asyncio.run(submit_all()) == [item * 10 for item in range(7)]
+    assert flush.batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_dynamic_batcher_flushes_after_window_without_full_batch():
+    flush = _RecordingFlush()
+
+    async def submit_single():
+        batcher = DynamicBatcher(flush, max_batch_size=8, batch_window_ms=5)
+        return await asyncio.wait_for(batcher.submit(4), timeout=1.0)
+
+    assert asyncio.run(submit_single()) == 40
+    assert flush.batches == [[4]]
+
+
+def test_dynamic_batcher_propagates_flush_error_to_every_caller():
+    flush = _RecordingFlush(error=ValueError("上游失败"))
+
+    async def submit_all():
+        batcher = DynamicBatcher(flush, max_batch_size=4, batch_window_ms=20)
+        return await asyncio.gather(*[batcher.submit(item) for item in range(3)], return_exceptions=True)
+
+    results = asyncio.run(submit_all())
+    assert [type(result) for result in results] == [ValueError] * 3
+    assert flush.batches == [[0, 1, 2]]
+
+
+def test_dynamic_batcher_rejects_mismatched_result_count():
+    async def short_flush(items):
+        return items[:-1]
+
+    async def submit_all():
+        batcher = DynamicBatcher(short_flush, max_batch_size=2, batch_window_ms=20)
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(submit_all())] == [RuntimeError, RuntimeError]
+
+
+class _CharacterEncoder:
+    """每个字符计为一个 token 的编码器替身。"""
+
+    def encode(self, text, disallowed_special=()):
+        return list(text)
+
+
+class _BrokenEncoder:
+    def encode(self, text, disallowed_special=()):
+        raise ValueError("无法编码")
+
+
+def test_estimate_message_tokens_uses_encoder_when_available():
+    messages = [{"role": "system", "content": "abc"}, {"role": "user", "content": "de"}, {"role": "user", "content": None}]
+    assert estimate_message_tokens(_CharacterEncoder(), messages) == 5
+
+
+def test_estimate_message_tokens_falls_back_to_character_count():
+    messages = [{"role": "user", "content": "x" * (ESTIMATED_CHARS_PER_TOKEN * 3)}]
+    assert estimate_message_tokens(None, messages) == 3
+    assert estimate_message_tokens(_BrokenEncoder(), messages) == 3
@@ -0,0 +1,159 @@
+# backend/tests/test_response_cache.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import schemas
+from app.llm_providers import response_cache
+from app.llm_providers.base_llm_provider import LLMResponse
+from app.llm_providers.response_cache import InMemoryLRUCacheBackend, LazyEmbeddingClient, SemanticResponseCache, build_response_cache_key, build_semantic_cache_scope
+
+
+BASE_API_PARAMS = {
+    "model": "deepseek-chat",
+    "messages": [{"role": "user", "content": "你好"}],
+    "temperature": 0,
+    "max_tokens": 256,
+}
+
+
+def test_cache_key_is_stable_for_identical_params():
+    assert build_response_cache_key(dict(BASE_API_PARAMS)) == build_response_cache_key(dict(BASE_API_PARAMS))
+
+
+def test_cache_key_ignores_param_order():
+    reordered_params = dict(reversed(list(BASE_API_PARAMS.items())))
+    assert build_response_cache_key(reordered_params) == build_response_cache_key(BASE_API_PARAMS)
+
+
+def test_cache_key_differs_by_penalties():
+    key_without_penalty = build_response_cache_key(BASE_API_PARAMS)
+    key_with_frequency_penalty = build_response_cache_key({**BASE_API_PARAMS, "frequency_penalty": 0.5})
+    key_with_presence_penalty = build_response_cache_key({**BASE_API_PARAMS, "presence_penalty": 0.5})
+    assert len({key_without_penalty, key_with_frequency_penalty, key_with_presence_penalty}) == 3
+    assert key_with_frequency_penalty != build_response_cache_key({**BASE_API_PARAMS, "frequency_penalty": 1.0})
+
+
+def test_cache_key_differs_by_logprobs():
+    key_without_logprobs = build_response_cache_key(BASE_API_PARAMS)
+    key_with_logprobs = build_response_cache_key({**BASE_API_PARAMS, "logprobs": True, "top_logprobs": 5})
+    assert key_without_logprobs != key_with_logprobs
+    assert key_with_logprobs != build_response_cache_key({**BASE_API_PARAMS, "logprobs": True, "top_logprobs": 3})
+
+
+def test_cache_key_ignores_transport_only_params():
+    streaming_params = {**BASE_API_PARAMS, "stream": True, "stream_options": {"include_usage": True}}
+    assert build_response_cache_key(streaming_params) == build_response_cache_key(BASE_API_PARAMS)
+
+
+def _make_response(text):
+    return LLMResponse(text, "deepseek/test", 1, 1, 2, "stop", None)
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_in_memory_backend_expires_entries_after_ttl(fake_clock):
+    backend = InMemoryLRUCacheBackend()
+
+    async def set_then_get():
+        await backend.set("key", _make_response("cached"), ttl_seconds=10)
+        fake_clock.now += 9.9
+        before_expiry = await backend.get("key")
+        fake_clock.now += 0.1
+        return before_expiry, await backend.get("key")
+
+    before_expiry, after_expiry = asyncio.run(set_then_get())
+    assert before_expiry.text == "cached"
+    assert after_expiry is None
+    assert "key" not in backend._entries
+
+
+def test_in_memory_backend_evicts_least_recently_used(fake_clock):
+    backend = InMemoryLRUCacheBackend(max_entries=2)
+
+    async def fill_and_touch():
+        await backend.set("a", _make_response("a"), ttl_seconds=60)
+        await backend.set("b", _make_response("b"), ttl_seconds=60)
+        await backend.get("a") # a 成为最近使用的条目
+        await backend.set("c", _make_response("c"), ttl_seconds=60)
+        return [await backend.get(key) for key in ("a", "b", "c")]
+
+    cached_a, cached_b, cached_c = asyncio.run(fill_and_touch())
+    assert (cached_a.text, cached_b, cached_c.text) == ("a", None, "c")
+
+
+def test_in_memory_backend_overwrite_refreshes_ttl(fake_clock):
+    backend = InMemoryLRUCacheBackend()
+
+    async def overwrite_then_get():
+        await backend.set("key", _make_response("old"), ttl_seconds=10)
+        fake_clock.now += 8
+        await backend.set("key", _make_response("new"), ttl_seconds=10)
+        fake_clock.now += 8
+        return await backend.get("key")
+
+    assert asyncio.run(overwrite_then_get()).text == "new"
+
+
+class _FakeEmbeddings:
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+def test_lazy_embedding_client_loads_model_once_on_first_embed():
+    load_calls = []
+
+    def load_embeddings():
+        load_calls.append(1)
+        return _FakeEmbeddings()
+
+    embedding_client = LazyEmbeddingClient(load_embeddings)
+    assert load_calls == []
+
+    async def embed_concurrently():
+        return await asyncio.gather(*[embedding_client.embed("abc") for _ in range(3)])
+
+    assert asyncio.run(embed_concurrently()) == [[3.0, 1.0]] * 3
+    assert load_calls == [1]
+
+
+def test_lazy_embedding_client_does_not_retry_failed_load():
+    load_calls = []
+
+    def load_embeddings():
+        load_calls.append(1)
+        raise RuntimeError("模型不可用")
+
+    embedding_client = LazyEmbeddingClient(load_embeddings)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            asyncio.run(embedding_client.embed("abc"))
+    assert load_calls == [1]
+
+
+def test_semantic_cache_is_built_only_when_enabled():
+    pytest.importorskip("numpy")
+    embedding_client = LazyEmbeddingClient(_FakeEmbeddings)
+    disabled_config = schemas.LLMProviderConfigSchema(provider_tag="deepseek")
+    assert SemanticResponseCache.from_provider_config(disabled_config, embedding_client) is None
+    no_ttl_config = schemas.LLMProviderConfigSchema(provider_tag="deepseek", enable_semantic_cache=True, cache_ttl_seconds=0)
+    assert SemanticResponseCache.from_provider_config(no_ttl_config, embedding_client) is None
+
+    enabled_config = schemas.LLMProviderConfigSchema(provider_tag="deepseek", enable_semantic_cache=True, cache_ttl_seconds=600, semantic_cache_threshold=0.8)
+    semantic_cache = SemanticResponseCache.from_provider_config(enabled_config, embedding_client)
+    assert semantic_cache is not None
+    assert (semantic_cache.ttl_seconds, semantic_cache.threshold, semantic_cache.embedding_client) == (600, 0.8, embedding_client)
+
+
+def test_semantic_scope_includes_system_prompt_but_not_messages():
+    api_params = {**BASE_API_PARAMS, "messages": [{"role": "user", "content": "第一章"}]}
+    other_prompt_params = {**BASE_API_PARAMS, "messages": [{"role": "user", "content": "第二章"}]}
+    assert build_semantic_cache_scope(api_params, "文风指南") == build_semantic_cache_scope(other_prompt_params, "文风指南")
+    assert build_semantic_cache_scope(api_params, "文风指南") != build_semantic_cache_scope(api_params, "人物设定")
+    assert build_semantic_cache_scope(api_params, "文风指南") != build_semantic_cache_scope({**api_params, "max_tokens": 512}, "文风指南")